@@ -55,6 +55,10 @@ class ACMContestController(ProgrammingContestController):
         super(ACMContestController, self). \
                 fill_evaluation_environ(environ, submission)
 
+    def use_fail_fast_evaluation(self, submission):
+        # Only the first failed test matters for the result.
+        return True
+
     def update_report_statuses(self, submission, queryset):
         self._activate_newest_report(submission, queryset,
             kind=['FULL', 'FAILURE'])
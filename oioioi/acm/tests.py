@@ -1,11 +1,18 @@
 from datetime import datetime
 import re
 
+from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
 from django.utils.timezone import utc
 
+from oioioi.acm.utils import acm_group_scorer, acm_score_aggregator
 from oioioi.base.tests import TestCase, fake_timezone_now
-from oioioi.contests.models import Contest
+from oioioi.contests.models import Contest, ProblemInstance, Submission, \
+        SubmissionReport
+from oioioi.participants.models import Participant
+from oioioi.programs.models import TestReport
+from oioioi.sinolpack.tests import get_test_filename
 
 # The following tests use full-contest fixture, which may be changed this way:
 # 1. Create new database, do migrate
@@ -115,7 +122,8 @@ class TestACMRanking(TestCase):
         with fake_timezone_now(datetime(2013, 12, 15, 0, 40, tzinfo=utc)):
             response = self.client.get(csv_url)
             self.assertEqual(response.status_code, 200)
-            self.assertEqual(response.content.count('\n'), 4)
+            self.assertEqual(
+                ''.join(response.streaming_content).count('\n'), 4)
 
             response = self.client.get(url)
             self.assertEqual(response.content.count('data-result_url'), 8)
@@ -138,3 +146,63 @@ class TestACMRanking(TestCase):
     def test_safe_exec_mode(self):
         contest = Contest.objects.get()
         self.assertEqual(contest.controller.get_safe_exec_mode(), 'cpu')
+
+
+class TestACMScorers(TestCase):
+    def test_skipped_tests(self):
+        group_results = acm_group_scorer({
+            '1a': {'status': 'OK'},
+            '1b': {'status': 'WA'},
+            '1c': {'status': 'SKIP'},
+        })
+        self.assertEqual(group_results[2], 'WA')
+        skipped = acm_group_scorer({'2a': {'status': 'SKIP'}})
+        self.assertEqual(skipped[2], 'SKIP')
+
+        score, max_score, status = acm_score_aggregator({
+            '1': {'status': 'WA'},
+            '2': {'status': 'SKIP'},
+        })
+        self.assertEqual(status, 'WA')
+        self.assertFalse(score.accepted)
+
+
+@override_settings(FAIL_FAST_FIRST_WAVE_SIZE=1)
+class TestACMFailFastJudging(TestCase):
+    fixtures = ['test_users', 'test_contest', 'test_full_package',
+                'test_problem_instance']
+
+    def _submit(self, **data):
+        contest = Contest.objects.get()
+        contest.controller_name = \
+                'oioioi.acm.controllers.ACMContestController'
+        contest.save()
+        user = User.objects.get(username='test_user')
+        Participant.objects.create(user=user, contest=contest)
+        self.client.login(username='test_user')
+        data['problem_instance_id'] = ProblemInstance.objects.get().id
+        response = self.client.post(reverse('submit',
+                kwargs={'contest_id': contest.id}), data)
+        self.assertEqual(response.status_code, 302)
+        submission = Submission.objects.get()
+        report = SubmissionReport.objects.get(submission=submission,
+                                              status='ACTIVE', kind='FULL')
+        statuses = dict(TestReport.objects.filter(submission_report=report)
+                        .values_list('test_name', 'status'))
+        return submission, statuses
+
+    def test_accepted(self):
+        # The tests are run in three waves.
+        submission, statuses = self._submit(
+                file=open(get_test_filename('sum-correct.cpp'), 'rb'))
+        self.assertEqual(submission.status, 'OK')
+        self.assertEqual(len(statuses), 6)
+        self.assertEqual(set(statuses.values()), set(['OK']))
+
+    def test_rejected(self):
+        submission, statuses = self._submit(
+                code='int main(void) { return 1; }', prog_lang='C')
+        self.assertEqual(submission.status, 'RE')
+        # Example tests are run first.
+        self.assertEqual(statuses.pop('0'), 'RE')
+        self.assertEqual(set(statuses.values()), set(['SKIP']))
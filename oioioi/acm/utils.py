@@ -2,13 +2,23 @@ from oioioi.acm.score import BinaryScore
 from oioioi.contests.utils import aggregate_statuses
 
 
+def _aggregate_statuses(statuses):
+    """Like :func:`~oioioi.contests.utils.aggregate_statuses`, but
+       ignores ``SKIP`` statuses of tests not run after a failed one.
+    """
+    judged = [status for status in statuses if status != 'SKIP']
+    if statuses and not judged:
+        return 'SKIP'
+    return aggregate_statuses(judged)
+
+
 def acm_test_scorer(test, result):
     status = result['result_code']
     return None, None, status
 
 
 def acm_group_scorer(test_results):
-    status = aggregate_statuses([result['status']
+    status = _aggregate_statuses([result['status']
             for result in test_results.itervalues()])
     return None, None, status
 
@@ -16,6 +26,6 @@ def acm_group_scorer(test_results):
 def acm_score_aggregator(group_results):
     if not group_results:
         return None, None, 'OK'
-    status = aggregate_statuses([result['status']
+    status = _aggregate_statuses([result['status']
             for result in group_results.itervalues()])
     return BinaryScore(status == 'OK'), BinaryScore(True), status
@@ -353,9 +353,18 @@ def request_cached(fn):
         if fn not in request._cache:
             request._cache[fn] = fn(request)
         return request._cache[fn]
+    cacher.cached_fn = fn
     return cacher
 
 
+def fill_request_cache(request, request_cached_fn, value):
+    """Sets the result of a function decorated by :fun:`request_cached`
+       for the request, unless it has been computed already."""
+    if not hasattr(request, '_cache'):
+        setattr(request, '_cache', {})
+    request._cache.setdefault(request_cached_fn.cached_fn, value)
+
+
 # Generating HTML
 
 
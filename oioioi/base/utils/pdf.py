@@ -10,7 +10,10 @@ from oioioi.base.utils.execute import execute
 from oioioi.filetracker.utils import stream_file
 
 
-def generate_pdf(tex_code, filename, extra_args=[], num_passes=3):
+def render_pdf(tex_code, extra_args=[], num_passes=3):
+    """Compiles ``tex_code`` with pdflatex and returns the resulting PDF
+       file, opened for reading.
+    """
     # Create temporary file and folder
     tmp_folder = tempfile.mkdtemp()
     try:
@@ -26,8 +29,12 @@ def generate_pdf(tex_code, filename, extra_args=[], num_passes=3):
         for _i in xrange(num_passes):
             execute(command, cwd=tmp_folder)
 
-        # Get PDF file contents
-        pdf_file = open(os.path.splitext(tex_path)[0] + '.pdf')
-        return stream_file(File(pdf_file), filename)
+        # The file stays readable after the folder is removed.
+        return open(os.path.splitext(tex_path)[0] + '.pdf', 'rb')
     finally:
         shutil.rmtree(tmp_folder)
+
+
+def generate_pdf(tex_code, filename, extra_args=[], num_passes=3):
+    pdf_file = render_pdf(tex_code, extra_args, num_passes)
+    return stream_file(File(pdf_file), filename)
@@ -12,6 +12,13 @@ from django.utils.timezone import utc
 from oioioi.base.tests import TestCase
 from oioioi.contests.models import Contest, Round, RoundTimeExtension
 from oioioi.contests.current_contest import ContestMode
+from oioioi.contests.utils import make_round_times
+from oioioi.programs.controllers import ProgrammingContestController
+
+
+class ExtendedRoundsContestController(ProgrammingContestController):
+    def get_round_times(self, request, round):
+        return make_round_times(round, extra_time=5)
 
 
 class TestClock(TestCase):
@@ -65,6 +72,22 @@ class TestClock(TestCase):
         self.assertEqual(round_start_date, time.mktime(r1_start.timetuple()))
         self.assertEqual(round_end_date, time.mktime(r1_end.timetuple()) + 600)
 
+    def test_countdown_with_controller_round_times(self):
+        contest = Contest.objects.get()
+        contest.controller_name = \
+                'oioioi.clock.tests.ExtendedRoundsContestController'
+        contest.save()
+        now = time.time()
+        r1_end = datetime.fromtimestamp(now + 10)
+        Round(contest=contest, start_date=datetime.fromtimestamp(now - 5),
+              end_date=r1_end).save()
+
+        response = self.client.get(reverse('get_status',
+            kwargs={'contest_id': contest.id}))
+        response = json.loads(response.content)
+        self.assertEqual(response['round_end_date'],
+                         time.mktime(r1_end.timetuple()) + 300)
+
     @override_settings(CONTEST_MODE=ContestMode.neutral)
     def test_admin_time(self):
         self.client.login(username='test_admin')
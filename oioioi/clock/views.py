@@ -7,14 +7,32 @@ from django.contrib import messages
 from django.http import Http404
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
+from oioioi.base.utils import fill_request_cache
 from oioioi.base.utils.redirect import safe_redirect
 
-from oioioi.contests.models import Round
+from oioioi.contests.models import Round, RoundTimeExtension
+from oioioi.contests.utils import make_round_times, rounds_times
 from oioioi.status.registry import status_registry
+from oioioi.status.utils import get_contest_status_data
 from oioioi.su.utils import is_real_superuser
 
 ONE_DAY = timedelta(days=1)
 
+
+def _get_rounds(contest):
+    """Returns the rounds of the contest and a dict mapping user ids to
+       dicts of their round time extensions (in minutes) by round ids.
+    """
+    rounds = list(Round.objects.filter(contest=contest)
+                  .select_related('contest'))
+    extra_times = {}
+    for user_id, round_id, extra_time in RoundTimeExtension.objects \
+            .filter(round__contest=contest) \
+            .values_list('user_id', 'round_id', 'extra_time'):
+        extra_times.setdefault(user_id, {})[round_id] = extra_time
+    return rounds, extra_times
+
+
 @status_registry.register
 def get_times_status(request, response):
     """Extends the response dictionary with rounds times.
@@ -26,6 +44,10 @@ def get_times_status(request, response):
        ``round_end_date`` the number of seconds between the epoch
        and the end of the current round if any exists; otherwise 0
        ``is_admin_time_set``: ``True`` if admin changes the time
+
+       The rounds of the contest are shared by all its users (see
+       :func:`~oioioi.status.utils.get_contest_status_data`), but their times
+       are still determined by the contest controller.
     """
     timestamp = getattr(request, 'timestamp', None)
     contest = getattr(request, 'contest', None)
@@ -40,8 +62,17 @@ def get_times_status(request, response):
     current_rounds_times = None
 
     if timestamp and contest:
+        rounds, extra_times = get_contest_status_data(contest, 'rounds',
+                                                      _get_rounds)
+        user_extra_times = extra_times.get(request.user.id, {})
+        # The default ContestController.get_round_times uses rounds_times,
+        # so it doesn't have to query the database then.
+        fill_request_cache(request, rounds_times, dict(
+                (round, make_round_times(round,
+                                         user_extra_times.get(round.id, 0)))
+                for round in rounds))
         rtimes = [(contest.controller.get_round_times(request, round), round)
-                  for round in Round.objects.filter(contest=contest)]
+                  for round in rounds]
         next_rounds_times = [(rt, round) for (rt, round)
                              in rtimes if rt.is_future(timestamp) and not rt.is_hidden() and rt.get_start() <= timestamp + ONE_DAY]
         next_rounds_times.sort(key=lambda (rt, round): rt.get_start())
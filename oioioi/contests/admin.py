@@ -12,6 +12,7 @@ from django.shortcuts import redirect, render
 from django.utils.translation import ugettext_lazy as _, ungettext_lazy
 from django.utils.html import conditional_escape
 from django.utils.encoding import force_unicode
+from django.db import transaction
 from django.db.models import Value
 from django.db.models.functions import Coalesce
 
@@ -26,6 +27,7 @@ from oioioi.contests.models import Contest, Round, ProblemInstance, \
         submission_kinds, ContestLink, SubmissionReport
 from oioioi.contests.utils import is_contest_admin, is_contest_observer
 from oioioi.contests.current_contest import set_cc_id
+from oioioi.evalmgr.tasks import rejudge_in_background
 from oioioi.programs.models import Test, TestReport
 from oioioi.problems.models import ProblemSite, ProblemPackage
 from staszic.pd.permissions import has_personal_data_pass
@@ -497,6 +499,8 @@ class SubmissionAdmin(admin.ModelAdmin):
         ]
         return urls + super(SubmissionAdmin, self).get_urls()
 
+    # The rejudge batch must be committed before its job starts.
+    @transaction.non_atomic_requests
     def rejudge_view(self, request):
         tests = request.POST.getlist('tests', [])
         subs_ids = [int(x) for x in request.POST.getlist('submissions', [])]
@@ -511,13 +515,16 @@ class SubmissionAdmin(admin.ModelAdmin):
                 break
 
         if all_reports_exist or rejudge_type == 'FULL':
-            for sub in submissions.values():
-                sub.problem_instance.controller.judge(sub,
-                                 is_rejudge=True,
-                                 extra_args={'tests_to_judge': tests,
-                                             'rejudge_type': rejudge_type})
-
             counter = len(submissions)
+            rejudge_in_background(sorted(submissions),
+                    extra_args={'tests_to_judge': tests,
+                                'rejudge_type': rejudge_type},
+                    contest=request.contest, created_by=request.user,
+                    description=ungettext_lazy(
+                        "%(counter)d selected submission",
+                        "%(counter)d selected submissions",
+                        counter) % {'counter': counter})
+
             self.message_user(
                 request,
                 ungettext_lazy("Queued one submission for rejudge.",
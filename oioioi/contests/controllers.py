@@ -1,3 +1,4 @@
+from collections import defaultdict
 from datetime import timedelta
 import logging
 
@@ -27,6 +28,11 @@ from oioioi.problems.controllers import ProblemController
 logger = logging.getLogger(__name__)
 
 
+# Number of (user, problem instance) pairs, whose round and contest results
+# are recalculated together by ContestController.update_user_results_bulk
+BULK_UPDATE_CHUNK_SIZE = 500
+
+
 def export_entries(registry, values):
     result = []
     for value, description in registry.entries:
@@ -640,6 +646,94 @@ class ContestController(RegisteredSubclassesBase, ObjectWithMixins):
             self.update_user_result_for_contest(result)
             result.save()
 
+    def _is_method_overridden(self, name):
+        return getattr(type(self), name).__func__ is not \
+            getattr(ContestController, name).__func__
+
+    def update_user_results_bulk(self, users_and_problems):
+        """Like :meth:`update_user_results`, but for many
+           ``(user, problem_instance)`` pairs at once.
+
+           Results for problems are still updated one by one, but results
+           for rounds and for the contest are recalculated only once per user
+           (and round), and if the default aggregation is used, the scores
+           are fetched with grouped queries.
+        """
+        users_and_problems = sorted(set(users_and_problems),
+                key=lambda pair: (pair[0].id, pair[1].id))
+        for i in xrange(0, len(users_and_problems), BULK_UPDATE_CHUNK_SIZE):
+            chunk = users_and_problems[i:i + BULK_UPDATE_CHUNK_SIZE]
+            for user, problem_instance in chunk:
+                problem_instance.problem.controller \
+                        .update_user_results(user, problem_instance)
+            users_and_rounds = set((user.id, pi.round_id)
+                                   for user, pi in chunk
+                                   if pi.round_id is not None)
+            self._update_user_results_for_rounds(users_and_rounds)
+            self._update_user_results_for_contest(
+                    set(user_id for user_id, _round_id in users_and_rounds))
+
+    def _update_user_results_for_rounds(self, users_and_rounds):
+        users_ids = set(user_id for user_id, _round_id in users_and_rounds)
+        rounds_ids = set(round_id for _user_id, round_id in users_and_rounds)
+        with transaction.atomic():
+            results = dict(((r.user_id, r.round_id), r) for r in
+                    UserResultForRound.objects.select_for_update()
+                    .filter(user_id__in=users_ids, round_id__in=rounds_ids)
+                    .order_by('id'))
+            for user_id, round_id in users_and_rounds:
+                if (user_id, round_id) not in results:
+                    results[user_id, round_id] = UserResultForRound.objects \
+                        .select_for_update() \
+                        .get_or_create(user_id=user_id, round_id=round_id)[0]
+
+            if self._is_method_overridden('update_user_result_for_round'):
+                for key in users_and_rounds:
+                    self.update_user_result_for_round(results[key])
+                    results[key].save()
+                return
+
+            scores = defaultdict(list)
+            for user_id, round_id, score in UserResultForProblem.objects \
+                    .filter(user_id__in=users_ids,
+                            problem_instance__round_id__in=rounds_ids) \
+                    .values_list('user_id', 'problem_instance__round_id',
+                                 'score'):
+                scores[user_id, round_id].append(score)
+            for key in users_and_rounds:
+                results[key].score = self._sum_scores(scores[key])
+                results[key].save()
+
+    def _update_user_results_for_contest(self, users_ids):
+        with transaction.atomic():
+            results = dict((r.user_id, r) for r in
+                    UserResultForContest.objects.select_for_update()
+                    .filter(user_id__in=users_ids, contest=self.contest)
+                    .order_by('id'))
+            for user_id in users_ids:
+                if user_id not in results:
+                    results[user_id] = UserResultForContest.objects \
+                        .select_for_update() \
+                        .get_or_create(user_id=user_id,
+                                       contest=self.contest)[0]
+
+            if self._is_method_overridden('update_user_result_for_contest'):
+                for user_id in users_ids:
+                    self.update_user_result_for_contest(results[user_id])
+                    results[user_id].save()
+                return
+
+            scores = defaultdict(list)
+            for user_id, score in UserResultForRound.objects \
+                    .filter(user_id__in=users_ids,
+                            round__contest=self.contest,
+                            round__is_trial=False) \
+                    .values_list('user_id', 'score'):
+                scores[user_id].append(score)
+            for user_id in users_ids:
+                results[user_id].score = self._sum_scores(scores[user_id])
+                results[user_id].save()
+
     def filter_my_visible_submissions(self, request, queryset):
         """Returns the submissions which the user should see in the
            "My submissions" view.
@@ -11,6 +11,7 @@ from django.db import transaction
 from oioioi.base.utils.db import require_transaction
 from oioioi.contests.models import ProblemInstance, Submission, \
         SubmissionReport, FailureReport
+from oioioi.evalmgr.tasks import defer_user_results_update
 from django.conf import settings
 from datetime import datetime
 logger = logging.getLogger(__name__)
@@ -98,7 +99,13 @@ def update_user_results(env, **kwargs):
             assert 'round_id' not in env
             assert 'contest_id' not in env
 
-    problem_instance.controller.update_user_results(user, problem_instance)
+    if env.get('is_rejudge') and settings.DEFERRED_USER_RESULTS_DELAY:
+        # Many submissions of the user may be rejudged at once, so let's
+        # update the results once for all of them.
+        defer_user_results_update(user, problem_instance)
+    else:
+        problem_instance.controller.update_user_results(user,
+                                                        problem_instance)
 
     return env
 
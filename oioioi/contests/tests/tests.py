@@ -22,13 +22,13 @@ from oioioi.base.tests import TestCase, check_not_accessible, fake_time, \
 from oioioi.contests.models import Contest, Round, ProblemInstance, \
         UserResultForContest, Submission, ContestAttachment, \
         RoundTimeExtension, ContestPermission, UserResultForProblem, \
-        ContestView, ContestLink, ProblemStatementConfig
+        ContestView, ContestLink, ProblemStatementConfig, UserResultForRound
 from oioioi.contests.scores import IntegerScore, ScoreValue
 from oioioi.contests.date_registration import date_registry
 from oioioi.contests.utils import is_contest_admin, is_contest_observer, \
         can_enter_contest, rounds_times, can_see_personal_data, \
         administered_contests, all_public_results_visible, \
-        all_non_trial_public_results_visible
+        all_non_trial_public_results_visible, update_user_results_bulk
 from oioioi.contests.current_contest import ContestMode
 from oioioi.contests.tests import SubmitFileMixin
 from oioioi.filetracker.tests import TestStreamingMixin
@@ -416,6 +416,29 @@ class TestContestController(TestCase):
         contest = Contest.objects.get()
         self.assertEqual(contest.controller.get_safe_exec_mode(), 'vcpu')
 
+    def test_update_user_results_bulk(self):
+        user = User.objects.get(username='test_user')
+        pi = ProblemInstance.objects.get(pk=1)
+        UserResultForProblem.objects.all().delete()
+        UserResultForRound.objects.all().delete()
+        UserResultForContest.objects.all().delete()
+
+        update_user_results_bulk([(user, pi), (user, pi)])
+
+        urp = UserResultForProblem.objects.get(user=user, problem_instance=pi)
+        urr = UserResultForRound.objects.get(user=user, round=pi.round)
+        urc = UserResultForContest.objects.get(user=user, contest=pi.contest)
+        self.assertEqual(urp.score, IntegerScore(34))
+        self.assertEqual(urr.score, IntegerScore(34))
+        self.assertEqual(urc.score, IntegerScore(34))
+
+        Submission.objects.update(kind='IGNORED')
+        update_user_results_bulk([(user, pi)])
+        urp = UserResultForProblem.objects.get(user=user, problem_instance=pi)
+        urc = UserResultForContest.objects.get(user=user, contest=pi.contest)
+        self.assertIsNone(urp.score)
+        self.assertIsNone(urc.score)
+
 
 class TestContestViews(TestCase):
     fixtures = ['test_users', 'test_contest', 'test_full_package',
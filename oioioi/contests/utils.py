@@ -100,11 +100,18 @@ def generic_rounds_times(request=None, contest=None):
         rtexts = dict((x['round_id'], x) for x in RoundTimeExtension.objects
                       .filter(user=request.user, round__id__in=rids).values())
 
-    return dict((r, RoundTimes(r.start_date, r.end_date, r.contest,
-        r.results_date, r.public_results_date,
+    return dict((r, make_round_times(r,
         rtexts[r.id]['extra_time'] if r.id in rtexts else 0)) for r in rounds)
 
 
+def make_round_times(round, extra_time=0):
+    """Returns the :class:`RoundTimes` of the round for a user, whose time
+       was extended by ``extra_time`` minutes.
+    """
+    return RoundTimes(round.start_date, round.end_date, round.contest,
+        round.results_date, round.public_results_date, extra_time)
+
+
 @request_cached
 def rounds_times(request):
     return generic_rounds_times(request)
@@ -220,6 +227,25 @@ def contests_by_registration_controller():
     return rcontrollers
 
 
+def update_user_results_bulk(users_and_problems):
+    """Updates results of many ``(user, problem_instance)`` pairs.
+
+       Pairs are grouped by contests, so that
+       :meth:`~oioioi.contests.controllers.ContestController.update_user_results_bulk`
+       is called once per contest.
+    """
+    by_contest = defaultdict(list)
+    for user, problem_instance in users_and_problems:
+        if problem_instance.contest_id is None:
+            problem_instance.controller.update_user_results(user,
+                                                            problem_instance)
+        else:
+            by_contest[problem_instance.contest_id].append(
+                    (user, problem_instance))
+    for pairs in by_contest.itervalues():
+        pairs[0][1].contest.controller.update_user_results_bulk(pairs)
+
+
 @request_cached
 def visible_contests(request):
     visible = set()
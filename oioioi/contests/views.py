@@ -5,6 +5,7 @@ from django.contrib import messages
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied, SuspiciousOperation
 from django.core.urlresolvers import reverse
+from django.db import transaction
 from django.db.models import Q
 from django.http import HttpResponseRedirect, HttpResponse
 from django.shortcuts import get_object_or_404, redirect
@@ -28,6 +29,7 @@ from oioioi.contests.utils import visible_contests, can_enter_contest, \
         can_see_personal_data, is_contest_admin, has_any_submittable_problem, \
         visible_rounds, visible_problem_instances, contest_exists, \
         is_contest_observer, get_submission_or_error, can_admin_contest
+from oioioi.evalmgr.tasks import rejudge_in_background
 from oioioi.filetracker.utils import stream_file
 from oioioi.problems.models import ProblemStatement, ProblemAttachment
 from oioioi.problems.utils import query_statement, query_zip, \
@@ -392,15 +394,20 @@ def user_info_redirect_view(request):
                         'user_id': user.id}))
 
 
+# The rejudge batch must be committed before its job starts.
+@transaction.non_atomic_requests
 @enforce_condition(contest_exists & is_contest_admin)
 def rejudge_all_submissions_for_problem_view(request, problem_instance_id):
     problem_instance = get_object_or_404(ProblemInstance,
                                          id=problem_instance_id)
     count = problem_instance.submission_set.count()
     if request.POST:
-        for submission in problem_instance.submission_set.all():
-            problem_instance.controller.judge(submission, request.GET.dict(),
-                                              is_rejudge=True)
+        rejudge_in_background(
+                problem_instance.submission_set.order_by('id')
+                    .values_list('id', flat=True),
+                extra_args=request.GET.dict(), contest=request.contest,
+                created_by=request.user,
+                description=_("All submissions for %s") % problem_instance)
         messages.info(request,
                       ungettext_lazy("%(count)d rejudge request received.",
                       "%(count)d rejudge requests reveived.",
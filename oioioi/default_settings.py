@@ -13,7 +13,7 @@ djcelery.setup_loader()
 import oioioi
 from oioioi.contests.current_contest import ContestMode
 
-INSTALLATION_CONFIG_VERSION = 22
+INSTALLATION_CONFIG_VERSION = 24
 
 DEBUG = False
 INTERNAL_IPS = ('127.0.0.1',)
@@ -244,9 +244,32 @@ NOSE_ARGS = (
 )
 
 SIOWORKERS_BACKEND = 'oioioi.sioworkers.backends.SioworkersdBackend'
+# Number of worker processes running jobs concurrently, when
+# oioioi.sioworkers.backends.LocalBackend is used. 1 means that jobs are run
+# one by one in the calling process.
+LOCAL_BACKEND_CONCURRENCY = 1
 FILETRACKER_CLIENT_FACTORY = 'oioioi.filetracker.client.media_root_factory'
 DEFAULT_FILE_STORAGE = 'oioioi.filetracker.storage.FiletrackerStorage'
 
+# Store identical files matching FILETRACKER_DEDUPLICATED_NAMES (a regular
+# expression) only once (see oioioi.filetracker.storage.FiletrackerStorage).
+# Use the "deduplicatefiles" management command to deduplicate files stored
+# before enabling this.
+FILETRACKER_DEDUPLICATION = False
+FILETRACKER_DEDUPLICATED_NAMES = r'^problems/\d+/[^/]+\.(in|out)$'
+
+# Directory, in which files read from Filetracker are cached (None disables
+# the cache), and the maximum total size of the cached files in bytes. The
+# "filetrackercache" management command shows the cache statistics.
+FILETRACKER_READ_CACHE_ROOT = None
+FILETRACKER_READ_CACHE_SIZE = 1024 * 1024 * 1024
+# Set to 'X-Sendfile' (Apache with mod_xsendfile, lighttpd) or
+# 'X-Accel-Redirect' (nginx) to let the web server send the files from
+# FILETRACKER_READ_CACHE_ROOT. For nginx, FILETRACKER_SENDFILE_URL should be
+# an internal location aliased to FILETRACKER_READ_CACHE_ROOT.
+FILETRACKER_SENDFILE_HEADER = None
+FILETRACKER_SENDFILE_URL = '/filetracker-cache/'
+
 SUPERVISOR_AUTORELOAD_PATTERNS = [".py", ".pyc", ".pyo"]
 
 # For linaro_django_pagination
@@ -298,6 +321,20 @@ USE_UNSAFE_CHECKER = True
 # execution (in a sandboxed environment, if USE_UNSAFE_EXEC is set to False).
 USE_SINOLPACK_MAKEFILES = True
 
+# Number of threads uploading test files concurrently, when a sinol package
+# is unpacked
+SINOLPACK_UPLOAD_CONCURRENCY = 8
+
+# Number of threads downloading submissions' sources concurrently, and
+# the number of sources kept in memory at once, when building an archive of
+# submissions in oioioi.exportszu
+EXPORTSZU_DOWNLOAD_CONCURRENCY = 8
+EXPORTSZU_DOWNLOAD_BATCH_SIZE = 500
+
+# Number of users, whose results are loaded at once, when a printing report
+# is generated in oioioi.oireports
+OIREPORTS_CHUNK_SIZE = 100
+
 # Scorers below are used for judging submissions without contests,
 # eg. submitting to problems from problemset.
 DEFAULT_TEST_SCORER = \
@@ -307,6 +344,25 @@ DEFAULT_GROUP_SCORER = \
 DEFAULT_SCORE_AGGREGATOR = \
     'oioioi.programs.utils.sum_score_aggregator'
 
+# In the fail-fast evaluation mode (used e.g. in ACM contests), tests are
+# sent to workers in waves, the first one of this size and every next one
+# twice as big. Evaluation stops after the first wave with a failed test.
+FAIL_FAST_FIRST_WAVE_SIZE = 5
+
+# Stop evaluating the tests of a group after one of them fails, if the group
+# is scored by its worst test (see use_group_short_circuiting in
+# ProgrammingContestController). Tests are sent to workers in waves of this
+# size in every group, every next one twice as big.
+GROUP_SHORT_CIRCUIT_EVALUATION = False
+GROUP_SHORT_CIRCUIT_FIRST_WAVE_SIZE = 2
+
+# Maximum total size in bytes of the compiled binaries kept in Filetracker
+# and reused for identical compilations, e.g. in rejudges (0 disables the
+# cache). The least recently used binaries are removed first, but not those
+# used in the last COMPILE_CACHE_MIN_AGE seconds, as they may still be tested.
+COMPILE_CACHE_SIZE = 0
+COMPILE_CACHE_MIN_AGE = 60 * 60
+
 # Upper bounds for tests' time [ms] and memory [KiB] limits.
 MAX_TEST_TIME_LIMIT_PER_PROBLEM = 1000 * 60 * 60 * 30
 MAX_MEMORY_LIMIT_FOR_TEST = 256 * 1024
@@ -391,17 +447,61 @@ CELERY_IMPORTS += [
 
 CELERY_ROUTES.update({
     'oioioi.evalmgr.tasks.evalmgr_job': dict(queue='evalmgr'),
+    'oioioi.evalmgr.tasks.update_deferred_user_results':
+        dict(queue='evalmgr'),
     'oioioi.problems.unpackmgr.unpackmgr_job': dict(queue='unpackmgr'),
 })
 
 # Number of concurrently evaluated submissions
 EVALMGR_CONCURRENCY = 1
 
+# Evaluation lanes (see oioioi.evalmgr.lanes): every evaluated environ is
+# sent to the Celery queue of the first matching lane. The lanes' workers
+# share EVALMGR_CONCURRENCY proportionally to the weights. If it's lower than
+# the number of queues, a single worker consumes all of them.
+EVALMGR_LANES = [
+    # (queue, condition, weight)
+    ('evalmgr-packages', 'oioioi.evalmgr.lanes.is_model_solution', 1),
+    ('evalmgr-rejudge', 'oioioi.evalmgr.lanes.is_rejudge', 2),
+    ('evalmgr-testrun', 'oioioi.evalmgr.lanes.is_testrun', 2),
+    ('evalmgr', None, 5),
+]
+
+# Bulk rejudges (see oioioi.evalmgr.models.RejudgeBatch) queue at most
+# REJUDGE_BATCH_CHUNK_SIZE submissions every REJUDGE_BATCH_INTERVAL seconds,
+# and only while there are less than REJUDGE_BATCH_MAX_ACTIVE_JOBS jobs in
+# the evaluation queue. The batches are processed in the REJUDGE_BATCH_QUEUE
+# Celery queue, which should be consumed by one of the EVALMGR_LANES.
+REJUDGE_BATCH_CHUNK_SIZE = 50
+REJUDGE_BATCH_INTERVAL = 5  # seconds
+REJUDGE_BATCH_MAX_ACTIVE_JOBS = 200
+REJUDGE_BATCH_QUEUE = 'evalmgr-rejudge'
+
+# Dictionaries of per-test data, which are saved separately from the rest
+# of environ, when a job is transferred
+EVALMGR_SAVED_ENVIRON_SEPARATE_KEYS = ['tests', 'test_results']
+
+# Log the size of environ after every phase of evaluation
+EVALMGR_LOG_ENVIRON_SIZE = False
+
 # Number of concurrently processed problem packages
 UNPACKMGR_CONCURRENCY = 1
 
 SIOWORKERSD_URL = 'http://localhost:7889/'
 
+# Maximum number of persistent connections to sioworkersd kept by every
+# process
+SIOWORKERSD_CONNECTION_POOL_SIZE = 4
+
+# Asynchronous jobs sent concurrently by many threads of a process are
+# batched into a single system.multicall RPC (sioworkersd must support it).
+# Set to 1 to disable batching.
+SIOWORKERSD_MAX_BATCH_SIZE = 1
+
+# Time (in seconds) for which the first asynchronous job waits for others
+# to be sent in the same batch
+SIOWORKERSD_BATCH_DELAY = 0.05
+
 # ID of JotForm account for "Send Feedback" link.
 JOTFORM_ID = None
 
@@ -449,11 +549,21 @@ CACHES = {
     }
 }
 
+# Results of users for rejudged submissions are updated in batches, at most
+# this long after the rejudge. Set to 0 to update them immediately.
+DEFERRED_USER_RESULTS_DELAY = 10  # seconds
+
 # Ranking
 RANKINGSD_POLLING_INTERVAL = 0.5  # seconds
 RANKING_COOLDOWN_FACTOR = 2  # seconds
 RANKING_MIN_COOLDOWN = 5  # seconds
 RANKING_MAX_COOLDOWN = 100  # seconds
+# Patch the previously generated ranking when only some results have changed,
+# instead of rebuilding it from scratch.
+RANKING_INCREMENTAL_RECALCULATION = True
+# Recalculations running longer than that are assumed to belong to crashed
+# rankingsd workers and are taken over by other workers.
+RANKING_RECALC_TIMEOUT = 600  # seconds
 
 # Notifications configuration (client)
 # This one is for JavaScript socket.io client.
@@ -480,6 +590,18 @@ BALLOON_ACCESS_COOKIE_EXPIRES_DAYS = 7
 # admins or observers.
 LIVEDATA_CACHE_TIMEOUT = 30
 
+# The livedata events of a round are kept in an append-only log, which is
+# rebuilt from scratch every LIVEDATA_EVENTS_LOG_TIMEOUT seconds. When it's
+# updated, reports created during the last LIVEDATA_EVENTS_OVERLAP seconds
+# are checked again, as they may have been committed out of order.
+# The events are stored in chunks of at most LIVEDATA_EVENTS_CHUNK_SIZE, and
+# the log is updated by one process at a time, which may hold the lock for
+# at most LIVEDATA_EVENTS_LOCK_TIMEOUT seconds.
+LIVEDATA_EVENTS_LOG_TIMEOUT = 3600
+LIVEDATA_EVENTS_OVERLAP = 60
+LIVEDATA_EVENTS_CHUNK_SIZE = 500
+LIVEDATA_EVENTS_LOCK_TIMEOUT = 60
+
 # Submissions by (snail) mail
 MAILSUBMIT_CONFIRMATION_HASH_LENGTH = 5
 
@@ -501,10 +623,18 @@ MAINTENANCE_MODE_IGNORE_URLS = [
     CONTEST_PREFIX_RE + '/logout/$',
 ]
 
+# Contest-wide and per-user parts of the status (see oioioi.status) are
+# cached for at most this many seconds.
+STATUS_CACHE_TIMEOUT = 60
+
 # Domain to use for serving IP to hostname mappings
 # using ./manage.py ipauth-dnsserver
 IPAUTH_DNSSERVER_DOMAIN = None
 
+# IP autoauth mappings are cached in memory of every process and reloaded
+# when they change, or after this many seconds.
+IPDNSAUTH_MAPPINGS_MAX_AGE = 60
+
 # Judging priority and weight settings
 DEFAULT_CONTEST_PRIORITY = 10
 DEFAULT_CONTEST_WEIGHT = 1000
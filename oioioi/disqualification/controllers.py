@@ -254,6 +254,14 @@ class WithDisqualificationRankingControllerMixin(object):
 
         return qs
 
+    def _get_page_template_names(self, key):
+        names = super(WithDisqualificationRankingControllerMixin, self) \
+            ._get_page_template_names(key)
+        if self._show_disqualified(key):
+            # It extends the default ranking template.
+            names = names + ['disqualification/default-ranking.html']
+        return names
+
     def _render_ranking_page(self, key, data, page):
         if not self._show_disqualified(key):
             return super(WithDisqualificationRankingControllerMixin, self) \
@@ -285,14 +293,34 @@ class WithDisqualificationRankingControllerMixin(object):
             return data
         return self._annotate_disqualified(key, data)
 
+    def serialize_ranking_for_export(self, key):
+        data = super(WithDisqualificationRankingControllerMixin, self) \
+            .serialize_ranking_for_export(key)
+        if not self._show_disqualified(key):
+            return data
+        return self._annotate_disqualified(key, data)
+
+    def update_serialized_ranking(self, key, data, changes):
+        data = super(WithDisqualificationRankingControllerMixin, self) \
+            .update_serialized_ranking(key, data, changes)
+        if data is None or not self._show_disqualified(key):
+            return data
+        users_ids = set(user_id for user_id, _pi_id in changes)
+        self._annotate_disqualified_rows([row for row in data['rows']
+                                          if row['user'].id in users_ids])
+        return data
+
     def _annotate_disqualified(self, key, data):
-        users_ids = [row['user'].id for row in data['rows']]
+        self._annotate_disqualified_rows(data['rows'])
+        return data
+
+    def _annotate_disqualified_rows(self, rows):
+        users_ids = [row['user'].id for row in rows]
         not_disqualified = self.contest.controller \
             .exclude_disqualified_users(User.objects.filter(id__in=users_ids))
 
-        for row in data['rows']:
+        for row in rows:
             row['disqualified'] = row['user'] not in not_disqualified
-        return data
 
     def _ignore_in_ranking_places(self, data_row):
         prev = super(WithDisqualificationRankingControllerMixin, self) \
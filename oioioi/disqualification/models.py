@@ -2,9 +2,12 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxLengthValidator
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from oioioi.base.utils.validators import validate_whitespaces
 from oioioi.contests.models import Submission, Contest
+from oioioi.rankings.models import Ranking
 
 
 class Disqualification(models.Model):
@@ -34,3 +37,10 @@ class Disqualification(models.Model):
             assert self.user.id == self.submission.user_id
 
         super(Disqualification, self).save(*args, **kwargs)
+
+
+@receiver([post_save, post_delete], sender=Disqualification)
+def _disqualification_changed(sender, instance, **kwargs):
+    # Disqualified users are excluded from the rankings, which can't be
+    # updated incrementally then.
+    Ranking.invalidate_contest(instance.contest_id)
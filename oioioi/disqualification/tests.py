@@ -7,6 +7,7 @@ from pytz import utc
 from oioioi.base.tests import TestCase, fake_time
 from oioioi.contests.models import Contest, Submission
 from oioioi.disqualification.models import Disqualification
+from oioioi.rankings.models import Ranking
 
 
 def _disqualify_contestwide():
@@ -108,6 +109,21 @@ class TestContestController(TestCase):
         self.assertNotIn(user, controller.exclude_disqualified_users(
             User.objects.all()))
 
+    def test_rankings_invalidated(self):
+        ranking = Ranking.objects.create(contest=Contest.objects.get(),
+                                         key='admin#c')
+
+        def assertInvalidated(action):
+            Ranking.objects.update(needs_recalculation=False,
+                                   needs_full_recalculation=False)
+            action()
+            ranking.refresh_from_db()
+            self.assertTrue(ranking.needs_recalculation)
+            self.assertTrue(ranking.needs_full_recalculation)
+
+        assertInvalidated(_disqualify_contestwide)
+        assertInvalidated(Disqualification.objects.all().delete)
+
 
 class TestViews(TestCase):
     fixtures = ["test_contest", "test_users", "test_full_package",
@@ -210,10 +226,11 @@ class TestViews(TestCase):
         self.client.login(username="test_admin")
         with fake_time(datetime(2015, 1, 1, tzinfo=utc)):
             response = self.client.get(url)
-            self.assertContains(response, "Test")
-            self.assertContains(response, "Disqualified")
-            self.assertContains(response, "Yes")
-            self.assertContains(response, "34")
+            content = ''.join(response.streaming_content)
+            self.assertIn("Test", content)
+            self.assertIn("Disqualified", content)
+            self.assertIn("Yes", content)
+            self.assertIn("34", content)
 
     def test_user_info_page(self):
         self.client.login(username='test_admin')
@@ -4,6 +4,7 @@ from django.utils.translation import ugettext_lazy as _
 from django.core.urlresolvers import reverse
 from django.contrib.admin import SimpleListFilter
 from django.utils.encoding import force_unicode
+from django.utils import timezone
 from django.db import transaction
 from djcelery.models import TaskState
 
@@ -13,7 +14,7 @@ from oioioi.base.utils import make_html_link
 from oioioi.contests.admin import contest_site
 from oioioi.contests.menu import contest_admin_menu_registry
 from oioioi.contests.utils import is_contest_admin
-from oioioi.evalmgr.models import QueuedJob
+from oioioi.evalmgr.models import QueuedJob, RejudgeBatch
 
 
 class UserListFilter(SimpleListFilter):
@@ -102,10 +103,11 @@ def _require_contest(function):
 
 class SystemJobsQueueAdmin(admin.ModelAdmin):
     list_display = ['submit_id', 'colored_state', 'contest',
-                    'problem_instance', 'user', 'creation_date',
+                    'problem_instance', 'user', 'creation_date', 'queue',
                     'celery_task_id_link']
-    list_filter = ['state', ProblemNameListFilter]
+    list_filter = ['state', 'queue', ProblemNameListFilter]
     actions = ['remove_from_queue', 'delete_selected']
+    show_queue_stats = True
 
     def __init__(self, *args, **kwargs):
         super(SystemJobsQueueAdmin, self).__init__(*args, **kwargs)
@@ -190,6 +192,13 @@ class SystemJobsQueueAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         return True
 
+    def changelist_view(self, request, extra_context=None):
+        if self.show_queue_stats:
+            extra_context = extra_context or {}
+            extra_context['queue_stats'] = QueuedJob.queue_stats()
+        return super(SystemJobsQueueAdmin, self) \
+                .changelist_view(request, extra_context=extra_context)
+
     def get_custom_list_select_related(self):
         return super(SystemJobsQueueAdmin, self) \
             .get_custom_list_select_related() + [
@@ -213,12 +222,17 @@ class ContestQueuedJob(QueuedJob):
 
 
 class ContestJobsQueueAdmin(SystemJobsQueueAdmin):
+    # The queues are shared by all contests.
+    show_queue_stats = False
+
     def __init__(self, *args, **kwargs):
         super(ContestJobsQueueAdmin, self).__init__(*args, **kwargs)
         self.list_display = [x for x in self.list_display
-                             if x not in ('contest', 'celery_task_id_link')]
+                             if x not in ('contest', 'queue',
+                                          'celery_task_id_link')]
         self.list_display_links = None
-        self.list_filter = self.list_filter + [UserListFilter]
+        self.list_filter = [x for x in self.list_filter if x != 'queue'] + \
+                [UserListFilter]
 
     def has_change_permission(self, request, obj=None):
         if obj:
@@ -236,3 +250,98 @@ contest_admin_menu_registry.register('queuedjob_admin',
             'oioioiadmin:evalmgr_contestqueuedjob_changelist'),
         condition=(lambda request: not request.user.is_superuser),
         order=60)
+
+
+class RejudgeBatchAdmin(admin.ModelAdmin):
+    list_display = ['id', 'description', 'contest', 'created_by',
+                    'creation_date', 'colored_state', 'progress_display',
+                    'throughput_display', 'eta_display']
+    list_filter = ['state']
+    actions = ['cancel_batches']
+
+    def __init__(self, *args, **kwargs):
+        super(RejudgeBatchAdmin, self).__init__(*args, **kwargs)
+        self.list_display_links = None
+
+    def has_add_permission(self, request):
+        return False
+
+    def colored_state(self, instance):
+        return '<span class="submission-admin submission--%s">%s</span>' % \
+            (instance.state, force_unicode(instance.get_state_display()))
+    colored_state.allow_tags = True
+    colored_state.short_description = _("Status")
+    colored_state.admin_order_field = 'state'
+
+    def progress_display(self, instance):
+        return '%d / %d (%d%%)' % (instance.done, instance.total,
+                                   instance.progress)
+    progress_display.short_description = _("Queued for evaluation")
+
+    def throughput_display(self, instance):
+        throughput = instance.throughput
+        if throughput is None:
+            return ''
+        return _("%.1f / min") % (throughput,)
+    throughput_display.short_description = _("Throughput")
+
+    def eta_display(self, instance):
+        eta = instance.eta
+        if eta is None:
+            return ''
+        return timezone.localtime(timezone.now() + eta) \
+                .strftime('%Y-%m-%d %H:%M:%S')
+    eta_display.short_description = _("Estimated finish")
+
+    @transaction.atomic
+    def cancel_batches(self, request, queryset):
+        queryset.filter(state__in=['QUEUED', 'PROGRESS']) \
+                .update(state='CANCELLED', finish_date=timezone.now())
+    cancel_batches.short_description = \
+        _("Cancel selected rejudges (the already queued submissions "
+          "are still evaluated)")
+
+    def get_custom_list_select_related(self):
+        return super(RejudgeBatchAdmin, self) \
+            .get_custom_list_select_related() + ['contest', 'created_by']
+
+
+admin.site.register(RejudgeBatch, RejudgeBatchAdmin)
+system_admin_menu_registry.register('rejudgebatch_admin',
+        _("Rejudges"), lambda request: reverse(
+            'oioioiadmin:evalmgr_rejudgebatch_changelist'),
+        order=60)
+
+
+class ContestRejudgeBatch(RejudgeBatch):
+    class Meta(object):
+        proxy = True
+        verbose_name = _("rejudge")
+        verbose_name_plural = _("rejudges")
+
+
+class ContestRejudgeBatchAdmin(RejudgeBatchAdmin):
+    def __init__(self, *args, **kwargs):
+        super(ContestRejudgeBatchAdmin, self).__init__(*args, **kwargs)
+        self.list_display = [x for x in self.list_display
+                             if x != 'contest']
+
+    def has_change_permission(self, request, obj=None):
+        if obj:
+            return False
+        return is_contest_admin(request)
+
+    def has_delete_permission(self, request, obj=None):
+        return is_contest_admin(request)
+
+    def get_queryset(self, request):
+        qs = super(ContestRejudgeBatchAdmin, self).get_queryset(request)
+        return qs.filter(contest=request.contest)
+
+
+contest_site.contest_register(ContestRejudgeBatch, ContestRejudgeBatchAdmin)
+contest_admin_menu_registry.register('rejudgebatch_admin',
+        _("Rejudges"), lambda request: reverse(
+            'oioioiadmin:evalmgr_contestrejudgebatch_changelist'),
+        condition=(lambda request: not request.user.is_superuser),
+        order=60)
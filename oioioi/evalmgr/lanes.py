@@ -0,0 +1,77 @@
+"""Evaluation lanes.
+
+   Environs are evaluated in separate Celery queues depending on what is
+   evaluated, so that a big rejudge or a problem package upload doesn't
+   delay evaluation of live contest submissions.
+
+   The lanes are configured in ``settings.EVALMGR_LANES``, a list of
+   ``(queue, condition, weight)`` tuples. An environ is sent to the queue of
+   the first lane whose condition (a dotted path to a function taking the
+   environ) returns ``True``, or which has no condition. Every queue is
+   consumed by its own worker, and ``settings.EVALMGR_CONCURRENCY``
+   evaluations are shared between them proportionally to the weights (see
+   :func:`get_lane_workers`).
+"""
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def is_model_solution(environ):
+    """Model solutions are evaluated after a problem package is uploaded."""
+    return bool(environ.get('extra_args', {}).get('model_solution'))
+
+
+def is_rejudge(environ):
+    return bool(environ.get('is_rejudge'))
+
+
+def is_testrun(environ):
+    return environ.get('submission_kind') == 'TESTRUN'
+
+
+def get_lane_queue(environ):
+    """Returns the Celery queue the environ should be evaluated in, or
+       ``None`` if no lane matches it.
+    """
+    for queue, condition, _weight in settings.EVALMGR_LANES:
+        if condition is None or import_string(condition)(environ):
+            return queue
+    return None
+
+
+def get_lane_workers():
+    """Returns a list of ``(name, queues, concurrency)`` tuples, describing
+       the workers which consume the queues of the lanes. ``queues`` is
+       a comma-separated list, as accepted by ``celeryd -Q``.
+
+       Every queue gets its own worker, with a share of
+       ``settings.EVALMGR_CONCURRENCY`` proportional to its weight, but at
+       least one process. If the concurrency is lower than the number of
+       queues, a single ``evalmgr`` worker consumes all of them, so that the
+       total is never exceeded.
+    """
+    weights = OrderedDict()
+    for queue, _condition, weight in settings.EVALMGR_LANES:
+        weights[queue] = weights.get(queue, 0) + weight
+    concurrency = settings.EVALMGR_CONCURRENCY
+    if concurrency < len(weights):
+        return [('evalmgr', ','.join(weights), concurrency)]
+
+    # The shares are rounded using the largest remainder method.
+    total_weight = sum(weights.itervalues()) or 1
+    shares = OrderedDict((queue, divmod(concurrency * weight, total_weight))
+                         for queue, weight in weights.iteritems())
+    counts = OrderedDict((queue, count)
+                         for queue, (count, _rem) in shares.iteritems())
+    by_remainder = sorted(shares, key=lambda queue: -shares[queue][1])
+    for queue in by_remainder[:concurrency - sum(counts.itervalues())]:
+        counts[queue] += 1
+    for queue, count in counts.iteritems():
+        if count == 0:
+            # The process is taken from the biggest worker.
+            counts[max(counts, key=counts.get)] -= 1
+            counts[queue] = 1
+    return [(queue, queue, count) for queue, count in counts.iteritems()]
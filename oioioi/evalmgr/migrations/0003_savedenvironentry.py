@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('evalmgr', '0002_deferreduserresultsupdate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SavedEnvironEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('name', models.CharField(max_length=255)),
+                ('value', models.TextField(help_text='JSON-encoded value')),
+                ('saved_environ', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='evalmgr.SavedEnviron')),
+            ],
+        ),
+    ]
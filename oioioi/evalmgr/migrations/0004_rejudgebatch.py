@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import oioioi.base.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contests', '0005_submission_auto_rejudges'),
+        ('evalmgr', '0003_savedenvironentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RejudgeBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creation_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='creation date')),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='description')),
+                ('state', oioioi.base.fields.EnumField(default='QUEUED', max_length=64, verbose_name='state')),
+                ('submission_ids', models.TextField(help_text='JSON-encoded list of submission ids')),
+                ('extra_args', models.TextField(default='{}', help_text='JSON-encoded extra_args passed to judge()')),
+                ('total', models.IntegerField(verbose_name='submissions')),
+                ('done', models.IntegerField(default=0, verbose_name='queued')),
+                ('start_date', models.DateTimeField(blank=True, null=True, verbose_name='start date')),
+                ('finish_date', models.DateTimeField(blank=True, null=True, verbose_name='finish date')),
+                ('contest', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='contests.Contest', verbose_name='contest')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='created by')),
+            ],
+            options={
+                'ordering': ['-creation_date'],
+                'verbose_name': 'rejudge',
+                'verbose_name_plural': 'rejudges',
+            },
+        ),
+        migrations.CreateModel(
+            name='ContestRejudgeBatch',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'rejudge',
+                'verbose_name_plural': 'rejudges',
+                'proxy': True,
+            },
+            bases=('evalmgr.rejudgebatch',),
+        ),
+    ]
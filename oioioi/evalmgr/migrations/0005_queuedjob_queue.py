@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('evalmgr', '0004_rejudgebatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedjob',
+            name='queue',
+            field=models.CharField(blank=True, db_index=True, max_length=50, verbose_name='queue'),
+        ),
+        migrations.AddField(
+            model_name='queuedjob',
+            name='queued_date',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='queued date'),
+        ),
+    ]
@@ -1,11 +1,17 @@
 import json
+from collections import OrderedDict
+from datetime import timedelta
 
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Count, Min
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
-from oioioi.contests.models import Submission
+from oioioi.contests.models import Contest, Submission, ProblemInstance
 from oioioi.base.fields import EnumRegistry, EnumField
+from oioioi.evalmgr import logger
 
 
 job_states = EnumRegistry()
@@ -24,12 +30,47 @@ class QueuedJob(models.Model):
     submission = models.ForeignKey(Submission, null=True)
     celery_task_id = models.CharField(max_length=50, unique=True, null=True,
                                       blank=True)
+    # Celery queue of the evaluation lane, see oioioi.evalmgr.lanes.
+    queue = models.CharField(max_length=50, blank=True, db_index=True,
+                             verbose_name=_("queue"))
+    queued_date = models.DateTimeField(null=True, blank=True,
+                                       verbose_name=_("queued date"))
 
     class Meta(object):
         verbose_name = _("Queued job")
         verbose_name_plural = _("Queued jobs")
         ordering = ['pk']
 
+    @classmethod
+    def queue_stats(cls):
+        """Returns a list of dicts describing every evaluation queue: its
+           ``queue`` name, the number of ``queued`` jobs and of jobs
+           ``in_progress`` or ``waiting`` for external evaluation, and
+           the ``latency``, i.e. how long the oldest queued job is waiting.
+        """
+        def empty(queue):
+            return {'queue': queue, 'queued': 0, 'in_progress': 0,
+                    'waiting': 0, 'latency': None}
+
+        stats = OrderedDict()
+        for queue, _condition, _weight in settings.EVALMGR_LANES:
+            stats.setdefault(queue, empty(queue))
+        rows = cls.objects.exclude(state='CANCELLED') \
+                .order_by().values('queue', 'state') \
+                .annotate(count=Count('job_id'), oldest=Min('queued_date'))
+        now = timezone.now()
+        for row in rows:
+            queue = stats.setdefault(row['queue'], empty(row['queue']))
+            if row['state'] == 'QUEUED':
+                queue['queued'] = row['count']
+                if row['oldest'] is not None:
+                    queue['latency'] = now - row['oldest']
+            elif row['state'] == 'PROGRESS':
+                queue['in_progress'] = row['count']
+            elif row['state'] == 'WAITING':
+                queue['waiting'] = row['count']
+        return stats.values()
+
 
 class SavedEnviron(models.Model):
     # A queued_job field can't be a primary key for this model, as it would
@@ -41,10 +82,137 @@ class SavedEnviron(models.Model):
             help_text=_("Time and date when the environ was saved"))
 
     def load_environ(self):
-        return json.loads(self.environ)
+        environ = json.loads(self.environ)
+        for entry in self.entries.all():
+            environ.setdefault(entry.key, {})[entry.name] = \
+                    json.loads(entry.value)
+        return environ
 
     @classmethod
     def save_environ(cls, environ):
-        return cls.objects.create(
+        """Saves the environ. Dictionaries listed in
+           ``settings.EVALMGR_SAVED_ENVIRON_SEPARATE_KEYS`` (per-test data,
+           like ``tests`` or ``test_results``) are stored separately as
+           :class:`SavedEnvironEntry` objects, one for every test, so that
+           the main environ stays small.
+        """
+        environ = dict(environ)
+        entries = []
+        for key in settings.EVALMGR_SAVED_ENVIRON_SEPARATE_KEYS:
+            value = environ.get(key)
+            if not isinstance(value, dict):
+                continue
+            environ[key] = {}
+            entries.extend(SavedEnvironEntry(key=key, name=name,
+                                             value=json.dumps(item))
+                           for name, item in value.iteritems())
+        saved_environ = cls.objects.create(
                 queued_job=QueuedJob.objects.get(job_id=environ['job_id']),
                 environ=json.dumps(environ))
+        for entry in entries:
+            entry.saved_environ = saved_environ
+        SavedEnvironEntry.objects.bulk_create(entries)
+        logger.debug("Saved environ of job %s: %d bytes, %d bytes in "
+                     "%d separate entries", environ['job_id'],
+                     len(saved_environ.environ),
+                     sum(len(entry.value) for entry in entries),
+                     len(entries))
+        return saved_environ
+
+
+class SavedEnvironEntry(models.Model):
+    """A single value of a dictionary from
+       :class:`SavedEnviron`, e.g. ``environ['tests'][name]``.
+    """
+    saved_environ = models.ForeignKey(SavedEnviron, related_name='entries',
+                                      on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    name = models.CharField(max_length=255)
+    value = models.TextField(help_text=_("JSON-encoded value"))
+
+
+class DeferredUserResultsUpdate(models.Model):
+    """Results of a user for a problem instance, which need to be updated
+       after a rejudge. Such updates are collected for a short time and
+       then processed together (see
+       :func:`oioioi.evalmgr.tasks.update_deferred_user_results`).
+    """
+    user = models.ForeignKey(User)
+    problem_instance = models.ForeignKey(ProblemInstance)
+    creation_date = models.DateTimeField(default=timezone.now)
+
+
+rejudge_batch_states = EnumRegistry()
+rejudge_batch_states.register('QUEUED', _("Queued"))
+rejudge_batch_states.register('PROGRESS', _("In progress"))
+rejudge_batch_states.register('DONE', _("Done"))
+rejudge_batch_states.register('CANCELLED', _("Cancelled"))
+
+
+class RejudgeBatch(models.Model):
+    """Submissions rejudged in background by
+       :func:`~oioioi.evalmgr.tasks.rejudgemgr_job`, in throttled chunks.
+
+       ``done`` out of ``total`` submissions have already been queued for
+       evaluation.
+    """
+    contest = models.ForeignKey(Contest, null=True, blank=True,
+            verbose_name=_("contest"))
+    created_by = models.ForeignKey(User, null=True, blank=True,
+            on_delete=models.SET_NULL, verbose_name=_("created by"))
+    creation_date = models.DateTimeField(default=timezone.now,
+            verbose_name=_("creation date"))
+    description = models.CharField(max_length=255, blank=True,
+            verbose_name=_("description"))
+    state = EnumField(rejudge_batch_states, default='QUEUED',
+            verbose_name=_("state"))
+    submission_ids = models.TextField(
+            help_text=_("JSON-encoded list of submission ids"))
+    extra_args = models.TextField(default='{}',
+            help_text=_("JSON-encoded extra_args passed to judge()"))
+    total = models.IntegerField(verbose_name=_("submissions"))
+    done = models.IntegerField(default=0, verbose_name=_("queued"))
+    start_date = models.DateTimeField(null=True, blank=True,
+            verbose_name=_("start date"))
+    finish_date = models.DateTimeField(null=True, blank=True,
+            verbose_name=_("finish date"))
+
+    class Meta(object):
+        verbose_name = _("rejudge")
+        verbose_name_plural = _("rejudges")
+        ordering = ['-creation_date']
+
+    def get_submission_ids(self):
+        return json.loads(self.submission_ids)
+
+    def get_extra_args(self):
+        return json.loads(self.extra_args)
+
+    @property
+    def progress(self):
+        """Percentage of the submissions queued for evaluation."""
+        if not self.total:
+            return 100
+        return 100 * self.done // self.total
+
+    @property
+    def throughput(self):
+        """Number of submissions queued per minute, or ``None`` if
+           the batch hasn't started yet.
+        """
+        if self.start_date is None:
+            return None
+        end = self.finish_date or timezone.now()
+        seconds = (end - self.start_date).total_seconds()
+        if seconds <= 0:
+            return None
+        return 60. * self.done / seconds
+
+    @property
+    def eta(self):
+        """Estimated time left until all the submissions are queued, or
+           ``None`` if it can't be estimated.
+        """
+        if self.state != 'PROGRESS' or not self.throughput:
+            return None
+        return timedelta(minutes=(self.total - self.done) / self.throughput)
@@ -1,9 +1,12 @@
-import copy
+import json
 import sys
 import pprint
 from uuid import uuid4
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
+from django.utils import timezone
 from django.utils.module_loading import import_string
 
 from celery.task import task
@@ -11,13 +14,21 @@ from celery.exceptions import Ignore
 
 from oioioi.base.utils.db import require_transaction
 from oioioi.evalmgr import logger
-from oioioi.evalmgr.models import SavedEnviron, QueuedJob
-from oioioi.evalmgr.utils import mark_job_state
+from oioioi.evalmgr.lanes import get_lane_queue
+from oioioi.contests.models import Submission
+from oioioi.contests.utils import update_user_results_bulk
+from oioioi.evalmgr.models import SavedEnviron, QueuedJob, \
+        DeferredUserResultsUpdate, RejudgeBatch
+from oioioi.evalmgr.utils import mark_job_state, CopyOnWriteEnviron, \
+        environ_size
 from oioioi.base.utils.loaders import load_modules
 
 
 loaded_controllers = False
 
+# Cache key set while update_deferred_user_results is scheduled
+_DEFERRED_USER_RESULTS_KEY = 'evalmgr_deferred_user_results_scheduled'
+
 
 def _placeholder(environ, **kwargs):
     return environ
@@ -157,6 +168,14 @@ def _run_phase(env, phase, extra_kwargs=None):
     return env
 
 
+def _log_environ_size(env, phase_name):
+    total, sizes = environ_size(env)
+    largest = sorted(sizes.iteritems(), key=lambda item: -item[1])[:3]
+    logger.info("Environ of job %s after phase %s: %d bytes (%s)",
+            env.get('job_id'), phase_name, total,
+            ', '.join('%s: %d' % item for item in largest))
+
+
 @require_transaction
 def _resume_job(environ):
     """Restores saved environ, returns environ or None, when a matching
@@ -237,13 +256,20 @@ def delay_environ(environ, **evalmgr_extra_args):
        it if it should be. Returns associated async result, or None when job
        was already resumed before (or was cancelled).
 
+       Unless a ``queue`` is given explicitly, the environ is sent to the
+       queue of its evaluation lane, see :mod:`oioioi.evalmgr.lanes`.
+
        Requires to be called from transaction.
     """
     if 'saved_environ_id' in environ:
         environ = _resume_job(environ)
         if environ is None:
             return None
-    if not mark_job_state(environ, 'QUEUED'):
+    queue = evalmgr_extra_args.get('queue') or get_lane_queue(environ)
+    if queue is not None:
+        evalmgr_extra_args['queue'] = queue
+    if not mark_job_state(environ, 'QUEUED', queue=queue or '',
+                          queued_date=timezone.now()):
         return None
     async_result = evalmgr_job.apply_async((environ,), **evalmgr_extra_args)
     QueuedJob.objects.filter(
@@ -298,7 +324,14 @@ def evalmgr_job(env):
         is stopped. One who does it is responsible for handling corresponding
         QueuedJob object.
 
-        Returns environment (a processed copy of given environment).
+        Returns environment (a processed copy of given environment). The
+        environment is copied lazily (see
+        :class:`~oioioi.evalmgr.utils.CopyOnWriteEnviron`), so the result
+        may share the values which weren't accessed by any handler with the
+        given environment.
+
+        If ``settings.EVALMGR_LOG_ENVIRON_SIZE`` is set, the size of the
+        environment is logged after every phase.
     """
 
     # pylint: disable=global-statement,broad-except
@@ -309,7 +342,9 @@ def evalmgr_job(env):
         load_modules('controllers')
         loaded_controllers = True
 
-    env = copy.deepcopy(env)
+    # The environ given as an argument must not be modified (e.g. when
+    # tasks are run eagerly), but copying it as a whole is expensive.
+    env = CopyOnWriteEnviron(env)
 
     try:
         if 'job_id' not in env:
@@ -329,10 +364,13 @@ def evalmgr_job(env):
             phase = recipe[0]
             env['recipe'] = recipe[1:]
             env = _run_phase(env, phase)
+            if settings.EVALMGR_LOG_ENVIRON_SIZE:
+                _log_environ_size(env, phase[0])
             if 'transfer' in env:
-                env = _transfer_job(env, **env.pop('transfer'))
+                transfer = env.pop('transfer')
+                env = _transfer_job(dict(env), **transfer)
                 break
-        return env
+        return dict(env)
 
     # Throwing up celery.exceptions.Ignore is necessary for our custom revoke
     # mechanism. Basically, one of the handlers in job's recipe throws Ignore
@@ -342,4 +380,120 @@ def evalmgr_job(env):
         raise
     # pylint: disable=broad-except
     except Exception:
-        return _run_error_handlers(env, sys.exc_info())
+        return dict(_run_error_handlers(env, sys.exc_info()))
+
+
+def defer_user_results_update(user, problem_instance):
+    """Schedules updating results of the user for the problem instance.
+
+       Instead of being updated immediately, the results are updated by
+       :func:`update_deferred_user_results` after
+       ``settings.DEFERRED_USER_RESULTS_DELAY`` seconds, together with all
+       the other results deferred in the meantime. This way, when many
+       submissions of a user are rejudged, the results are recalculated
+       only once.
+    """
+    DeferredUserResultsUpdate.objects.create(user=user,
+            problem_instance=problem_instance)
+    delay = settings.DEFERRED_USER_RESULTS_DELAY
+    if cache.add(_DEFERRED_USER_RESULTS_KEY, True, delay):
+        update_deferred_user_results.apply_async(countdown=delay)
+
+
+@task
+def update_deferred_user_results():
+    """Updates all the results deferred by
+       :func:`defer_user_results_update`.
+    """
+    # Results deferred from now on will schedule another run.
+    cache.delete(_DEFERRED_USER_RESULTS_KEY)
+    updates = list(DeferredUserResultsUpdate.objects
+            .select_related('user', 'problem_instance__contest',
+                            'problem_instance__problem')
+            .order_by('id'))
+    if not updates:
+        return
+    update_user_results_bulk(set((update.user, update.problem_instance)
+                                 for update in updates))
+    DeferredUserResultsUpdate.objects.filter(
+            id__in=[update.id for update in updates]).delete()
+
+
+def rejudge_in_background(submission_ids, extra_args=None, contest=None,
+                          created_by=None, description=''):
+    """Creates a :class:`~oioioi.evalmgr.models.RejudgeBatch` of the given
+       submissions and schedules :func:`rejudgemgr_job` for it.
+
+       ``extra_args`` are passed to
+       :meth:`~oioioi.contests.controllers.ContestController.judge`.
+
+       Must not be called inside a transaction (views calling it have to be
+       decorated with ``transaction.non_atomic_requests``), as the job could
+       start before the batch is committed and wouldn't find it.
+    """
+    submission_ids = list(submission_ids)
+    # We need to make sure that the batch is saved in the database before
+    # the Celery task starts.
+    with transaction.atomic():
+        batch = RejudgeBatch.objects.create(contest=contest,
+                created_by=created_by, description=description[:255],
+                submission_ids=json.dumps(submission_ids),
+                extra_args=json.dumps(extra_args or {}),
+                total=len(submission_ids))
+    rejudgemgr_job.apply_async((batch.id,),
+                               queue=settings.REJUDGE_BATCH_QUEUE)
+    return batch
+
+
+@task(ignore_result=True)
+def rejudgemgr_job(batch_id):
+    """Queues the next chunk of submissions of the
+       :class:`~oioioi.evalmgr.models.RejudgeBatch` with the given id for
+       evaluation, and schedules itself for the next one.
+
+       At most ``settings.REJUDGE_BATCH_CHUNK_SIZE`` submissions are queued
+       every ``settings.REJUDGE_BATCH_INTERVAL`` seconds, and only while
+       there are less than ``settings.REJUDGE_BATCH_MAX_ACTIVE_JOBS``
+       jobs in the evaluation queue, so that new submissions don't wait
+       behind the rejudged ones. The evaluations are sent to the rejudge
+       lane (see :mod:`oioioi.evalmgr.lanes`).
+    """
+    with transaction.atomic():
+        try:
+            batch = RejudgeBatch.objects.select_for_update().get(id=batch_id)
+        except RejudgeBatch.DoesNotExist:
+            logger.info("Rejudge batch %s got deleted before it was "
+                        "finished.", batch_id)
+            return
+        if batch.state not in ('QUEUED', 'PROGRESS'):
+            return
+        if batch.state == 'QUEUED':
+            batch.state = 'PROGRESS'
+            batch.start_date = timezone.now()
+
+        active_jobs = QueuedJob.objects.exclude(state='CANCELLED').count()
+        chunk_size = min(settings.REJUDGE_BATCH_CHUNK_SIZE,
+                         settings.REJUDGE_BATCH_MAX_ACTIVE_JOBS - active_jobs)
+        chunk = batch.get_submission_ids()[batch.done:
+                                           batch.done + max(chunk_size, 0)]
+        submissions = Submission.objects.select_related(
+                'problem_instance__contest',
+                'problem_instance__problem').in_bulk(chunk)
+        extra_args = dict(batch.get_extra_args(), rejudge_batch_id=batch.id)
+        for submission_id in chunk:
+            # The submission may have been deleted in the meantime.
+            if submission_id in submissions:
+                submission = submissions[submission_id]
+                submission.problem_instance.controller.judge(submission,
+                        extra_args=extra_args, is_rejudge=True)
+
+        batch.done += len(chunk)
+        if batch.done >= batch.total:
+            batch.state = 'DONE'
+            batch.finish_date = timezone.now()
+        batch.save()
+
+    if batch.state == 'PROGRESS':
+        rejudgemgr_job.apply_async((batch_id,),
+                                   queue=settings.REJUDGE_BATCH_QUEUE,
+                                   countdown=settings.REJUDGE_BATCH_INTERVAL)
@@ -0,0 +1,9 @@
+from django import template
+
+from oioioi.evalmgr.lanes import get_lane_workers
+register = template.Library()
+
+
+@register.assignment_tag
+def evalmgr_lane_workers():
+    return get_lane_workers()
@@ -1,19 +1,31 @@
 import copy
+import json
 import uuid
 import os.path
+from datetime import timedelta
 
-from django.db import transaction
+from django.core.cache import cache
+from django.db import transaction, DEFAULT_DB_ALIAS
 from django.test.utils import override_settings
-from django.core.urlresolvers import reverse
+from django.utils import timezone
+from django.core.urlresolvers import reverse, resolve
+from mock import patch
 
 from oioioi.base.tests import TestCase
-from oioioi.contests.models import Submission, Contest
-from oioioi.evalmgr.tasks import transfer_job, create_environ, delay_environ
-from oioioi.evalmgr.models import SavedEnviron
+from oioioi.contests.controllers import ContestController
+from oioioi.contests.handlers import update_user_results
+from oioioi.contests.models import Submission, Contest, UserResultForProblem
+from oioioi.evalmgr.tasks import transfer_job, create_environ, \
+        delay_environ, update_deferred_user_results, \
+        _DEFERRED_USER_RESULTS_KEY, rejudge_in_background, rejudgemgr_job, \
+        evalmgr_job
+from oioioi.evalmgr.lanes import get_lane_queue, get_lane_workers
+from oioioi.evalmgr.models import SavedEnviron, SavedEnvironEntry, \
+        DeferredUserResultsUpdate, RejudgeBatch
 from oioioi.filetracker.client import get_client
 from oioioi.programs.controllers import ProgrammingContestController
 from oioioi.sioworkers.jobs import run_sioworkers_job
-from oioioi.evalmgr.utils import mark_job_state
+from oioioi.evalmgr.utils import mark_job_state, CopyOnWriteEnviron
 from oioioi.evalmgr.models import QueuedJob
 
 
@@ -59,6 +71,12 @@ def rest_handler(env, **kwargs):
     return env
 
 
+def mark_tests_handler(env, **kwargs):
+    for test in env['tests'].itervalues():
+        test['marked'] = True
+    return env
+
+
 class TestLocalJobs(TestCase):
     def test_evalmgr_job(self):
         env = create_environ()
@@ -83,6 +101,28 @@ class TestLocalJobs(TestCase):
         self.assertEqual('Epic fail.', city_result.get()['output'])
         self.assertEqual('Epic fail.', jungle_result.get()['output'])
 
+    def test_environ_not_modified(self):
+        env = create_environ()
+        env.update(dict(recipe=hunting + [('mark',
+                            'oioioi.evalmgr.tests.tests.mark_tests_handler')],
+                        area='forest', tests={'1a': {'name': '1a'}}))
+        original = copy.deepcopy(env)
+        result = delay_environ_wrapper(env).get()
+        self.assertEqual(env, original)
+        self.assertTrue(result['tests']['1a']['marked'])
+        self.assertEqual(type(result), dict)
+
+    def test_copy_on_write_environ(self):
+        original = {'tests': {'1a': {}}, 'recipe': [1, 2]}
+        env = CopyOnWriteEnviron(original)
+        env['tests']['1a']['marked'] = True
+        env.setdefault('test_results', {})['1a'] = {}
+        env.pop('recipe').pop()
+        self.assertEqual(original, {'tests': {'1a': {}}, 'recipe': [1, 2]})
+        self.assertEqual(env, {'tests': {'1a': {'marked': True}},
+                               'test_results': {'1a': {}}})
+        self.assertEqual(type(copy.deepcopy(env)), dict)
+
 
 def upload_source(env, **kwargs):
     fc = get_client()
@@ -346,6 +386,19 @@ class TestAsyncJobs(TestCase):
             delay_environ_wrapper(res).get()
         self.assertNotEqual(ids[0], ids[1])
 
+    def test_separately_saved_keys(self):
+        env = self._prepare()
+        env['tests'] = {'1a': {'name': '1a'}, '1b': {'name': '1b'}}
+        delay_environ_wrapper(env).get()
+        res = TestAsyncJobs.transferred_environs.pop()
+        saved_environ = SavedEnviron.objects.get()
+        self.assertEqual(saved_environ.entries.count(), 2)
+        self.assertNotIn('1a', saved_environ.environ)
+        self.assertEqual(saved_environ.load_environ()['tests'], env['tests'])
+        env = delay_environ_wrapper(res).get()
+        self.assertEqual(env['tests']['1b'], {'name': '1b'})
+        self.assertEqual(SavedEnvironEntry.objects.count(), 0)
+
 
 def _call_transfer(environ):
     environ['magic'] = 1234
@@ -468,3 +521,186 @@ class TestEval(TestCase):
         qs.save()
 
         self.assertFalse(mark_job_state(env, state='PROGRESS'))
+
+    @override_settings(DEFERRED_USER_RESULTS_DELAY=10)
+    def test_deferred_user_results(self):
+        submission = Submission.objects.get(pk=1)
+        UserResultForProblem.objects.all().delete()
+        env = create_environ()
+        env['submission_id'] = submission.id
+        env['problem_instance_id'] = submission.problem_instance_id
+        env['round_id'] = submission.problem_instance.round_id
+        env['contest_id'] = submission.problem_instance.contest_id
+        env['is_rejudge'] = True
+        # Pretend that the update is already scheduled, as tasks run eagerly
+        # in tests.
+        cache.set(_DEFERRED_USER_RESULTS_KEY, True)
+        update_user_results(env)
+        update_user_results(env)
+        self.assertEqual(DeferredUserResultsUpdate.objects.count(), 2)
+        self.assertFalse(UserResultForProblem.objects.exists())
+
+        update_deferred_user_results()
+        self.assertFalse(DeferredUserResultsUpdate.objects.exists())
+        urp = UserResultForProblem.objects.get(user=submission.user,
+                problem_instance=submission.problem_instance)
+        self.assertEqual(urp.score, submission.score)
+
+
+class TestRejudgeBatch(TestCase):
+    fixtures = ['test_users', 'test_contest', 'test_full_package',
+                'test_problem_instance', 'test_submission']
+
+    def _create_batch(self, submission_ids, **kwargs):
+        return RejudgeBatch.objects.create(
+                submission_ids=json.dumps(submission_ids),
+                total=len(submission_ids), **kwargs)
+
+    @override_settings(REJUDGE_BATCH_CHUNK_SIZE=1)
+    def test_rejudge_in_chunks(self):
+        with patch.object(ContestController, 'judge') as judge:
+            batch = rejudge_in_background([1, 1, 1],
+                    extra_args={'rejudge_type': 'FULL'},
+                    contest=Contest.objects.get())
+        self.assertEqual(judge.call_count, 3)
+        submission, = judge.call_args[0]
+        self.assertEqual(submission.id, 1)
+        self.assertEqual(judge.call_args[1], {'is_rejudge': True,
+                'extra_args': {'rejudge_type': 'FULL',
+                               'rejudge_batch_id': batch.id}})
+        batch = RejudgeBatch.objects.get()
+        self.assertEqual(batch.state, 'DONE')
+        self.assertEqual(batch.done, 3)
+        self.assertEqual(batch.progress, 100)
+        self.assertIsNotNone(batch.throughput)
+        self.assertIsNone(batch.eta)
+
+    @override_settings(REJUDGE_BATCH_MAX_ACTIVE_JOBS=2)
+    def test_throttling(self):
+        QueuedJob.objects.create(job_id='live', state='WAITING')
+        batch = self._create_batch([1, 1, 1])
+        with patch.object(ContestController, 'judge') as judge, \
+                patch.object(rejudgemgr_job, 'apply_async') as apply_async:
+            rejudgemgr_job(batch.id)
+            self.assertEqual(judge.call_count, 1)
+            self.assertTrue(apply_async.called)
+
+            QueuedJob.objects.create(job_id='live2', state='QUEUED')
+            rejudgemgr_job(batch.id)
+            self.assertEqual(judge.call_count, 1)
+        batch = RejudgeBatch.objects.get()
+        self.assertEqual(batch.state, 'PROGRESS')
+        self.assertEqual(batch.done, 1)
+        self.assertIsNotNone(batch.start_date)
+
+    def test_cancelled(self):
+        batch = self._create_batch([1], state='CANCELLED')
+        with patch.object(ContestController, 'judge') as judge:
+            rejudgemgr_job(batch.id)
+        self.assertFalse(judge.called)
+        self.assertEqual(RejudgeBatch.objects.get().done, 0)
+
+    def test_rejudge_all_view(self):
+        self.client.login(username='test_admin')
+        url = reverse('rejudge_all_submissions_for_problem',
+                      kwargs={'contest_id': 'c', 'problem_instance_id': 1})
+        with patch.object(ContestController, 'judge') as judge:
+            response = self.client.post(url, {'submit': True}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(judge.called)
+        batch = RejudgeBatch.objects.get()
+        self.assertEqual(batch.contest_id, 'c')
+        self.assertEqual(batch.get_submission_ids(), [1])
+
+        response = self.client.get(reverse(
+                'oioioiadmin:evalmgr_contestrejudgebatch_changelist',
+                kwargs={'contest_id': 'c'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('1 / 1 (100%)', response.content)
+
+    def test_rejudge_views_not_atomic(self):
+        # Otherwise the job could start before the batch is committed.
+        urls = [reverse('rejudge_all_submissions_for_problem',
+                        kwargs={'contest_id': 'c', 'problem_instance_id': 1}),
+                reverse('oioioiadmin:contests_submission_changelist',
+                        kwargs={'contest_id': 'c'}) + 'rejudge/']
+        for url in urls:
+            self.assertIn(DEFAULT_DB_ALIAS, getattr(resolve(url).func,
+                          '_non_atomic_requests', set()))
+
+
+class TestEvaluationLanes(TestCase):
+    fixtures = ['test_users', 'test_contest']
+
+    def test_lane_queue(self):
+        self.assertEqual(get_lane_queue({'submission_kind': 'NORMAL'}),
+                         'evalmgr')
+        self.assertEqual(get_lane_queue({'submission_kind': 'TESTRUN'}),
+                         'evalmgr-testrun')
+        self.assertEqual(get_lane_queue({'is_rejudge': True}),
+                         'evalmgr-rejudge')
+        self.assertEqual(get_lane_queue({'is_rejudge': True,
+                    'extra_args': {'model_solution': True}}),
+                'evalmgr-packages')
+
+    @override_settings(EVALMGR_CONCURRENCY=10)
+    def test_lane_workers(self):
+        self.assertEqual(get_lane_workers(), [
+                ('evalmgr-packages', 'evalmgr-packages', 1),
+                ('evalmgr-rejudge', 'evalmgr-rejudge', 2),
+                ('evalmgr-testrun', 'evalmgr-testrun', 2),
+                ('evalmgr', 'evalmgr', 5)])
+        for concurrency in xrange(4, 30):
+            with self.settings(EVALMGR_CONCURRENCY=concurrency):
+                counts = [c for _n, _q, c in get_lane_workers()]
+                self.assertEqual(sum(counts), concurrency)
+                self.assertTrue(min(counts) >= 1)
+        with self.settings(EVALMGR_CONCURRENCY=5):
+            self.assertEqual([c for _n, _q, c in get_lane_workers()],
+                             [1, 1, 1, 2])
+        with self.settings(EVALMGR_CONCURRENCY=1):
+            self.assertEqual(get_lane_workers(), [('evalmgr',
+                    'evalmgr-packages,evalmgr-rejudge,evalmgr-testrun,'
+                    'evalmgr', 1)])
+
+    def test_delay_environ_queue(self):
+        with patch.object(evalmgr_job, 'apply_async') as apply_async:
+            env = create_environ()
+            env.update(recipe=hunting, is_rejudge=True)
+            delay_environ_wrapper(env)
+            self.assertEqual(apply_async.call_args[1],
+                             {'queue': 'evalmgr-rejudge'})
+            job = QueuedJob.objects.get(job_id=env['job_id'])
+            self.assertEqual(job.queue, 'evalmgr-rejudge')
+            self.assertIsNotNone(job.queued_date)
+
+            env = create_environ()
+            env.update(recipe=hunting, is_rejudge=True)
+            delay_environ_wrapper(env, queue='evalmgr-zeus')
+            self.assertEqual(apply_async.call_args[1],
+                             {'queue': 'evalmgr-zeus'})
+
+    def test_queue_stats(self):
+        now = timezone.now()
+        QueuedJob.objects.create(job_id='a', state='QUEUED',
+                queue='evalmgr', queued_date=now - timedelta(seconds=30))
+        QueuedJob.objects.create(job_id='b', state='QUEUED',
+                queue='evalmgr', queued_date=now)
+        QueuedJob.objects.create(job_id='c', state='PROGRESS',
+                queue='evalmgr-rejudge', queued_date=now)
+        QueuedJob.objects.create(job_id='d', state='CANCELLED',
+                queue='evalmgr-rejudge', queued_date=now)
+
+        stats = dict((s['queue'], s) for s in QueuedJob.queue_stats())
+        self.assertEqual(stats['evalmgr']['queued'], 2)
+        self.assertGreaterEqual(stats['evalmgr']['latency'],
+                                timedelta(seconds=30))
+        self.assertEqual(stats['evalmgr-rejudge']['queued'], 0)
+        self.assertEqual(stats['evalmgr-rejudge']['in_progress'], 1)
+        self.assertIsNone(stats['evalmgr-testrun']['latency'])
+
+        self.client.login(username='test_admin')
+        response = self.client.get(reverse(
+                'oioioiadmin:evalmgr_queuedjob_changelist'))
+        self.assertContains(response, 'evalmgr-packages')
+        self.assertContains(response, 'queue-stats')
@@ -1,3 +1,5 @@
+import copy
+import json
 import logging
 
 from oioioi.base.utils.db import require_transaction
@@ -33,3 +35,111 @@ def mark_job_state(environ, state, **kwargs):
                 setattr(qj, k, v)
             qj.save()
     return True
+
+
+_IMMUTABLE_TYPES = (basestring, int, long, float, bool, type(None))
+
+
+class CopyOnWriteEnviron(dict):
+    """A job environ, which copies its values lazily.
+
+       Values of the original environ are deep-copied only when they are
+       first accessed, so the parts of environ not used by a handler (like
+       big ``tests`` or ``test_results`` dictionaries) are not copied at
+       all. Values which were never accessed are shared with the original
+       environ, which must not be modified.
+
+       Pickling or deep-copying the environ yields a plain dict.
+    """
+
+    def __init__(self, environ):
+        super(CopyOnWriteEnviron, self).__init__(environ)
+        self._copied = set()
+
+    def _materialize(self, key):
+        if key in self._copied or not dict.__contains__(self, key):
+            return
+        value = dict.__getitem__(self, key)
+        if not isinstance(value, _IMMUTABLE_TYPES):
+            dict.__setitem__(self, key, copy.deepcopy(value))
+        self._copied.add(key)
+
+    def _materialize_all(self):
+        for key in dict.keys(self):
+            self._materialize(key)
+
+    def __getitem__(self, key):
+        self._materialize(key)
+        return super(CopyOnWriteEnviron, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._copied.add(key)
+        super(CopyOnWriteEnviron, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._copied.discard(key)
+        super(CopyOnWriteEnviron, self).__delitem__(key)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def get(self, key, default=None):
+        self._materialize(key)
+        return super(CopyOnWriteEnviron, self).get(key, default)
+
+    def setdefault(self, key, default=None):
+        self._materialize(key)
+        self._copied.add(key)
+        return super(CopyOnWriteEnviron, self).setdefault(key, default)
+
+    def pop(self, key, *args):
+        self._materialize(key)
+        self._copied.discard(key)
+        return super(CopyOnWriteEnviron, self).pop(key, *args)
+
+    def popitem(self):
+        self._materialize_all()
+        key, value = super(CopyOnWriteEnviron, self).popitem()
+        self._copied.discard(key)
+        return key, value
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        self._copied.update(other.iterkeys())
+        super(CopyOnWriteEnviron, self).update(other)
+
+    def copy(self):
+        self._materialize_all()
+        return dict(self)
+
+    def values(self):
+        self._materialize_all()
+        return super(CopyOnWriteEnviron, self).values()
+
+    def itervalues(self):
+        self._materialize_all()
+        return super(CopyOnWriteEnviron, self).itervalues()
+
+    def items(self):
+        self._materialize_all()
+        return super(CopyOnWriteEnviron, self).items()
+
+    def iteritems(self):
+        self._materialize_all()
+        return super(CopyOnWriteEnviron, self).iteritems()
+
+    def to_dict(self):
+        """Returns the environ as a plain dict, without copying the values
+           which were never accessed.
+        """
+        return dict(self)
+
+
+def environ_size(environ):
+    """Returns a pair ``(total, sizes)``, where ``total`` is the size
+       of the JSON-encoded environ and ``sizes`` maps its keys to sizes of
+       the JSON-encoded values (in bytes).
+    """
+    sizes = dict((key, len(json.dumps(value, default=repr)))
+                 for key, value in dict.iteritems(environ))
+    return len(json.dumps(dict(environ), default=repr)), sizes
@@ -3,11 +3,15 @@ import tempfile
 import tarfile
 import shutil
 import StringIO
+from datetime import date
 
 from django.core.management import call_command
+from django.test.utils import override_settings
 
 from oioioi.base.tests import TestCase
 from oioioi.contests.models import Contest, Round
+from oioioi.oi.models import OIRegistration, School
+from oioioi.participants.models import Participant
 from oioioi.programs.models import ProgramSubmission
 from oioioi.exportszu.utils import SubmissionsWithUserDataCollector
 
@@ -44,6 +48,14 @@ class TestSubmissionsWithUserDataCollector(TestCase):
         self.assertEqual(submissions, [1, 2, 3, 4])
         self.assert_correct_submission_data(submission_data_list)
 
+    def test_queries(self):
+        contest = Contest.objects.get(id="c")
+        collector = SubmissionsWithUserDataCollector(contest)
+        # No queries per submission.
+        with self.assertNumQueriesLessThan(3):
+            submission_data_list = collector.collect_list()
+        self.assertEqual(len(submission_data_list), 4)
+
     def test_not_only_final(self):
         contest = Contest.objects.get(id="c")
         collector = SubmissionsWithUserDataCollector(contest, only_final=False)
@@ -83,6 +95,38 @@ class TestFinalSubmissionsWithUserDataCollector(TestCase):
         self.assertEqual(submissions, [1, 2])
 
 
+class TestRegistrationDataCollector(TestCase):
+    fixtures = ['test_users', 'test_contest', 'test_full_package',
+            'test_problem_instance', 'test_submission',
+            'test_another_submission', 'test_schools']
+
+    def setUp(self):
+        contest = Contest.objects.get(id="c")
+        contest.controller_name = 'oioioi.oi.controllers.OIContestController'
+        contest.save()
+
+    def test_registration_data(self):
+        contest = Contest.objects.get(id="c")
+        participant = Participant.objects.create(contest=contest,
+                                                 user_id=1001)
+        OIRegistration.objects.create(participant=participant,
+                address='Nowowiejska 37a', postal_code='02-010',
+                city='Krakow', birthday=date(1998, 1, 1),
+                birthplace='Krakow', t_shirt_size='L', class_type='1LO',
+                school=School.objects.get(id=1))
+
+        collector = SubmissionsWithUserDataCollector(contest,
+                                                     only_final=False)
+        with self.assertNumQueriesLessThan(4):
+            submission_data_list = collector.collect_list()
+        self.assertEqual([s.submission_id for s in submission_data_list],
+                         [1, 2])
+        for s in submission_data_list:
+            self.assertEqual(s.city, 'Krakow')
+            self.assertEqual(s.school, 'XIV LO im. S.Staszica')
+            self.assertEqual(s.school_city, 'Warszawa')
+
+
 INDEX_HEADER = ('submission_id,user_id,username,first_name,last_name,city,'
     'school,school_city,problem_short_name,score\r\n')
 
@@ -106,6 +150,25 @@ class TestExportCommand(TestCase):
         finally:
             shutil.rmtree(tmpdir)
 
+    @override_settings(EXPORTSZU_DOWNLOAD_BATCH_SIZE=1,
+                       EXPORTSZU_DOWNLOAD_CONCURRENCY=2)
+    def test_export_in_batches(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            archive_path = os.path.join(tmpdir, 'archive.tgz')
+            call_command('export_submissions', 'c', archive_path, all=True)
+            archive = tarfile.open(archive_path, 'r:gz')
+            sources = [member for member in archive.getmembers()
+                       if member.isfile() and member.name != 'c/INDEX']
+            self.assertEqual(len(sources), 2)
+            for member in sources:
+                self.assertEqual(member.size,
+                                 len(archive.extractfile(member).read()))
+                self.assertRegexpMatches(
+                        archive.extractfile(member).read(), '.*main.*')
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 class TestExportSubmissionsView(TestCase):
     fixtures = ['test_users', 'test_contest', 'test_full_package',
@@ -1,15 +1,14 @@
 import csv
-import os
-import shutil
 import tarfile
-import tempfile
+import time
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
 
+from django.conf import settings
 from django.db.models import Q
 from django.utils.encoding import force_text
-from django.core.exceptions import ObjectDoesNotExist
 
 from oioioi.programs.models import ProgramSubmission
-from oioioi.participants.models import Participant
 from oioioi.filetracker.utils import django_to_filetracker_path
 from oioioi.filetracker.client import get_client
 
@@ -66,6 +65,7 @@ class SubmissionsWithUserDataCollector(object):
         submissions_list = []
         psubmissions = ProgramSubmission.objects.filter(q_expressions) \
                 .select_related()
+        registrations = self._get_registrations()
 
         for s in psubmissions:
             data = SubmissionData()
@@ -82,10 +82,8 @@ class SubmissionsWithUserDataCollector(object):
 
             # here we try to get some optional data, it just may not be there
             # and it's ok
-            try:
-                registration = Participant.objects.select_related() \
-                    .get(contest_id=self.contest.id, user=s.user) \
-                    .registration_model
+            registration = registrations.get(s.user_id)
+            if registration is not None:
                 try:
                     data.city = registration.city
                 except AttributeError:
@@ -95,15 +93,45 @@ class SubmissionsWithUserDataCollector(object):
                     data.school_city = registration.school.city
                 except AttributeError:
                     pass
-            except (Participant.DoesNotExist, ObjectDoesNotExist):
-                pass
 
             submissions_list.append(data)
         return submissions_list
 
-    def get_submission_source(self, out_file_path, source):
+    def _get_registrations(self):
+        """Returns a dict mapping ids of the contest participants to their
+           registration data (instances of the registration model of
+           the contest), fetched with a single query.
+        """
+        rcontroller = self.contest.controller.registration_controller()
+        # Only participants-based registration controllers keep any
+        # registration data.
+        if not hasattr(rcontroller, 'get_model_class'):
+            return {}
+        model_class = rcontroller.get_model_class()
+        if model_class is None:
+            return {}
+        registrations = model_class.objects \
+                .filter(participant__contest=self.contest) \
+                .select_related('participant')
+        if 'school' in [f.name for f in model_class._meta.fields]:
+            registrations = registrations.select_related('school')
+        return dict((r.participant.user_id, r) for r in registrations)
+
+    def get_submission_source_content(self, source):
         ft_file = django_to_filetracker_path(source)
-        self.filetracker.get_file(ft_file, out_file_path, add_to_cache=False)
+        reader, _version = self.filetracker.get_stream(ft_file)
+        try:
+            return reader.read()
+        finally:
+            reader.close()
+
+
+def _add_to_tar(tar, name, content, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    info.mtime = mtime
+    info.mode = 0600
+    tar.addfile(info, StringIO(content))
 
 
 def build_submissions_archive(out_file, submission_collector):
@@ -111,40 +139,56 @@ def build_submissions_archive(out_file, submission_collector):
     Builds submissions archive, in szubrawcy format, in out_file from data
     provided by submission_collector. Argument out_file should be a file-like
     object.
+
+    The sources are downloaded by ``settings.EXPORTSZU_DOWNLOAD_CONCURRENCY``
+    threads, in batches of ``settings.EXPORTSZU_DOWNLOAD_BATCH_SIZE``, and
+    written straight to the archive.
     """
     submission_list = submission_collector.collect_list()
-    tmpdir = tempfile.mkdtemp()
-    try:
-        contest_id = submission_collector.get_contest_id()
-        files_dir = os.path.join(tmpdir, contest_id)
-        os.mkdir(files_dir, 0700)
-        with open(os.path.join(files_dir, 'INDEX'), 'w') as f:
-            index_csv = csv.writer(f)
-            header = ['submission_id', 'user_id', 'username', 'first_name',
-                'last_name', 'city', 'school', 'school_city',
-                'problem_short_name', 'score']
-            index_csv.writerow(header)
-            for s in submission_list:
-                index_entry = [s.submission_id, s.user_id, s.username,
-                    s.first_name, s.last_name, s.city, s.school, s.school_city,
-                    s.problem_short_name, s.score]
-
-                def encode(obj):
-                    if obj is None:
-                        return 'NULL'
-                    else:
-                        return force_text(obj).encode('utf8')
-
-                index_csv.writerow([encode(col) for col in index_entry])
-
-        for s in submission_list:
-            filename = '%s:%s:%s.%s' % (
-                    s.submission_id, s.username, s.problem_short_name,
-                    s.solution_language)
-            dest = os.path.join(files_dir, filename)
-            submission_collector.get_submission_source(dest, s.source_file)
+    contest_id = submission_collector.get_contest_id()
+    mtime = time.time()
 
+    def encode(obj):
+        if obj is None:
+            return 'NULL'
+        else:
+            return force_text(obj).encode('utf8')
+
+    index = StringIO()
+    index_csv = csv.writer(index)
+    header = ['submission_id', 'user_id', 'username', 'first_name',
+        'last_name', 'city', 'school', 'school_city',
+        'problem_short_name', 'score']
+    index_csv.writerow(header)
+    for s in submission_list:
+        index_entry = [s.submission_id, s.user_id, s.username,
+            s.first_name, s.last_name, s.city, s.school, s.school_city,
+            s.problem_short_name, s.score]
+        index_csv.writerow([encode(col) for col in index_entry])
+
+    def get_source(s):
+        return submission_collector \
+                .get_submission_source_content(s.source_file)
+
+    pool = ThreadPool(max(1, settings.EXPORTSZU_DOWNLOAD_CONCURRENCY))
+    try:
         with tarfile.open(fileobj=out_file, mode='w:gz') as tar:
-            tar.add(files_dir, arcname=contest_id)
+            dir_info = tarfile.TarInfo(contest_id)
+            dir_info.type = tarfile.DIRTYPE
+            dir_info.mode = 0700
+            dir_info.mtime = mtime
+            tar.addfile(dir_info)
+            _add_to_tar(tar, '%s/INDEX' % contest_id, index.getvalue(),
+                        mtime)
+
+            batch_size = settings.EXPORTSZU_DOWNLOAD_BATCH_SIZE
+            for i in xrange(0, len(submission_list), batch_size):
+                batch = submission_list[i:i + batch_size]
+                for s, content in zip(batch, pool.map(get_source, batch)):
+                    filename = '%s/%s:%s:%s.%s' % (contest_id,
+                            s.submission_id, s.username,
+                            s.problem_short_name, s.solution_language)
+                    _add_to_tar(tar, filename, content, mtime)
     finally:
-        shutil.rmtree(tmpdir)
+        pool.close()
+        pool.join()
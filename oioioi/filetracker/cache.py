@@ -0,0 +1,183 @@
+import errno
+import hashlib
+import logging
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+
+from oioioi.base.utils import memoized, reset_memoized
+
+
+logger = logging.getLogger(__name__)
+
+_HITS_KEY = 'filetracker_read_cache_hits'
+_MISSES_KEY = 'filetracker_read_cache_misses'
+
+# Part of the cache left free after eviction, so that it isn't run on every
+# file added to a full cache.
+_EVICTION_SLACK = 0.1
+
+_TMP_PREFIX = '.tmp'
+
+
+class FileReadCache(object):
+    """A bounded on-disk cache of immutable Filetracker files.
+
+       Files are identified by keys, which must uniquely determine their
+       contents (like versioned Filetracker paths). When the total size of
+       the cached files exceeds ``max_size`` bytes, the least recently used
+       files are removed.
+
+       The cache directory may be shared by many processes. The numbers of
+       hits and misses are counted in the Django cache, see :meth:`stats`.
+    """
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    def local_path(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def get(self, key):
+        """Returns the local path of the cached file, or ``None`` if
+           the file is not in the cache.
+        """
+        path = self.local_path(key)
+        try:
+            # The modification time is used as the time of the last use.
+            os.utime(path, None)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self._count(_MISSES_KEY)
+            return None
+        self._count(_HITS_KEY)
+        return path
+
+    def put(self, key, stream):
+        """Stores the contents of ``stream`` in the cache and returns the local
+           path of the cached file.
+        """
+        path = self.local_path(key)
+        dir = os.path.dirname(path)
+        try:
+            os.makedirs(dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        f = tempfile.NamedTemporaryFile(dir=dir, prefix=_TMP_PREFIX,
+                                        delete=False)
+        try:
+            with f:
+                shutil.copyfileobj(stream, f)
+            size = os.path.getsize(f.name)
+            os.rename(f.name, path)
+        except:
+            os.unlink(f.name)
+            raise
+        self._added(size)
+        return path
+
+    def discard(self, key):
+        """Removes the file from the cache, if it's there."""
+        try:
+            os.unlink(self.local_path(key))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _count(self, key):
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The key has been evicted from the cache in the meantime.
+            pass
+
+    def _cached_files(self):
+        for dir, _dirnames, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.startswith(_TMP_PREFIX):
+                    # Being written.
+                    continue
+                path = os.path.join(dir, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _added(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _path, size, _mtime
+                                 in self._cached_files())
+            else:
+                self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # Other processes may have added or removed files, so the size is
+        # recomputed here.
+        files = sorted(self._cached_files(), key=lambda f: f[2])
+        self._size = sum(size for _path, size, _mtime in files)
+        target_size = self.max_size * (1 - _EVICTION_SLACK)
+        for path, size, _mtime in files:
+            if self._size <= target_size:
+                break
+            try:
+                # Files opened before are still readable after unlinking.
+                os.unlink(path)
+            except OSError:
+                continue
+            self._size -= size
+        logger.debug("Filetracker read cache evicted, size is %d bytes now",
+                     self._size)
+
+    def stats(self):
+        """Returns a dict with the numbers of cache hits and misses, and
+           the current number and total size of the cached files.
+        """
+        files = list(self._cached_files())
+        return {
+            'hits': cache.get(_HITS_KEY, 0),
+            'misses': cache.get(_MISSES_KEY, 0),
+            'files': len(files),
+            'size': sum(size for _path, size, _mtime in files),
+        }
+
+    def reset_stats(self):
+        cache.delete_many([_HITS_KEY, _MISSES_KEY])
+
+
+@memoized
+def get_read_cache():
+    """Returns the :class:`FileReadCache` used by
+       :class:`~oioioi.filetracker.storage.FiletrackerStorage`, or ``None``
+       if ``settings.FILETRACKER_READ_CACHE_ROOT`` is not set.
+    """
+    if not settings.FILETRACKER_READ_CACHE_ROOT:
+        return None
+    return FileReadCache(settings.FILETRACKER_READ_CACHE_ROOT,
+                         settings.FILETRACKER_READ_CACHE_SIZE)
+
+
+@receiver(setting_changed)
+def _on_setting_changed(sender, setting, **kwargs):
+    if setting in ('FILETRACKER_READ_CACHE_ROOT',
+                   'FILETRACKER_READ_CACHE_SIZE'):
+        reset_memoized(get_read_cache)
@@ -2,14 +2,23 @@ import datetime
 import itertools
 import optparse
 
+from django.apps import apps
 from django.core.management.base import BaseCommand
-from django.db.models.loading import cache
 from django.utils.translation import ugettext as _, ungettext
 
 from oioioi.filetracker.client import get_client
+from oioioi.filetracker.models import FileBlob
+from oioioi.filetracker.storage import blob_digest, blob_path
 from filetracker import split_name
 
 
+def _needed_file(name):
+    # Deduplicated files are stored under a name different than the one
+    # kept in the database.
+    digest = blob_digest(name)
+    return blob_path(digest) if digest else name
+
+
 class Command(BaseCommand):
     help = _("Delete all orphaned files older than specified number of days.")
     base_options = (
@@ -27,16 +36,15 @@ class Command(BaseCommand):
 
     def _get_needed_files(self):
         result = []
-        for app in cache.get_apps():
-            model_list = cache.get_models(app)
-            for model in model_list:
-                file_fields = [field.name for field in model._meta.fields
-                               if field.get_internal_type() == 'FileField']
+        for model in apps.get_models():
+            file_fields = [field.name for field in model._meta.fields
+                           if field.get_internal_type() == 'FileField']
 
-                if len(file_fields) > 0:
-                    files = model.objects.all().values_list(*file_fields)
-                    result.extend([split_name(file)[0] for file in itertools.
-                                  chain.from_iterable(files) if file])
+            if len(file_fields) > 0:
+                files = model.objects.all().values_list(*file_fields)
+                result.extend([_needed_file(split_name(file)[0])
+                               for file in itertools.
+                               chain.from_iterable(files) if file])
         return result
 
     def handle(self, *args, **options):
@@ -77,4 +85,9 @@ class Command(BaseCommand):
             for file in to_delete:
                 if int(options['verbosity']) > 1:
                     print " ", file
+                digest = blob_digest(file)
+                if digest:
+                    # Forget the blob, so that it's uploaded again when
+                    # an identical file is saved.
+                    FileBlob.objects.filter(digest=digest).delete()
                 get_client().delete_file('/' + file)
@@ -0,0 +1,91 @@
+import optparse
+import re
+import shutil
+import tempfile
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.translation import ugettext as _, ungettext
+
+from oioioi.filetracker.storage import FiletrackerStorage, blob_digest
+
+
+class Command(BaseCommand):
+    help = _("Store files matching FILETRACKER_DEDUPLICATED_NAMES by their "
+             "content, so that identical files are kept only once. The "
+             "original files are left for the collectgarbage command.")
+    option_list = BaseCommand.option_list + (
+        optparse.make_option('-a', '--all', action='store_true',
+                             dest='all', default=False,
+                             help=_("Deduplicate all the files, not only "
+                                    "those matching "
+                                    "FILETRACKER_DEDUPLICATED_NAMES.")),
+        optparse.make_option('-p', '--pretend', action='store_true',
+                             dest='pretend', default=False,
+                             help=_("If set, the files will only be counted, "
+                                    "not deduplicated.")),
+    )
+
+    def _file_fields(self):
+        for model in apps.get_models():
+            for field in model._meta.fields:
+                if field.get_internal_type() == 'FileField' and \
+                        isinstance(field.storage, FiletrackerStorage):
+                    yield model, field
+
+    def _should_deduplicate(self, name, options):
+        return not blob_digest(name) and (options['all'] or
+                re.match(settings.FILETRACKER_DEDUPLICATED_NAMES, name))
+
+    def _deduplicate(self, storage, name, tmpdir, blobs):
+        """Returns the deduplicated name for the file. The file is
+           downloaded only once, even if it's referenced many times.
+        """
+        if name not in blobs:
+            tmpfile = tempfile.NamedTemporaryFile(dir=tmpdir, delete=False)
+            with tmpfile:
+                shutil.copyfileobj(storage.open(name, 'rb'), tmpfile)
+            blobs[name] = storage.save_blob(tmpfile.name, name)
+        else:
+            storage._add_blob_reference(blob_digest(blobs[name]))
+        return blobs[name]
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        blobs = {}
+        count = 0
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for model, field in self._file_fields():
+                rows = model.objects.exclude(**{field.name: ''}) \
+                        .exclude(**{field.name + '__isnull': True}) \
+                        .values_list('pk', field.name)
+                for pk, name in rows.iterator():
+                    if not self._should_deduplicate(name, options):
+                        continue
+                    count += 1
+                    if options['pretend']:
+                        continue
+                    if verbosity > 1:
+                        print " ", name
+                    with transaction.atomic():
+                        new_name = self._deduplicate(field.storage, name,
+                                                     tmpdir, blobs)
+                        model.objects.filter(pk=pk) \
+                                .update(**{field.name: new_name})
+        finally:
+            shutil.rmtree(tmpdir)
+
+        if verbosity > 0:
+            if options['pretend']:
+                print ungettext("%d file to deduplicate.",
+                                "%d files to deduplicate.", count) % count
+            else:
+                print ungettext("Deduplicated %(count)d file, "
+                                "%(blobs)d distinct contents.",
+                                "Deduplicated %(count)d files, "
+                                "%(blobs)d distinct contents.", count) \
+                        % {'count': count,
+                           'blobs': len(set(blobs.itervalues()))}
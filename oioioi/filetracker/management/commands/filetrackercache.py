@@ -0,0 +1,34 @@
+import optparse
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.translation import ugettext as _
+
+from oioioi.filetracker.cache import get_read_cache
+
+
+class Command(BaseCommand):
+    help = _("Show statistics of the cache of files read from Filetracker "
+             "(see FILETRACKER_READ_CACHE_ROOT).")
+    option_list = BaseCommand.option_list + (
+        optparse.make_option('--reset', action='store_true',
+                             dest='reset', default=False,
+                             help=_("Reset the hit and miss counters.")),
+    )
+
+    def handle(self, *args, **options):
+        read_cache = get_read_cache()
+        if read_cache is None:
+            raise CommandError(_("FILETRACKER_READ_CACHE_ROOT is not set."))
+
+        stats = read_cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        hit_ratio = 100. * stats['hits'] / lookups if lookups else 0.
+        print _("Hits: %(hits)d, misses: %(misses)d "
+                "(hit ratio %(ratio).1f%%)") % {'hits': stats['hits'], 'misses': stats['misses'],
+                   'ratio': hit_ratio}
+        print _("Cached files: %(files)d, %(size)d of %(max_size)d bytes") \
+                % {'files': stats['files'], 'size': stats['size'],
+                   'max_size': read_cache.max_size}
+
+        if options['reset']:
+            read_cache.reset_stats()
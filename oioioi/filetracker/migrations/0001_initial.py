@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import oioioi.filetracker.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 digest')),
+                ('refcount', models.IntegerField(default=0, verbose_name='reference count')),
+            ],
+        ),
+    ]
+
+    # TestFileModel exists only when running tests.
+    if getattr(settings, 'TESTS', False):
+        operations.append(migrations.CreateModel(
+            name='TestFileModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_field', oioioi.filetracker.fields.FileField(max_length=255, upload_to='tests')),
+            ],
+        ))
@@ -1,8 +1,23 @@
 from nose.tools import nottest
 from django.conf import settings
 from django.db import models
+from django.utils.translation import ugettext_lazy as _
 from oioioi.filetracker.fields import FileField
 
+
+class FileBlob(models.Model):
+    """A file stored in Filetracker once for all its identical copies (see
+       :class:`~oioioi.filetracker.storage.FiletrackerStorage`).
+
+       ``refcount`` is the number of references to the file held by
+       ``FileField``\\ s.
+    """
+    digest = models.CharField(max_length=64, unique=True,
+            verbose_name=_("SHA-256 digest"))
+    refcount = models.IntegerField(default=0,
+            verbose_name=_("reference count"))
+
+
 if getattr(settings, 'TESTS', False):
     class TestFileModel(models.Model):
         file_field = FileField(upload_to='tests')
@@ -1,18 +1,76 @@
+from django.conf import settings
 from django.core.files.storage import Storage
 from django.core.files import File
 from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.db.models import F
+from oioioi.filetracker.cache import get_read_cache
 from oioioi.filetracker.client import get_client
 from oioioi.filetracker.utils import FileInFiletracker
 from oioioi.filetracker.filename import FiletrackerFilename
 
+import hashlib
 import os
 import os.path
+import re
 import tempfile
 import datetime
 
+import filetracker
+
+
+BLOBS_DIR = 'blobs'
+
+_blob_name_re = re.compile(r'^%s/[0-9a-f]{2}/([0-9a-f]{64})(/[^/]+)?$'
+                           % BLOBS_DIR)
+
+
+def blob_digest(name):
+    """Returns the content digest of a deduplicated file with the given
+       name, or ``None`` if the file is not deduplicated.
+    """
+    match = _blob_name_re.match(name)
+    return match.group(1) if match else None
+
+
+def blob_path(digest):
+    """Returns the name, under which the content with the given digest is
+       stored in Filetracker (relative to the storage prefix).
+    """
+    return '%s/%s/%s' % (BLOBS_DIR, digest[:2], digest)
+
+
+def file_digest(filename):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
 
 class FiletrackerStorage(Storage):
+    """A Django storage keeping files in Filetracker.
+
+       If ``settings.FILETRACKER_DEDUPLICATION`` is set, files with names
+       matching ``settings.FILETRACKER_DEDUPLICATED_NAMES`` (test data by
+       default) are stored by content: identical files are kept in
+       Filetracker only once, as ``blobs/<xx>/<sha256>``, and the names
+       returned by :meth:`save` (stored in ``FileField``\ s) look like
+       ``blobs/<xx>/<sha256>/<original basename>``. Such files are
+       reference-counted with :class:`~oioioi.filetracker.models.FileBlob`,
+       so that deleting one of them doesn't affect the others.
+
+       Storages using the default Filetracker client keep the files they
+       read in the :class:`~oioioi.filetracker.cache.FileReadCache`, if
+       ``settings.FILETRACKER_READ_CACHE_ROOT`` is set. Only files which
+       can't change are cached: those with versioned names and the
+       deduplicated ones.
+    """
+
     def __init__(self, prefix='/', client=None):
+        # The read cache is keyed by Filetracker paths, so it may be used
+        # only with the client it has been filled with.
+        self._uses_default_client = client is None
         if client is None:
             client = get_client()
         assert prefix.startswith('/'), \
@@ -27,8 +85,75 @@ class FiletrackerStorage(Storage):
         if os.path.isabs(name):
             raise ValueError('FiletrackerStorage does not support absolute '
                     'paths')
+        digest = blob_digest(name.replace(os.sep, '/'))
+        if digest:
+            name = blob_path(digest)
         return os.path.join(self.prefix, name).replace(os.sep, '/')
 
+    def _should_deduplicate(self, name):
+        return settings.FILETRACKER_DEDUPLICATION and \
+                re.match(settings.FILETRACKER_DEDUPLICATED_NAMES, name)
+
+    def save_blob(self, filename, name):
+        """Stores the local file ``filename`` by its content (uploading it
+           only if an identical file isn't stored yet) and returns the name
+           of the deduplicated file, with the basename of ``name``.
+        """
+        from oioioi.filetracker.models import FileBlob
+        digest = file_digest(filename)
+        path = self._make_filetracker_path(blob_path(digest))
+        with transaction.atomic():
+            blob, created = FileBlob.objects.select_for_update() \
+                    .get_or_create(digest=digest)
+            # The content of a blob may have been removed by the
+            # collectgarbage command, if no FileField referenced it.
+            if created or not self._in_filetracker(path):
+                self.client.put_file(path, filename, to_local_store=False)
+            FileBlob.objects.filter(id=blob.id) \
+                    .update(refcount=F('refcount') + 1)
+        return '%s/%s' % (blob_path(digest), os.path.basename(name))
+
+    def _add_blob_reference(self, digest):
+        from oioioi.filetracker.models import FileBlob
+        FileBlob.objects.filter(digest=digest) \
+                .update(refcount=F('refcount') + 1)
+
+    def _read_cache_key(self, name):
+        if isinstance(name, FiletrackerFilename):
+            name = name.versioned_name
+        path = self._make_filetracker_path(name)
+        if blob_digest(name.replace(os.sep, '/')) is None \
+                and filetracker.split_name(path)[1] is None:
+            return None
+        return path
+
+    def _get_read_cache(self):
+        if not self._uses_default_client:
+            return None
+        return get_read_cache()
+
+    def cached_local_path(self, name, fetch=True):
+        """Returns the path of a local copy of the file in the read cache.
+
+           If the file is not cached yet, it's downloaded first, unless
+           ``fetch`` is ``False``. Returns ``None`` if the file can't be
+           cached.
+        """
+        read_cache = self._get_read_cache()
+        if read_cache is None:
+            return None
+        key = self._read_cache_key(name)
+        if key is None:
+            return None
+        path = read_cache.get(key)
+        if path is None and fetch:
+            reader, _version = self.client.get_stream(key)
+            try:
+                path = read_cache.put(key, reader)
+            finally:
+                reader.close()
+        return path
+
     def _cut_prefix(self, path):
         assert path.startswith(self.prefix), \
                 'Path passed to _cut_prefix does not start with prefix'
@@ -41,6 +166,9 @@ class FiletrackerStorage(Storage):
         if 'w' in mode or '+' in mode or 'a' in mode:
             raise ValueError('FiletrackerStorage.open does not support '
                     'writing. Use FiletrackerStorage.save.')
+        local_path = self.cached_local_path(name)
+        if local_path is not None:
+            return File(open(local_path, 'rb'), FiletrackerFilename(name))
         path = self._make_filetracker_path(name)
         reader, _version = self.client.get_stream(path)
         return File(reader, FiletrackerFilename(name))
@@ -57,6 +185,9 @@ class FiletrackerStorage(Storage):
             # This happens when used with field assignment
             # We are ignoring suggested name, as copying files in filetracker
             # isn't implemented
+            digest = blob_digest(content.file.name)
+            if digest:
+                self._add_blob_reference(digest)
             return content.file.name
         elif isinstance(content, FileInFiletracker):
             # This happens when file_field.save(path, file) is called
@@ -68,6 +199,10 @@ class FiletrackerStorage(Storage):
                 f.write(chunk)
             f.flush()
             filename = f.name
+        if self._should_deduplicate(name):
+            name = FiletrackerFilename(self.save_blob(filename, name))
+            content.close()
+            return name
         # If there will be only local store, filetracker will ignore
         # 'to_local_store' argument.
         name = self._cut_prefix(self.client.put_file(path, filename,
@@ -78,6 +213,9 @@ class FiletrackerStorage(Storage):
 
     def read_using_cache(self, name):
         """Opens a file using a cache (if it's possible)"""
+        local_path = self.cached_local_path(name)
+        if local_path is not None:
+            return File(open(local_path, 'rb'), FiletrackerFilename(name))
         path = self._make_filetracker_path(name)
         reader, _version = self.client.get_stream(path, serve_from_cache=True)
         return File(reader, FiletrackerFilename(name))
@@ -90,15 +228,37 @@ class FiletrackerStorage(Storage):
             name = content.name
         if not hasattr(content, 'chunks'):
             content = File(content)
-        name = self.get_available_name(name)
+        if not self._should_deduplicate(name):
+            name = self.get_available_name(name)
         return self._save(name, content)
 
     def delete(self, name):
         path = self._make_filetracker_path(name)
+        digest = blob_digest(name)
+        if digest:
+            from oioioi.filetracker.models import FileBlob
+            with transaction.atomic():
+                blob = FileBlob.objects.select_for_update() \
+                        .filter(digest=digest).first()
+                if blob is None:
+                    return
+                if blob.refcount > 1:
+                    FileBlob.objects.filter(id=blob.id) \
+                            .update(refcount=F('refcount') - 1)
+                    return
+                blob.delete()
+        read_cache = self._get_read_cache()
+        key = self._read_cache_key(name)
+        if read_cache is not None and key is not None:
+            read_cache.discard(key)
         self.client.delete_file(path)
 
     def exists(self, name):
-        path = self._make_filetracker_path(name)
+        if self.cached_local_path(name, fetch=False) is not None:
+            return True
+        return self._in_filetracker(self._make_filetracker_path(name))
+
+    def _in_filetracker(self, path):
         try:
             self.client.file_version(path)
             return True
@@ -107,6 +267,13 @@ class FiletrackerStorage(Storage):
             return False
 
     def size(self, name):
+        local_path = self.cached_local_path(name, fetch=False)
+        if local_path is not None:
+            try:
+                return os.path.getsize(local_path)
+            except OSError:
+                # Evicted in the meantime.
+                pass
         path = self._make_filetracker_path(name)
         return self.client.file_size(path)
 
@@ -4,18 +4,27 @@ from django.core.urlresolvers import reverse
 from django.core.files.base import ContentFile
 from django.db.models.fields.files import FieldFile, FileField
 from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test.utils import override_settings
 
 from oioioi.base.tests import TestCase
-from oioioi.filetracker.models import TestFileModel
-from oioioi.filetracker.storage import FiletrackerStorage
+from oioioi.filetracker.cache import FileReadCache, get_read_cache
+from oioioi.filetracker.client import get_client
+from oioioi.filetracker.models import FileBlob, TestFileModel
+from oioioi.filetracker.storage import FiletrackerStorage, blob_digest, \
+        blob_path
 from oioioi.filetracker.utils import django_to_filetracker_path, \
-        filetracker_to_django_file, make_content_disposition_header
+        filetracker_to_django_file, make_content_disposition_header, \
+        stream_file
 import filetracker
 import filetracker.dummy
 
+from cStringIO import StringIO
+from mock import patch
 import tempfile
 import shutil
 import datetime
+import os
 
 
 class TestFileField(TestCase):
@@ -160,6 +169,196 @@ class TestFileFixtures(TestCase):
         self.assertEqual(instance.file_field.read(), 'whatever\x01\xff')
 
 
+@override_settings(FILETRACKER_DEDUPLICATION=True,
+                   FILETRACKER_DEDUPLICATED_NAMES=r'^dedup/')
+class TestDeduplication(TestCase):
+    def test_deduplicated_storage(self):
+        storage = FiletrackerStorage()
+        name1 = storage.save('dedup/a.in', ContentFile('same'))
+        name2 = storage.save('dedup/b.in', ContentFile('same'))
+        name3 = storage.save('other/c.in', ContentFile('same'))
+
+        self.assertTrue(name1.startswith('blobs/'))
+        self.assertTrue(name1.endswith('/a.in'))
+        self.assertTrue(name2.endswith('/b.in'))
+        self.assertEqual(blob_digest(name1), blob_digest(name2))
+        self.assertIsNone(blob_digest(name3))
+        blob = FileBlob.objects.get()
+        self.assertEqual(blob.digest, blob_digest(name1))
+        self.assertEqual(blob.refcount, 2)
+
+        storage.delete(name1)
+        self.assertEqual(FileBlob.objects.get().refcount, 1)
+        self.assertEqual(storage.open(name2, 'rb').read(), 'same')
+
+        storage.delete(name2)
+        self.assertFalse(FileBlob.objects.exists())
+        self.assertFalse(storage.exists(name2))
+        storage.delete(name3)
+
+    def test_field_assignment(self):
+        name = default_storage.save('dedup/a.out', ContentFile('data'))
+        model = TestFileModel()
+        model.file_field = filetracker_to_django_file(
+                django_to_filetracker_path(default_storage.open(name)))
+        model.save()
+        self.assertEqual(blob_digest(model.file_field.name),
+                         blob_digest(name))
+        self.assertEqual(FileBlob.objects.get().refcount, 2)
+
+        default_storage.delete(name)
+        model = TestFileModel.objects.get()
+        self.assertEqual(model.file_field.read(), 'data')
+        model.file_field.delete()
+        self.assertFalse(FileBlob.objects.exists())
+
+    def test_deduplicatefiles_command(self):
+        with override_settings(FILETRACKER_DEDUPLICATION=False):
+            names = [default_storage.save('dedup/%d.in' % i,
+                                          ContentFile('same'))
+                     for i in xrange(3)]
+            other = default_storage.save('other.in', ContentFile('same'))
+        for name in names + [other]:
+            TestFileModel.objects.create(file_field=name)
+
+        call_command('deduplicatefiles', pretend=True, verbosity=0)
+        self.assertFalse(FileBlob.objects.exists())
+
+        call_command('deduplicatefiles', verbosity=0)
+        blob = FileBlob.objects.get()
+        self.assertEqual(blob.refcount, 3)
+        for model in TestFileModel.objects.all():
+            if model.file_field.name == other:
+                continue
+            self.assertEqual(blob_digest(model.file_field.name), blob.digest)
+            self.assertEqual(model.file_field.read(), 'same')
+
+        # Running the command again changes nothing.
+        call_command('deduplicatefiles', verbosity=0)
+        self.assertEqual(FileBlob.objects.get().refcount, 3)
+
+        for name in names + [other]:
+            default_storage.delete(name)
+
+    def test_removed_blob_uploaded_again(self):
+        storage = FiletrackerStorage()
+        name = storage.save('dedup/a.in', ContentFile('data'))
+        path = blob_path(blob_digest(name))
+
+        # Nothing references the file, so collectgarbage removes it.
+        with patch.object(get_client(), 'list_local_files',
+                          return_value=[(path, 0)]):
+            call_command('collectgarbage', days=0, verbosity=0)
+        self.assertFalse(FileBlob.objects.exists())
+        self.assertFalse(storage.exists(name))
+
+        name1 = storage.save('dedup/b.in', ContentFile('data'))
+        self.assertEqual(FileBlob.objects.get().refcount, 1)
+        self.assertEqual(storage.open(name1, 'rb').read(), 'data')
+
+        # The content is uploaded again even if the blob is still known.
+        get_client().delete_file('/' + path)
+        name2 = storage.save('dedup/c.in', ContentFile('data'))
+        self.assertEqual(FileBlob.objects.get().refcount, 2)
+        self.assertEqual(storage.open(name1, 'rb').read(), 'data')
+        storage.delete(name1)
+        storage.delete(name2)
+
+
+class TestReadCache(TestCase, TestStreamingMixin):
+    fixtures = ['test_users']
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+                FILETRACKER_READ_CACHE_ROOT=self.cache_dir)
+        self.settings_override.enable()
+        get_read_cache().reset_stats()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.cache_dir)
+
+    def test_storage_reads(self):
+        storage = FiletrackerStorage()
+        name = storage.save('cached/file.txt', ContentFile('eloziom'))
+        other_name = storage.save('cached/other.txt', ContentFile('foo'))
+        try:
+            self.assertEqual(storage.open(name, 'rb').read(), 'eloziom')
+            self.assertEqual(get_read_cache().stats()['misses'], 1)
+
+            with patch.object(storage.client, 'get_stream') as get_stream, \
+                    patch.object(storage.client, 'file_size') as file_size:
+                self.assertEqual(storage.open(name, 'rb').read(), 'eloziom')
+                self.assertTrue(storage.exists(name))
+                self.assertEqual(storage.size(name), 7)
+                self.assertFalse(get_stream.called)
+                self.assertFalse(file_size.called)
+            stats = get_read_cache().stats()
+            self.assertEqual(stats['hits'], 3)
+            self.assertEqual(stats['files'], 1)
+            self.assertEqual(stats['size'], 7)
+
+            # Files with unversioned names may change, so they are not cached.
+            self.assertEqual(storage.open(unicode(other_name), 'rb').read(),
+                             'foo')
+            self.assertEqual(get_read_cache().stats()['files'], 1)
+        finally:
+            storage.delete(name)
+            storage.delete(other_name)
+        self.assertEqual(get_read_cache().stats()['files'], 0)
+        self.assertFalse(storage.exists(name))
+
+    def test_custom_client_not_cached(self):
+        dir = tempfile.mkdtemp()
+        try:
+            client = filetracker.Client(cache_dir=dir, remote_store=None)
+            storage = FiletrackerStorage(client=client)
+            name = storage.save('cached/file.txt', ContentFile('eloziom'))
+            self.assertEqual(storage.open(name, 'rb').read(), 'eloziom')
+            self.assertEqual(get_read_cache().stats()['files'], 0)
+        finally:
+            shutil.rmtree(dir)
+
+    def test_eviction(self):
+        read_cache = FileReadCache(self.cache_dir, 10)
+        path_a = read_cache.put('a', StringIO('aaaa'))
+        path_b = read_cache.put('b', StringIO('bbbb'))
+        os.utime(path_a, (1, 1))
+        self.assertEqual(read_cache.get('b'), path_b)
+        read_cache.put('c', StringIO('cccc'))
+
+        self.assertIsNone(read_cache.get('a'))
+        self.assertEqual(read_cache.get('b'), path_b)
+        self.assertEqual(open(read_cache.get('c')).read(), 'cccc')
+        self.assertEqual(read_cache.stats()['size'], 8)
+
+    @override_settings(FILETRACKER_SENDFILE_HEADER='X-Accel-Redirect',
+                       FILETRACKER_SENDFILE_URL='/internal/')
+    def test_sendfile(self):
+        name = default_storage.save('cached/file.txt', ContentFile('foo'))
+        try:
+            self.client.login(username='test_admin')
+            url = reverse('oioioi.filetracker.views.raw_file_view',
+                    kwargs={'filename': name.versioned_name})
+            response = self.client.get(url)
+            self.assertFalse(response.streaming)
+            self.assertEqual(response.content, '')
+            self.assertEqual(response['Content-Length'], '3')
+            path = get_read_cache().local_path(
+                    '/' + name.versioned_name)
+            self.assertEqual(response['X-Accel-Redirect'], '/internal/'
+                    + os.path.relpath(path, self.cache_dir))
+
+            with override_settings(FILETRACKER_SENDFILE_HEADER='X-Sendfile'):
+                response = stream_file(
+                        TestFileModel(file_field=name).file_field)
+                self.assertFalse(response.streaming)
+                self.assertEqual(response['X-Sendfile'], path)
+        finally:
+            default_storage.delete(name)
+
+
 class TestFileUtils(TestCase):
     def test_content_disposition(self):
         value = make_content_disposition_header('inline', u'EURO rates.txt')
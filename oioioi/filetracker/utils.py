@@ -1,10 +1,12 @@
 import mimetypes
+import os.path
 import urllib
 
 from wsgiref.util import FileWrapper
+from django.conf import settings
 from django.core.files.storage import default_storage
 from django.core.files import File
-from django.http import StreamingHttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 
 from oioioi.filetracker.filename import FiletrackerFilename
 
@@ -88,6 +90,31 @@ def make_content_disposition_header(disposition, filename):
     return header
 
 
+def sendfile_response(storage, name, content_type):
+    """Returns a :class:`HttpResponse` asking the web server to send
+       the file from the Filetracker read cache itself (see
+       ``settings.FILETRACKER_SENDFILE_HEADER``).
+
+       Returns ``None`` if this is disabled or the file can't be cached.
+    """
+    header = settings.FILETRACKER_SENDFILE_HEADER
+    if not header or not hasattr(storage, 'cached_local_path'):
+        return None
+    path = storage.cached_local_path(name)
+    if path is None:
+        return None
+    response = HttpResponse(content_type=content_type)
+    if header == 'X-Accel-Redirect':
+        relative_path = os.path.relpath(path,
+                settings.FILETRACKER_READ_CACHE_ROOT)
+        response[header] = settings.FILETRACKER_SENDFILE_URL.rstrip('/') \
+                + '/' + urllib.quote(relative_path)
+    else:
+        response[header] = path
+    response['Content-Length'] = os.path.getsize(path)
+    return response
+
+
 def stream_file(django_file, name=None, showable=None):
     """Returns a :class:`HttpResponse` representing a file download.
 
@@ -103,9 +130,14 @@ def stream_file(django_file, name=None, showable=None):
         name = unicode(django_file.name.rsplit('/', 1)[-1])
     content_type = mimetypes.guess_type(name)[0] or \
         'application/octet-stream'
-    response = StreamingHttpResponse(FileWrapper(django_file),
-        content_type=content_type)
-    response['Content-Length'] = django_file.size
+    response = None
+    if getattr(django_file, 'storage', None):
+        response = sendfile_response(django_file.storage, django_file.name,
+                                     content_type)
+    if response is None:
+        response = StreamingHttpResponse(FileWrapper(django_file),
+            content_type=content_type)
+        response['Content-Length'] = django_file.size
     showable_exts = ['pdf', 'ps', 'txt']
     if showable is None:
         extension = name.rsplit('.')[-1]
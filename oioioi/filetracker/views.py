@@ -4,6 +4,9 @@ from django.http import Http404, StreamingHttpResponse
 from django.core.exceptions import PermissionDenied
 import mimetypes
 
+from oioioi.filetracker.filename import FiletrackerFilename
+from oioioi.filetracker.utils import sendfile_response
+
 
 def raw_file_view(request, filename):
     if not filename or filename.startswith('/'):
@@ -13,9 +16,12 @@ def raw_file_view(request, filename):
     if not default_storage.exists(filename):
         raise Http404
 
+    content_type = mimetypes.guess_type(FiletrackerFilename(filename))[0] \
+        or 'application/octet-stream'
+    response = sendfile_response(default_storage, filename, content_type)
+    if response is not None:
+        return response
     file = default_storage.open(filename, 'rb')
-    content_type = mimetypes.guess_type(file.name)[0] or \
-        'application/octet-stream'
     response = StreamingHttpResponse(FileWrapper(file),
                                      content_type=content_type)
     response['Content-Length'] = file.size
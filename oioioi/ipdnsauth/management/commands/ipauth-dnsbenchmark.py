@@ -0,0 +1,132 @@
+from optparse import make_option
+import itertools
+import socket
+import threading
+import time
+from dnslib import DNSRecord
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from oioioi.ipdnsauth.models import IpToUser
+from oioioi.ipdnsauth.utils import username_to_hostname
+
+
+def _reverse_name(ip_addr):
+    return '.'.join(reversed(ip_addr.split('.'))) + '.in-addr.arpa'
+
+
+def run_benchmark(server_addr, questions, num_queries, num_threads,
+                  timeout=1.0):
+    """Sends ``num_queries`` DNS queries over UDP to ``server_addr``, from
+       ``num_threads`` threads at once, cycling through ``questions`` (pairs
+       of a name and a query type).
+
+       Returns a dict with the number of ``answered`` and ``failed`` (not
+       answered in ``timeout`` seconds) queries, the total ``time`` and
+       the sorted list of ``latencies`` of the answered queries.
+    """
+    packets = [DNSRecord.question(name, qtype).pack()
+               for name, qtype in questions]
+    lock = threading.Lock()
+    results = {'answered': 0, 'failed': 0, 'latencies': []}
+
+    def worker(count, offset):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(timeout)
+        answered = 0
+        latencies = []
+        try:
+            for packet in itertools.islice(
+                    itertools.cycle(packets[offset % len(packets):] +
+                                    packets[:offset % len(packets)]),
+                    count):
+                start = time.time()
+                sock.sendto(packet, server_addr)
+                try:
+                    DNSRecord.parse(sock.recv(4096))
+                except socket.timeout:
+                    continue
+                latencies.append(time.time() - start)
+                answered += 1
+        finally:
+            sock.close()
+        with lock:
+            results['answered'] += answered
+            results['failed'] += count - answered
+            results['latencies'].extend(latencies)
+
+    threads = []
+    start = time.time()
+    for i in xrange(num_threads):
+        count = num_queries // num_threads + \
+                (1 if i < num_queries % num_threads else 0)
+        thread = threading.Thread(target=worker, args=(count, i))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    results['time'] = time.time() - start
+    results['latencies'].sort()
+    return results
+
+
+class Command(BaseCommand):
+    help = "Load benchmark of the ipauth-dnsserver.\n\nSends A and PTR " \
+        "queries for the names and IP addresses managed by ipdnsauth " \
+        "module to a running server and reports the number of queries " \
+        "answered per second."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--server',
+                    type=str,
+                    default='127.0.0.1',
+                    help="Address of the server"),
+        make_option('--port', '-p',
+                    type=int,
+                    default=8053,
+                    help="Port of the server"),
+        make_option('--queries', '-n',
+                    type=int,
+                    default=10000,
+                    help="Number of queries to send"),
+        make_option('--threads', '-t',
+                    type=int,
+                    default=16,
+                    help="Number of clients sending queries concurrently"),
+        make_option('--timeout',
+                    type=float,
+                    default=1.0,
+                    help="Time (in seconds) after which a query is "
+                         "considered failed"),
+        )
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'IPAUTH_DNSSERVER_DOMAIN', None):
+            raise CommandError("IPAUTH_DNSSERVER_DOMAIN not set in settings")
+        if options['threads'] < 1 or options['queries'] < 1:
+            raise CommandError("--threads and --queries must be positive")
+
+        questions = []
+        for ip_addr, username in IpToUser.objects \
+                .values_list('ip_addr', 'user__username'):
+            questions.append((username_to_hostname(username) + '.' +
+                              settings.IPAUTH_DNSSERVER_DOMAIN, 'A'))
+            questions.append((_reverse_name(ip_addr), 'PTR'))
+        if not questions:
+            raise CommandError("There are no IP mappings to query for")
+
+        results = run_benchmark((options['server'], options['port']),
+                questions, options['queries'], options['threads'],
+                options['timeout'])
+
+        latencies = results['latencies']
+        print "Answered %d of %d queries in %.2fs: %.1f queries/second" % (
+                results['answered'], options['queries'], results['time'],
+                results['answered'] / results['time'])
+        if latencies:
+            print "Latency: median %.1fms, 99th percentile %.1fms, " \
+                  "max %.1fms" % (
+                    1000 * latencies[len(latencies) // 2],
+                    1000 * latencies[len(latencies) * 99 // 100],
+                    1000 * latencies[-1])
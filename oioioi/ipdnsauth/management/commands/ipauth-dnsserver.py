@@ -8,10 +8,8 @@ import logging
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.contrib.auth.models import User
 
-from oioioi.ipdnsauth.models import IpToUser
-from oioioi.ipdnsauth.utils import username_to_hostname
+from oioioi.ipdnsauth.utils import IpToUserIndex
 
 
 logger = logging.getLogger(__name__)
@@ -51,30 +49,26 @@ class BaseRequestHandler(SocketServer.BaseRequestHandler):
         # return any SOA records and stuff...
         #
 
+        index = self.server.command.index
         if qndomain == settings.IPAUTH_DNSSERVER_DOMAIN:
             if qt in ['*', 'A']:
-                for u in User.objects.filter(iptouser__isnull=False):
-                    if qnhost == username_to_hostname(u.username):
-                        for itu in u.iptouser_set.all():
-                            reply.add_answer(RR(rname=qname, rtype=QTYPE.A,
-                                rclass=1,
-                                ttl=self.server.command.options['ttl'],
-                                rdata=A(itu.ip_addr)))
+                for ip_addr in index.ips_for_hostname(qnhost):
+                    reply.add_answer(RR(rname=qname, rtype=QTYPE.A,
+                        rclass=1, ttl=self.server.command.options['ttl'],
+                        rdata=A(ip_addr)))
         elif qn.endswith('.in-addr.arpa'):
             if qt in ['*', 'PTR']:
                 qn = qn[:-len('.in-addr.arpa')]
                 parts = qn.split('.')
                 if len(parts) == 4:
                     ip = '.'.join(reversed(parts))
-                    try:
-                        iptu = IpToUser.objects.get(ip_addr=ip)
-                        fqdn = username_to_hostname(iptu.user.username) + \
-                                '.' + settings.IPAUTH_DNSSERVER_DOMAIN + '.'
+                    hostname = index.hostname_for_ip(ip)
+                    if hostname is not None:
+                        fqdn = hostname + '.' + \
+                                settings.IPAUTH_DNSSERVER_DOMAIN + '.'
                         reply.add_answer(RR(rname=qname, rtype=QTYPE.PTR,
                             rclass=1, ttl=self.server.command.options['ttl'],
                             rdata=PTR(fqdn)))
-                    except IpToUser.DoesNotExist:
-                        pass
 
         logger.debug('%s', reply)
 
@@ -130,7 +124,9 @@ class TCPServer(SocketServer.ThreadingTCPServer):
 
 class Command(BaseCommand):
     help = "DNS server for ipdnsauth.\n\nAnswers DNS queries for names " \
-        "and IP addresses managed by ipdnsauth module."
+        "and IP addresses managed by ipdnsauth module. The mappings are " \
+        "kept in memory and reloaded when they change, or every " \
+        "--refresh-interval seconds."
 
     option_list = BaseCommand.option_list + (
         make_option('--port', '-p',
@@ -146,16 +142,34 @@ class Command(BaseCommand):
                     type=int,
                     default=60,
                     help="Specify TTL for returned records"),
+        make_option('--refresh-interval',
+                    dest='refresh_interval',
+                    type=int,
+                    default=60,
+                    help="Reload the mappings from the database at least "
+                         "this often (in seconds)"),
         )
 
     def __init__(self, *args, **kwargs):
         super(Command, self).__init__(*args, **kwargs)
         self.options = None
+        self.index = None
+
+    def _refresh_index(self):
+        try:
+            if self.index.refresh_if_needed():
+                logger.debug("Mappings reloaded")
+        # pylint: disable=broad-except
+        except Exception:
+            # Keep answering with the mappings loaded before.
+            logger.warning("Exception reloading mappings", exc_info=True)
 
     def handle(self, *args, **options):
         if not getattr(settings, 'IPAUTH_DNSSERVER_DOMAIN', None):
             raise CommandError("IPAUTH_DNSSERVER_DOMAIN not set in settings")
         self.options = options
+        self.index = IpToUserIndex(options['refresh_interval'])
+        self.index.refresh()
         listen_addr = (options['bind_addr'], options['port'])
         servers = [
             ('udp', UDPServer(self, listen_addr, UDPRequestHandler)),
@@ -170,6 +184,7 @@ class Command(BaseCommand):
             threads.append(thread)
         while True:
             time.sleep(1)
+            self._refresh_index()
         # Terminate the script in case both threads terminate
         for t in threads:
             t.join()
@@ -1,4 +1,5 @@
 from oioioi.contests.utils import is_contest_admin
+from oioioi.ipdnsauth.utils import get_ip_to_user_index
 from oioioi.participants.models import Participant
 from oioioi.su.utils import is_under_su, reset_to_real_user
 
@@ -9,7 +10,16 @@ from django.template.response import TemplateResponse
 
 # Code based on django.contrib.auth.middleware.RemoteUserMiddleware
 class IpDnsAuthMiddleware(object):
-    """Middleware for authentication based on user IP or DNS hostname."""
+    """Middleware for authentication based on user IP or DNS hostname.
+
+       When the session already belongs to the user mapped to the IP
+       address, the user is not authenticated again. The IP mappings are
+       looked up in the process-local
+       :class:`~oioioi.ipdnsauth.utils.IpToUserIndex` then, without
+       accessing the database.
+    """
+
+    backend_path = 'oioioi.ipdnsauth.backends.IpDnsBackend'
 
     def process_request(self, request):
         if not hasattr(request, 'user'):
@@ -29,10 +39,21 @@ class IpDnsAuthMiddleware(object):
         if not dns_name and not ip_addr:
             return
 
+        if ip_addr and self._session_matches(request, ip_addr):
+            return
+
         user = auth.authenticate(ip_addr=ip_addr, dns_name=dns_name)
         if user:
             auth.login(request, user)
 
+    def _session_matches(self, request, ip_addr):
+        user_id = get_ip_to_user_index().user_id_for_ip(ip_addr)
+        if user_id is None:
+            return False
+        session = request.session
+        return session.get(auth.BACKEND_SESSION_KEY) == self.backend_path \
+                and session.get(auth.SESSION_KEY) == unicode(user_id)
+
 
 # Code based on django.contrib.auth.middleware.RemoteUserMiddleware
 class ForceDnsIpAuthMiddleware(object):
@@ -1,4 +1,9 @@
-from django.db import models
+import uuid
+
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
 from oioioi.base.utils.deps import check_django_app_dependencies
@@ -21,6 +26,30 @@ class IpToUser(models.Model):
         return self.ip_addr
 
 
+_IP_TO_USER_VERSION_KEY = 'ipdnsauth_ip_to_user_version'
+
+
+def ip_to_user_version():
+    """Returns a token, which changes whenever any :class:`IpToUser` is
+       saved or deleted.
+
+       It's kept in the Django cache, so that other processes (like
+       the ``ipauth-dnsserver`` command) may notice the change.
+    """
+    return cache.get(_IP_TO_USER_VERSION_KEY)
+
+
+def _bump_ip_to_user_version():
+    cache.set(_IP_TO_USER_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+@receiver([post_save, post_delete], sender=IpToUser)
+def _ip_to_user_changed(sender, **kwargs):
+    # Other processes must not reload the mappings before they can see
+    # the change.
+    transaction.on_commit(_bump_ip_to_user_version)
+
+
 class DnsToUser(models.Model):
     """Represents mapping for automatic authorization based on DNS hostname."""
     dns_name = models.CharField(unique=True, max_length=255,
@@ -1,17 +1,27 @@
 from datetime import datetime
+import importlib
 import socket
 import os
+import threading
 
+from dnslib import DNSRecord, QTYPE
+
+from django.contrib import auth
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TransactionTestCase
 from django.test.utils import override_settings
 from django.utils.timezone import utc
+from mock import patch
 
 from oioioi.base.tests import TestCase, fake_time
 from oioioi.test_settings import AUTHENTICATION_BACKENDS, MIDDLEWARE_CLASSES
 from oioioi.contests.models import Contest
 from oioioi.contestexcl.models import ExclusivenessConfig
 from oioioi.ipdnsauth.management.commands.ipdnsauth import Command
-from oioioi.ipdnsauth.models import IpToUser, DnsToUser
+from oioioi.ipdnsauth.models import IpToUser, DnsToUser, \
+        ip_to_user_version
+from oioioi.ipdnsauth.utils import IpToUserIndex
 
 
 @override_settings(AUTHENTICATION_BACKENDS=AUTHENTICATION_BACKENDS +
@@ -19,6 +29,9 @@ from oioioi.ipdnsauth.models import IpToUser, DnsToUser
 @override_settings(MIDDLEWARE_CLASSES=MIDDLEWARE_CLASSES +
         ('oioioi.contestexcl.middleware.ExclusiveContestsMiddleware',
          'oioioi.ipdnsauth.middleware.IpDnsAuthMiddleware',))
+# Mappings are reloaded on every request, as changes made in a TestCase are
+# never committed, so they don't invalidate the loaded ones.
+@override_settings(IPDNSAUTH_MAPPINGS_MAX_AGE=0)
 class TestAutoAuthorization(TestCase):
     fixtures = ['test_users', 'test_two_empty_contests']
 
@@ -54,6 +67,21 @@ class TestAutoAuthorization(TestCase):
             dns_name=socket.getfqdn('localhost'))
         self._assertBackend(self.test_user2)
 
+    def test_authentication_skipped_for_matching_session(self):
+        mapping = self.test_user.iptouser_set.create(ip_addr='127.0.0.1')
+        self._assertBackend(self.test_user)
+
+        with patch.object(auth, 'authenticate',
+                          wraps=auth.authenticate) as authenticate:
+            self._assertBackend(self.test_user)
+            self.assertFalse(authenticate.called)
+
+            # The cached mappings are invalidated on changes.
+            mapping.user = self.test_user2
+            mapping.save()
+            self._assertBackend(self.test_user2)
+            self.assertTrue(authenticate.called)
+
 
 def _test_filename(name):
     return os.path.join(os.path.dirname(__file__), 'files', name)
@@ -103,3 +131,106 @@ class TestIpDnsManagement(TestCase):
                                 '--unload', filename])
         loaded = manager.export_data('dns', DnsToUser.objects)
         self.assertEquals(len(loaded), 0)
+
+
+class TestIpToUserIndex(TestCase):
+    fixtures = ['test_users']
+
+    def test_lookups(self):
+        user = User.objects.get(username='test_user')
+        user.iptouser_set.create(ip_addr='10.0.0.1')
+        user.iptouser_set.create(ip_addr='10.0.0.2')
+        index = IpToUserIndex(max_age=60)
+        index.refresh()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(index.ips_for_hostname('testuser'),
+                             ['10.0.0.1', '10.0.0.2'])
+            self.assertEqual(index.ips_for_hostname('nobody'), [])
+            self.assertEqual(index.hostname_for_ip('10.0.0.2'), 'testuser')
+            self.assertIsNone(index.hostname_for_ip('10.0.0.3'))
+
+    def test_max_age(self):
+        index = IpToUserIndex(max_age=0)
+        index.refresh()
+        self.assertTrue(index.refresh_if_needed())
+
+
+# The version is changed on commit, which never happens in a TestCase.
+class TestIpToUserIndexInvalidation(TransactionTestCase):
+    fixtures = ['test_users']
+
+    def test_invalidation(self):
+        user = User.objects.get(username='test_user')
+        index = IpToUserIndex(max_age=60)
+        index.refresh()
+        self.assertFalse(index.refresh_if_needed())
+
+        version = ip_to_user_version()
+        with transaction.atomic():
+            mapping = user.iptouser_set.create(ip_addr='10.0.0.1')
+            self.assertEqual(ip_to_user_version(), version)
+            self.assertFalse(index.refresh_if_needed())
+        self.assertNotEqual(ip_to_user_version(), version)
+        self.assertTrue(index.refresh_if_needed())
+        self.assertEqual(index.hostname_for_ip('10.0.0.1'), 'testuser')
+        self.assertFalse(index.refresh_if_needed())
+
+        mapping.delete()
+        self.assertTrue(index.refresh_if_needed())
+        self.assertIsNone(index.hostname_for_ip('10.0.0.1'))
+
+
+@override_settings(IPAUTH_DNSSERVER_DOMAIN='contest.local')
+class TestDnsServer(TestCase):
+    fixtures = ['test_users']
+
+    def setUp(self):
+        self.dnsserver = importlib.import_module(
+                'oioioi.ipdnsauth.management.commands.ipauth-dnsserver')
+        User.objects.get(username='test_user') \
+                .iptouser_set.create(ip_addr='10.0.0.1')
+        self.command = self.dnsserver.Command()
+        self.command.options = {'ttl': 60}
+        self.command.index = IpToUserIndex(max_age=60)
+        self.command.index.refresh()
+
+    def _query(self, name, qtype):
+        handler = self.dnsserver.UDPRequestHandler.__new__(
+                self.dnsserver.UDPRequestHandler)
+        handler.server = self.dnsserver.UDPServer.__new__(
+                self.dnsserver.UDPServer)
+        handler.server.command = self.command
+        with self.assertNumQueries(0):
+            data = handler.dns_response(
+                    DNSRecord.question(name, qtype).pack())
+        return [(QTYPE[rr.rtype], str(rr.rdata))
+                for rr in DNSRecord.parse(data).rr]
+
+    def test_responses(self):
+        self.assertEqual(self._query('testuser.contest.local', 'A'),
+                         [('A', '10.0.0.1')])
+        self.assertEqual(self._query('1.0.0.10.in-addr.arpa', 'PTR'),
+                         [('PTR', 'testuser.contest.local.')])
+        self.assertEqual(self._query('nobody.contest.local', 'A'), [])
+        self.assertEqual(self._query('2.0.0.10.in-addr.arpa', 'PTR'), [])
+
+    def test_benchmark(self):
+        benchmark = importlib.import_module(
+                'oioioi.ipdnsauth.management.commands.ipauth-dnsbenchmark')
+        server = self.dnsserver.UDPServer(self.command, ('127.0.0.1', 0),
+                                          self.dnsserver.UDPRequestHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            results = benchmark.run_benchmark(server.server_address,
+                    [('testuser.contest.local', 'A'),
+                     ('1.0.0.10.in-addr.arpa', 'PTR')],
+                    num_queries=20, num_threads=4, timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(results['answered'], 20)
+        self.assertEqual(results['failed'], 0)
+        self.assertEqual(len(results['latencies']), 20)
@@ -1,4 +1,15 @@
 import re
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils.ipv6 import clean_ipv6_address
+
+from oioioi.base.utils import memoized, reset_memoized
+from oioioi.ipdnsauth.models import IpToUser, ip_to_user_version
 
 
 def username_to_hostname(username):
@@ -6,3 +17,93 @@ def username_to_hostname(username):
     if not hostname:
         hostname = 'samepodkreslniki'
     return hostname
+
+
+class IpToUserIndex(object):
+    """An in-memory index of :class:`~oioioi.ipdnsauth.models.IpToUser`
+       mappings, which maps hostnames (see :func:`username_to_hostname`)
+       to IP addresses and back, and IP addresses to user ids.
+
+       Lookups don't touch the database. The index is reloaded by
+       :meth:`refresh_if_needed`, when the mappings have changed or it's
+       older than ``max_age`` seconds.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._hostname_to_ips = {}
+        self._ip_to_hostname = {}
+        self._ip_to_user_id = {}
+        self._version = None
+        self._loaded_at = None
+
+    def refresh(self):
+        # The version is read first, so that changes made while loading
+        # trigger another refresh.
+        version = ip_to_user_version()
+        hostname_to_ips = defaultdict(list)
+        ip_to_hostname = {}
+        ip_to_user_id = {}
+        for ip_addr, user_id, username in IpToUser.objects \
+                .order_by('ip_addr') \
+                .values_list('ip_addr', 'user_id', 'user__username'):
+            hostname = username_to_hostname(username)
+            hostname_to_ips[hostname].append(ip_addr)
+            ip_to_hostname[ip_addr] = hostname
+            ip_to_user_id[ip_addr] = user_id
+        # The dicts are replaced, not modified, so lookups may be done
+        # concurrently.
+        self._hostname_to_ips = dict(hostname_to_ips)
+        self._ip_to_hostname = ip_to_hostname
+        self._ip_to_user_id = ip_to_user_id
+        self._version = version
+        self._loaded_at = time.time()
+
+    def refresh_if_needed(self):
+        """Reloads the index if it's stale. Returns whether it was
+           reloaded.
+        """
+        if self._loaded_at is not None \
+                and time.time() - self._loaded_at < self.max_age \
+                and ip_to_user_version() == self._version:
+            return False
+        self.refresh()
+        return True
+
+    def ips_for_hostname(self, hostname):
+        return self._hostname_to_ips.get(hostname, [])
+
+    def hostname_for_ip(self, ip_addr):
+        return self._ip_to_hostname.get(ip_addr)
+
+    def user_id_for_ip(self, ip_addr):
+        """Returns the id of the user mapped to the IP address, which may
+           be given in any form accepted by
+           :class:`~oioioi.ipdnsauth.models.IpToUser`.
+        """
+        if ':' in ip_addr:
+            try:
+                ip_addr = clean_ipv6_address(ip_addr, unpack_ipv4=True)
+            except ValidationError:
+                return None
+        return self._ip_to_user_id.get(ip_addr)
+
+
+@memoized
+def _get_ip_to_user_index():
+    return IpToUserIndex(settings.IPDNSAUTH_MAPPINGS_MAX_AGE)
+
+
+def get_ip_to_user_index():
+    """Returns the process-local :class:`IpToUserIndex`, refreshed if
+       the mappings have changed.
+    """
+    index = _get_ip_to_user_index()
+    index.refresh_if_needed()
+    return index
+
+
+@receiver(setting_changed)
+def _on_setting_changed(sender, setting, **kwargs):
+    if setting == 'IPDNSAUTH_MAPPINGS_MAX_AGE':
+        reset_memoized(_get_ip_to_user_index)
@@ -1,9 +1,20 @@
+import calendar
+import json
+from datetime import datetime
+
 from django.contrib.auth.models import User
-from oioioi.base.tests import TestCase
-from oioioi.livedata.utils import get_display_name
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from django.utils.timezone import utc
+from mock import patch
 
+from oioioi.acm.controllers import ACMContestController
+from oioioi.base.tests import TestCase, fake_time
+from oioioi.contests.models import Round, ScoreReport, SubmissionReport
+from oioioi.livedata.utils import _events_log_key, get_display_name, \
+        get_events, get_events_log
 
-# TODO
 
 class TestLivedata(TestCase):
     fixtures = ['test_users', 'test_users_nonames']
@@ -16,3 +27,118 @@ class TestLivedata(TestCase):
         for username, display in cases:
             user = User.objects.get(username=username)
             self.assertEqual(get_display_name(user), display or username)
+
+
+class TestLivedataEvents(TestCase):
+    fixtures = ['acm_test_full_contest']
+
+    def setUp(self):
+        self.round = Round.objects.get(pk=1)
+        cache.clear()
+
+    def _add_report(self, submission):
+        report = SubmissionReport.objects.create(submission=submission,
+                                                 kind='FULL')
+        ScoreReport.objects.create(submission_report=report, status='OK')
+        return report
+
+    def _report_ids(self, events):
+        return [event['reportId'] for event, _date in events]
+
+    def test_events_log(self):
+        log = get_events_log(self.round, 60)
+        reports = SubmissionReport.objects.filter(
+                submission__problem_instance__round=self.round,
+                submission__user__participant__contest_id='acm',
+                submission__user__participant__status='ACTIVE') \
+                .exclude(submission__kind='IGNORED')
+        self.assertItemsEqual(self._report_ids(log.events_since()),
+                              reports.values_list('id', flat=True))
+        cursor = log.cursor()
+        self.assertEqual(log.events_since(cursor), [])
+
+        submission = reports[0].submission
+        report = self._add_report(submission)
+        # The log is updated only when it's old enough.
+        self.assertEqual(get_events_log(self.round, 60).events_since(cursor),
+                         [])
+        log = get_events_log(self.round, 0)
+        events = log.events_since(cursor)
+        self.assertEqual(self._report_ids(events), [report.id])
+        self.assertEqual(events[0][1], submission.date)
+
+        # An unknown cursor gives all the events.
+        self.assertEqual(len(log.events_since('unknown:0')),
+                         len(reports) + 1)
+
+    @override_settings(LIVEDATA_EVENTS_CHUNK_SIZE=2)
+    def test_events_log_chunks(self):
+        events = get_events_log(self.round, 60).events_since()
+        self.assertTrue(len(events) > 1)
+        report = self._add_report(SubmissionReport.objects.get(
+                id=events[0][0]['reportId']).submission)
+        get_events_log(self.round, 0)
+
+        log = cache.get(_events_log_key(self.round))
+        for position in xrange(len(events) + 2):
+            self.assertEqual(
+                    self._report_ids(log.events_since(
+                            '%s:%d' % (log.generation, position))),
+                    self._report_ids(events[position:]) + [report.id])
+
+        # Only the chunks after the cursor are read.
+        with patch.object(cache, 'get_many', wraps=cache.get_many) \
+                as get_many:
+            log = cache.get(_events_log_key(self.round))
+            self.assertEqual(self._report_ids(log.events_since(
+                    '%s:%d' % (log.generation, len(events)))), [report.id])
+            self.assertEqual(len(get_many.call_args[0][0]), 1)
+
+        # A log with evicted chunks is rebuilt.
+        cache.delete('%s/%s/0' % (log.key, log.generation))
+        events, cursor = get_events(self.round, 60)
+        self.assertEqual(len(events), len(log))
+        self.assertNotEqual(cursor.partition(':')[0], log.generation)
+
+    def test_events_log_lock(self):
+        log = get_events_log(self.round, 60)
+        cursor = log.cursor()
+        self._add_report(SubmissionReport.objects.get(
+                id=log.events_since()[0][0]['reportId']).submission)
+
+        # While another process updates the log, it's used as it is.
+        lock_key = _events_log_key(self.round) + '/lock'
+        cache.add(lock_key, True)
+        self.assertEqual(get_events_log(self.round, 0).cursor(), cursor)
+        self.assertEqual(
+                cache.get(_events_log_key(self.round)).cursor(), cursor)
+
+        cache.delete(lock_key)
+        log = get_events_log(self.round, 0)
+        self.assertEqual(len(log.events_since(cursor)), 1)
+        self.assertIsNone(cache.get(lock_key))
+
+    @patch.object(ACMContestController, 'can_see_livedata',
+                  return_value=True)
+    def test_events_view(self, _can_see_livedata):
+        url = reverse('livedata_events_view',
+                      kwargs={'contest_id': 'acm', 'round_id': 1})
+        self.client.login(username='test_user')
+        with fake_time(datetime(2013, 12, 15, 2, 0, tzinfo=utc)):
+            events = json.loads(self.client.get(url).content)
+            self.assertEqual(events[0]['reportId'], 'START')
+            self.assertTrue(len(events) > 1)
+
+            response = self.client.get(url, {'since': events[0]['cursor']})
+            self.assertEqual([event['reportId'] for event
+                              in json.loads(response.content)], ['START'])
+
+        self.round.end_date = datetime(2013, 12, 14, 21, 0, tzinfo=utc)
+        self.round.save()
+        with fake_time(datetime(2013, 12, 15, 2, 0, tzinfo=utc)):
+            events = json.loads(self.client.get(url).content)[1:]
+        frozen = [event for event in events if event['result'] == 'FROZEN']
+        self.assertTrue(frozen)
+        self.assertTrue(all(event['submissionTimestamp'] >=
+                            calendar.timegm((2013, 12, 14, 20, 0, 0))
+                            for event in frozen))
@@ -1,4 +1,14 @@
+import uuid
+from bisect import bisect_right
+from datetime import timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import dateformat, timezone
+
 from oioioi.base.permissions import make_request_condition
+from oioioi.contests.models import SubmissionReport
 
 
 @make_request_condition
@@ -11,3 +21,210 @@ def get_display_name(user):
         return '%s. %s' % (user.first_name[0], user.last_name)
     else:
         return user.username
+
+
+def _events_log_key(round):
+    return 'livedata_events_log/%s/%s' % (round.contest_id, round.id)
+
+
+def _reports(round, since=None):
+    reports = SubmissionReport.objects \
+        .filter(submission__problem_instance__round=round,
+                submission__user__participant__contest_id=round.contest_id,
+                submission__user__participant__status='ACTIVE') \
+        .exclude(submission__kind='IGNORED') \
+        .select_related('submission') \
+        .prefetch_related('scorereport_set')
+    if since is not None:
+        reports = reports.filter(creation_date__gte=since)
+    return reports.order_by('creation_date', 'id')
+
+
+class EventsLog(object):
+    """An append-only log of the livedata events of a round.
+
+       Every event is a dict described in
+       :func:`oioioi.livedata.views.livedata_events_view`, with
+       the status of the submission's score report as its ``result``. It
+       is stored along with the submission date, so that the results may
+       be frozen when the log is read.
+
+       Positions in the log don't change, so they are used as cursors by
+       clients. A log rebuilt from scratch gets a new ``generation``, so
+       that older cursors are not used with it.
+
+       The events are kept in the cache in chunks of at most
+       ``settings.LIVEDATA_EVENTS_CHUNK_SIZE`` events, separately from the
+       log itself. Every update adds new chunks, so the stored ones never
+       change, and only the chunks after a cursor have to be read.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.generation = uuid.uuid4().hex
+        self.created = timezone.now()
+        # Positions of the ends of the chunks.
+        self.chunk_ends = []
+        self.checked = None
+        # Ids and creation dates of the reports added recently, which
+        # may be returned by the next query.
+        self.recent_reports = {}
+        self._chunks = {}
+        self._unsaved_chunks = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_chunks']
+        del state['_unsaved_chunks']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._chunks = {}
+        self._unsaved_chunks = []
+
+    def __len__(self):
+        return self.chunk_ends[-1] if self.chunk_ends else 0
+
+    def _chunk_key(self, index):
+        return '%s/%s/%d' % (self.key, self.generation, index)
+
+    def update(self, round):
+        """Appends the events of reports created since the last update.
+
+           The new events are kept in memory until :meth:`save` is called.
+        """
+        now = timezone.now()
+        # Reports are created in transactions, which may commit later and
+        # in a different order, so the last few seconds are checked again.
+        overlap = timedelta(seconds=settings.LIVEDATA_EVENTS_OVERLAP)
+        since = self.checked - overlap if self.checked else None
+        events = []
+        for report in _reports(round, since):
+            if report.id in self.recent_reports:
+                continue
+            score_report = report.score_report
+            if score_report is None:
+                continue
+            self.recent_reports[report.id] = report.creation_date
+            events.append(({
+                'submissionId': report.submission_id,
+                'reportId': report.pk,
+                'teamId': report.submission.user_id,
+                'taskId': report.submission.problem_instance_id,
+                'submissionTimestamp':
+                    int(dateformat.format(report.submission.date, 'U')),
+                'judgingTimestamp':
+                    int(dateformat.format(report.creation_date, 'U')),
+                'result': score_report.status,
+            }, report.submission.date))
+        self.checked = now
+        self.recent_reports = dict((id, date) for id, date
+                                   in self.recent_reports.iteritems()
+                                   if date >= now - overlap)
+
+        chunk_size = settings.LIVEDATA_EVENTS_CHUNK_SIZE
+        for i in xrange(0, len(events), chunk_size):
+            chunk = events[i:i + chunk_size]
+            index = len(self.chunk_ends)
+            self.chunk_ends.append(len(self) + len(chunk))
+            self._chunks[index] = chunk
+            self._unsaved_chunks.append(index)
+
+    def save(self, timeout):
+        """Stores the log and its new chunks in the cache."""
+        # The chunks go first, so that a stored log never refers to
+        # missing ones.
+        cache.set_many(dict((self._chunk_key(index), self._chunks[index])
+                            for index in self._unsaved_chunks), timeout)
+        self._unsaved_chunks = []
+        cache.set(self.key, self, timeout)
+
+    def cursor(self):
+        return '%s:%d' % (self.generation, len(self))
+
+    def events_since(self, cursor=None):
+        """Returns the events added after the ``cursor`` was returned by
+           :meth:`cursor`, or all the events if it's not a valid cursor for
+           this log.
+
+           The events are returned as pairs of an event and the submission
+           date. ``None`` is returned if some of the chunks are no longer
+           in the cache.
+        """
+        start = 0
+        if cursor:
+            generation, _sep, position = cursor.partition(':')
+            if generation == self.generation and position.isdigit():
+                start = min(int(position), len(self))
+        first = bisect_right(self.chunk_ends, start)
+        indices = range(first, len(self.chunk_ends))
+        keys = dict((self._chunk_key(index), index) for index in indices
+                    if index not in self._chunks)
+        if keys:
+            chunks = cache.get_many(keys.keys())
+            if len(chunks) < len(keys):
+                return None
+            for key, chunk in chunks.iteritems():
+                self._chunks[keys[key]] = chunk
+        offset = start - (self.chunk_ends[first - 1] if first else 0)
+        return list(chain.from_iterable(self._chunks[index]
+                                        for index in indices))[offset:]
+
+
+def _is_expired(log, now):
+    return log is None or log.created < now - timedelta(
+            seconds=settings.LIVEDATA_EVENTS_LOG_TIMEOUT)
+
+
+def get_events_log(round, max_age, rebuild=False):
+    """Returns the :class:`EventsLog` of the round, updated if it's older
+       than ``max_age`` seconds, or rebuilt if ``rebuild`` is set.
+
+       The log is kept in the cache and rebuilt from scratch every
+       ``settings.LIVEDATA_EVENTS_LOG_TIMEOUT`` seconds, so that events of
+       disqualified participants or ignored submissions disappear.
+
+       Only one process at a time updates the log, so that there are no two
+       versions of the same generation. While it does, the others use the
+       stored log, even if it's older than ``max_age``.
+    """
+    key = _events_log_key(round)
+    now = timezone.now()
+    log = cache.get(key)
+    if not rebuild and not _is_expired(log, now) \
+            and log.checked >= now - timedelta(seconds=max_age):
+        return log
+
+    lock_key = key + '/lock'
+    locked = cache.add(lock_key, True, settings.LIVEDATA_EVENTS_LOCK_TIMEOUT)
+    try:
+        if locked and not rebuild:
+            # The log may have been updated before the lock was acquired.
+            log = cache.get(key)
+        if rebuild or _is_expired(log, now):
+            log = EventsLog(key)
+        elif not locked or log.checked >= now - timedelta(seconds=max_age):
+            return log
+        # A log which can't be stored is still built, but kept in memory.
+        log.update(round)
+        if locked:
+            log.save(settings.LIVEDATA_EVENTS_LOG_TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return log
+
+
+def get_events(round, max_age, cursor=None):
+    """Returns the events added to the log of the round after the
+       ``cursor`` (see :meth:`EventsLog.events_since`) and a cursor for
+       the next call.
+    """
+    log = get_events_log(round, max_age)
+    events = log.events_since(cursor)
+    if events is None:
+        # Some chunks were evicted from the cache.
+        log = get_events_log(round, max_age, rebuild=True)
+        events = log.events_since(cursor)
+    return events, log.cursor()
@@ -1,18 +1,15 @@
-import datetime
 import functools
 from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from django.utils import dateformat
-from django.utils.timezone import utc
 from django.http import HttpResponse
-from oioioi.base.permissions import make_request_condition, enforce_condition
+from oioioi.base.permissions import enforce_condition
 from oioioi.base.utils import jsonify, allow_cross_origin
-from oioioi.contests.models import SubmissionReport
 from oioioi.contests.utils import is_contest_observer, is_contest_admin, \
         contest_exists
-from oioioi.livedata.utils import can_see_livedata, get_display_name
+from oioioi.livedata.utils import can_see_livedata, get_display_name, \
+        get_events
 
 
 RESULT_FOR_FROZEN_SUBMISSION = 'FROZEN'
@@ -71,54 +68,52 @@ def livedata_tasks_view(request, round_id):
 
 @allow_cross_origin
 @enforce_condition(contest_exists & can_see_livedata)
-@cache_unless_admin_or_observer
 @jsonify
 def livedata_events_view(request, round_id):
-    user_is_participant = \
-        Q(submission__user__participant__contest_id=request.contest.id,
-          submission__user__participant__status='ACTIVE')
-    submission_ignored = Q(submission__kind='IGNORED')
-
-    reports = SubmissionReport.objects \
-        .filter(user_is_participant) \
-        .exclude(submission_ignored) \
-        .select_related('submission') \
-        .prefetch_related('scorereport_set')
-
-    if (is_contest_admin(request) or is_contest_observer(request)) and \
-            'from' in request.GET:
+    """Returns the events of the round.
+
+       The first one is a control event, with the start date of the round
+       as its ``judgingTimestamp`` and a ``cursor``. When the cursor is
+       passed in the ``since`` parameter, only the events added after it
+       was returned are sent.
+
+       The events are kept in an append-only log (see
+       :class:`~oioioi.livedata.utils.EventsLog`), which is updated
+       every ``settings.LIVEDATA_CACHE_TIMEOUT`` seconds (or on every
+       request of an admin or observer).
+    """
+    round = get_object_or_404(request.contest.round_set.all(), pk=round_id)
+    is_admin = is_contest_admin(request)
+    is_admin_or_observer = is_admin or is_contest_observer(request)
+    events, cursor = get_events(round, 0 if is_admin_or_observer
+                                       else settings.LIVEDATA_CACHE_TIMEOUT,
+                                request.GET.get('since'))
+
+    if is_admin_or_observer and 'from' in request.GET:
         # Only admin/observer is allowed to specify 'from' parameter.
-        start_time = datetime.datetime.utcfromtimestamp(
-                int(request.GET['from'])).replace(tzinfo=utc)
-        reports = reports.filter(creation_date__gte=start_time)
+        start_timestamp = int(request.GET['from'])
+        events = [(event, submission_date)
+                  for event, submission_date in events
+                  if event['judgingTimestamp'] >= start_timestamp]
 
-    round = get_object_or_404(request.contest.round_set.all(), pk=round_id)
-    contest_start = round.start_date
-    reports = reports.filter(submission__problem_instance__round=round)
-    if is_contest_admin(request):
+    if is_admin:
         freeze_time = None
     else:
         freeze_time = request.contest.controller.get_round_freeze_time(round)
 
+    def frozen(event, submission_date):
+        if freeze_time is None or submission_date < freeze_time:
+            return event
+        return dict(event, result=RESULT_FOR_FROZEN_SUBMISSION)
+
     return [{
         'submissionId': 'START',
         'reportId': 'START',
         'teamId': 'START',
         'taskId': 'START',
         'submissionTimestamp': int(dateformat.format(request.timestamp, 'U')),
-        'judgingTimestamp': int(dateformat.format(contest_start, 'U')),
+        'judgingTimestamp': int(dateformat.format(round.start_date, 'U')),
         'result': 'CTRL',
-    }] + [{
-        'submissionId': report.submission_id,
-        'reportId': report.pk,
-        'teamId': report.submission.user_id,
-        'taskId': report.submission.problem_instance_id,
-        'submissionTimestamp':
-            int(dateformat.format(report.submission.date, 'U')),
-        'judgingTimestamp': int(dateformat.format(report.creation_date, 'U')),
-        'result':
-            report.score_report.status
-            if freeze_time is None or report.submission.date < freeze_time
-            else RESULT_FOR_FROZEN_SUBMISSION,
-    } for report in reports.order_by('creation_date')
-        if report.score_report is not None]
+        'cursor': cursor,
+    }] + [frozen(event, submission_date)
+          for event, submission_date in events]
@@ -127,6 +127,7 @@ var CAdapter = function(teamsIds, tasksIds) {
     this.rejudge = false;         // czy wystapil rejudge
     this.startTS = 0;         // timestamp rozpoczecia zawodow : [Number, null], null jesli nie otrzymalismy jeszcze sekwencji rozpoczynajacej
     this.lastJudgingTS = 0;
+    this.cursor = "";             // kursor zwrocony przez serwer w sekwencji START
 	
     this.submits = {};             // mapa CEvents indeksowana kluczami submitId
     
@@ -142,7 +143,7 @@ var CAdapter = function(teamsIds, tasksIds) {
             url: CAcmvis.settings.eventsSenderUrl,
             async: !!that.settings.downloadEventsAsync,        
             dataType: 'json',        
-            data: "from=" + Math.max(0, (minTS - 1)),
+            data: {"from": Math.max(0, (minTS - 1)), "since": that.cursor},
             success: function(data) { 
                 var datum = null;
                 for (var l1 = 0; l1<data.length; l1++) {                    
@@ -150,6 +151,7 @@ var CAdapter = function(teamsIds, tasksIds) {
                     if (datum.result === "CTRL") {             // jezeli otrzymalismy sekwencje sterujaca
                         if (datum.reportId === "START") {     // jezeli otrzymano sekwencje z timestampem startu zawodów
                             that.startTS = Number(datum.judgingTimestamp);
+                            that.cursor = datum.cursor;       // kolejne zapytanie zwroci tylko nowe zdarzenia
                         }
                     } else {						
                         that.submitsQueue.push(new CTmpEvent({
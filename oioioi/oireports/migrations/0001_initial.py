@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import oioioi.base.fields
+import oioioi.filetracker.fields
+import oioioi.oireports.models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contests', '0005_submission_auto_rejudges'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneratedReport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creation_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='creation date')),
+                ('form_type', models.CharField(max_length=32, verbose_name='report type')),
+                ('filename', models.CharField(max_length=255, verbose_name='filename')),
+                ('status', oioioi.base.fields.EnumField(default=b'?', max_length=64, verbose_name='status')),
+                ('users_done', models.IntegerField(default=0)),
+                ('users_total', models.IntegerField(blank=True, null=True)),
+                ('file', oioioi.filetracker.fields.FileField(blank=True, max_length=255, null=True, upload_to=oioioi.oireports.models._make_report_filename, verbose_name='file')),
+                ('error', models.CharField(blank=True, max_length=1000, null=True, verbose_name='error')),
+                ('contest', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contests.Contest', verbose_name='contest')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='created by')),
+            ],
+            options={
+                'ordering': ['-creation_date'],
+                'verbose_name': 'generated report',
+                'verbose_name_plural': 'generated reports',
+            },
+        ),
+    ]
@@ -1,3 +1,95 @@
+import logging
+import os.path
+
+from celery.task import task
+from django.contrib.auth.models import User
+from django.db import models
+from django.utils import timezone
+from django.utils.text import Truncator, get_valid_filename
+from django.utils.translation import ugettext_lazy as _
+
+from oioioi.base.fields import EnumField, EnumRegistry
 from oioioi.base.utils.deps import check_django_app_dependencies
+from oioioi.contests.models import Contest
+from oioioi.filetracker.fields import FileField
 
 check_django_app_dependencies(__name__, ['oioioi.oi'])
+
+
+logger = logging.getLogger(__name__)
+
+
+report_statuses = EnumRegistry()
+report_statuses.register('?', _("Generating"))
+report_statuses.register('OK', _("Ready"))
+report_statuses.register('ERR', _("Error"))
+
+
+def _make_report_filename(instance, filename):
+    return 'oireports/%s/%s' % (instance.contest_id,
+            get_valid_filename(os.path.basename(filename)))
+
+
+class GeneratedReport(models.Model):
+    """A PDF or XML report, generated in background by
+       :func:`~oioioi.oireports.models.oireportsmgr_job`.
+
+       ``users_done`` out of ``users_total`` users have already been
+       processed while the report is generated.
+    """
+    contest = models.ForeignKey(Contest, verbose_name=_("contest"))
+    created_by = models.ForeignKey(User, verbose_name=_("created by"),
+            null=True, blank=True, on_delete=models.SET_NULL)
+    creation_date = models.DateTimeField(default=timezone.now,
+            verbose_name=_("creation date"))
+    form_type = models.CharField(max_length=32,
+            verbose_name=_("report type"))
+    filename = models.CharField(max_length=255, verbose_name=_("filename"))
+    status = EnumField(report_statuses, default='?',
+            verbose_name=_("status"))
+    users_done = models.IntegerField(default=0)
+    users_total = models.IntegerField(null=True, blank=True)
+    file = FileField(upload_to=_make_report_filename, null=True, blank=True,
+            verbose_name=_("file"))
+    error = models.CharField(max_length=1000, null=True, blank=True,
+            verbose_name=_("error"))
+
+    class Meta(object):
+        verbose_name = _("generated report")
+        verbose_name_plural = _("generated reports")
+        ordering = ['-creation_date']
+
+    @property
+    def progress(self):
+        """Percentage of the processed users."""
+        if not self.users_total:
+            return 100 if self.status != '?' else 0
+        return 100 * self.users_done // self.users_total
+
+
+@task(ignore_result=True)
+def oireportsmgr_job(report_id, params):
+    """Generates the :class:`GeneratedReport` with the given id.
+
+       ``params`` is a dict described in
+       :func:`oioioi.oireports.views.generate_report`.
+    """
+    # Avoid a circular import, the views use the model.
+    from oioioi.oireports.views import generate_report
+
+    try:
+        report = GeneratedReport.objects.select_related('contest') \
+                .get(id=report_id)
+    except GeneratedReport.DoesNotExist:
+        logger.info("Report %s got deleted before it was generated.",
+                    report_id)
+        return
+
+    try:
+        generate_report(report, params)
+    # pylint: disable=broad-except
+    except Exception, e:
+        logger.exception("Error generating report %s", report_id,
+                         extra={'omit_sentry': True})
+        GeneratedReport.objects.filter(id=report_id).update(status='ERR',
+                error=Truncator(e).chars(1000))
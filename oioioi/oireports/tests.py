@@ -3,13 +3,16 @@ from datetime import datetime
 
 import slate
 from django.contrib.auth.models import User
-from django.core.urlresolvers import reverse
+from django.core.urlresolvers import reverse, resolve
+from django.db import DEFAULT_DB_ALIAS
+from django.test.utils import override_settings
 from django.utils.timezone import utc
 
 from oioioi.base.tests import TestCase, fake_time
-from oioioi.contests.models import Contest
+from oioioi.contests.models import Contest, ProblemInstance
 from oioioi.filetracker.tests import TestStreamingMixin
-from oioioi.oireports.views import CONTEST_REPORT_KEY
+from oioioi.oireports.models import GeneratedReport
+from oioioi.oireports.views import CONTEST_REPORT_KEY, _serialize_reports
 from oioioi.participants.models import Participant
 
 
@@ -27,6 +30,23 @@ class TestReportViews(TestCase, TestStreamingMixin):
         p = Participant(contest=contest, user=user, status='ACTIVE')
         p.save()
 
+    def test_view_not_atomic(self):
+        # Otherwise the job could start before the report is committed.
+        url = reverse('oireports', kwargs={'contest_id': 'c'})
+        self.assertIn(DEFAULT_DB_ALIAS, getattr(resolve(url).func,
+                      '_non_atomic_requests', set()))
+
+    def _generate_report(self, url, post_vars):
+        response = self.client.post(url, post_vars, follow=True)
+        report = GeneratedReport.objects.get()
+        self.assertEqual(report.status, 'OK')
+        self.assertEqual(report.users_done, report.users_total)
+        download_url = reverse('oireports_download',
+                kwargs={'contest_id': report.contest_id,
+                        'report_id': report.id})
+        self.assertContains(response, download_url)
+        return self.client.get(download_url)
+
     def test_pdf_report_view(self):
         contest = Contest.objects.get()
         url = reverse('oireports', kwargs={'contest_id': contest.id})
@@ -46,7 +66,7 @@ class TestReportViews(TestCase, TestStreamingMixin):
 
         self.client.login(username='test_admin')
         with fake_time(datetime(2015, 8, 5, tzinfo=utc)):
-            response = self.client.post(url, post_vars)
+            response = self._generate_report(url, post_vars)
             pages = slate.PDF(StringIO(self.streamingContent(response)))
             self.assertIn("test_user", pages[0])
             self.assertIn("Wynik:34", pages[0])
@@ -73,7 +93,7 @@ class TestReportViews(TestCase, TestStreamingMixin):
 
         self.client.login(username='test_admin')
         with fake_time(datetime(2015, 8, 5, tzinfo=utc)):
-            response = self.client.post(url, post_vars)
+            response = self._generate_report(url, post_vars)
             content = self.streamingContent(response)
             self.assertIn("<user>Test User (test_user)", content)
             self.assertIn("<result>34</result>", content)
@@ -96,11 +116,66 @@ class TestReportViews(TestCase, TestStreamingMixin):
 
         self.client.login(username='test_admin')
         with fake_time(datetime(2015, 8, 5, tzinfo=utc)):
-            response = self.client.post(url, post_vars)
+            response = self._generate_report(url, post_vars)
             content = self.streamingContent(response)
             self.assertNotIn('test_user2', content)
             self.assertIn('Strange, there is no one', content)
 
+    def test_report_page(self):
+        contest = Contest.objects.get()
+        report = GeneratedReport.objects.create(contest=contest,
+                form_type='xml_report', filename='report.xml',
+                users_done=1, users_total=4)
+        url = reverse('oireports_report',
+                kwargs={'contest_id': contest.id, 'report_id': report.id})
+        download_url = reverse('oireports_download',
+                kwargs={'contest_id': contest.id, 'report_id': report.id})
+
+        self.client.login(username='test_user')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.login(username='test_admin')
+        with fake_time(datetime(2015, 8, 5, tzinfo=utc)):
+            response = self.client.get(url)
+            self.assertContains(response, '25%')
+            self.assertNotContains(response, download_url)
+            self.assertEqual(self.client.get(download_url).status_code, 404)
+
+            response = self.client.get(reverse('oireports',
+                    kwargs={'contest_id': contest.id}))
+            self.assertContains(response, 'report.xml')
+
+            GeneratedReport.objects.filter(id=report.id).update(status='ERR',
+                    error='Something went wrong')
+            response = self.client.get(url)
+            self.assertContains(response, 'Something went wrong')
+
+    @override_settings(OIREPORTS_CHUNK_SIZE=1)
+    def test_serialize_reports(self):
+        problem_instance = ProblemInstance.objects.get(id=1)
+        test_groups = {problem_instance: ['0', '1', '2', '3']}
+        users = User.objects.all()
+        progress = []
+        num_users = users.count()
+        # A few queries for every chunk of users.
+        with self.assertNumQueriesLessThan(2 + 4 * num_users):
+            rows = _serialize_reports(users, [problem_instance],
+                                      test_groups, progress.append)
+        self.assertEqual(progress, range(1, num_users + 1))
+
+        with override_settings(OIREPORTS_CHUNK_SIZE=100):
+            with self.assertNumQueriesLessThan(6):
+                rows_in_one_chunk = _serialize_reports(users,
+                        [problem_instance], test_groups)
+
+        self.assertEqual([row['user'] for row in rows],
+                         [row['user'] for row in rows_in_one_chunk])
+        row = rows[0]
+        self.assertEqual(row['user'].username, 'test_user')
+        self.assertEqual(row['sum'], 34)
+        self.assertEqual(len(row['resultsets']), 1)
+        self.assertIn('int main', row['resultsets'][0]['code'])
+
     def test_default_selected_round(self):
         contest = Contest.objects.get()
         url = reverse('oireports', kwargs={'contest_id': contest.id})
@@ -4,6 +4,10 @@ from oioioi.oireports import views
 
 contest_patterns = [
     url(r'^oireports/$', views.oireports_view, name='oireports'),
+    url(r'^oireports/(?P<report_id>\d+)/$', views.report_view,
+        name='oireports_report'),
+    url(r'^oireports/(?P<report_id>\d+)/download/$',
+        views.download_report_view, name='oireports_download'),
     url(r'^get_report_users/$', views.get_report_users_view,
         name='get_report_users'),
 ]
@@ -1,24 +1,31 @@
 import itertools
+from collections import defaultdict
 from operator import attrgetter
 
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from django.shortcuts import get_object_or_404, redirect
 from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
-from django.template import RequestContext
 from django.core.exceptions import SuspiciousOperation
 from django.core.urlresolvers import reverse
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
+from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
 
 from oioioi.base.permissions import enforce_condition
-from oioioi.base.utils.pdf import generate_pdf
+from oioioi.base.utils.pdf import render_pdf
 from oioioi.base.utils.user_selection import get_user_hints_view
 from oioioi.contests.menu import contest_admin_menu_registry
 from oioioi.filetracker.utils import stream_file
-from oioioi.contests.models import Round, UserResultForProblem, Submission
+from oioioi.contests.models import ProblemInstance, Round, \
+        UserResultForProblem, Submission
 from oioioi.contests.utils import is_contest_admin, contest_exists, \
         has_any_rounds
 from oioioi.oireports.forms import OIReportForm, CONTEST_REPORT_KEY
+from oioioi.oireports.models import GeneratedReport, oireportsmgr_job
 from oioioi.programs.models import CompilationReport, GroupReport, \
         TestReport
 from oioioi.participants.models import Region
@@ -26,8 +33,8 @@ from oioioi.participants.models import Region
 
 # FIXME conditions for views expressing oi dependence?
 
-def _users_in_contest(request, region=None):
-    queryset = User.objects.filter(participant__contest=request.contest,
+def _users_in_contest(contest, region=None):
+    queryset = User.objects.filter(participant__contest=contest,
         participant__status='ACTIVE')
     if region is not None:
         queryset = queryset.filter(
@@ -35,6 +42,8 @@ def _users_in_contest(request, region=None):
     return queryset
 
 
+# The report must be committed before its job starts.
+@transaction.non_atomic_requests
 @contest_admin_menu_registry.register_decorator(_("Printing reports"),
     lambda request: reverse('oireports',
         kwargs={'contest_id': request.contest.id}),
@@ -48,37 +57,29 @@ def oireports_view(request):
         if form.is_valid():
             form_type = form.cleaned_data['form_type']
 
-            if form_type == 'pdf_report':
-                return generate_pdfreport(request, form)
-            elif form_type == 'xml_report':
-                return generate_xmlreport(request, form)
-            else:
+            if form_type not in ('pdf_report', 'xml_report'):
                 raise SuspiciousOperation
+            report = _schedule_report(request, form)
+            return redirect('oireports_report', contest_id=request.contest.id,
+                            report_id=report.id)
     else:
         form = OIReportForm(request)
     return TemplateResponse(request, 'oireports/report-options.html', {
             'form': form,
-            'CONTEST_REPORT_KEY': CONTEST_REPORT_KEY
+            'CONTEST_REPORT_KEY': CONTEST_REPORT_KEY,
+            'reports': GeneratedReport.objects
+                    .filter(contest=request.contest)[:10],
     })
 
 
-def _render_report(request, template_name, title, users,
-        problem_instances, test_groups):
-    rows = _serialize_reports(users, problem_instances, test_groups)
-    return render_to_string(template_name,
-            context_instance=RequestContext(request, {
-                'rows': rows,
-                'title': title,
-            }))
+def _serialize_resultsets(users, problem_instances, test_groups):
+    """Generates dictionaries representing results of the given users
+       for single problems, using a few queries for all the users.
 
+       Returns a dict mapping user ids to lists of such dictionaries.
 
-def _serialize_report(user, problem_instances, test_groups):
-    """Generates a dictionary representing a single report.
-
-
-       :param request: Django request
-       :type user: :cls:`django.contrib.auth.User`
-       :param user: user to generate the report for
+       :type users: list of :cls:`django.contrib.auth.User`
+       :param users: users to generate the results for
        :type problem_instances: list of
                                  :cls:`oioioi.contests.ProblemInstance`
        :param problem_instances: problem instances to include in the report
@@ -87,49 +88,54 @@ def _serialize_report(user, problem_instances, test_groups):
        :param test_groups: dictionary mapping problem instances into lists
                            of names of test groups to include
     """
-
-    resultsets = []
-    total_score = None
-
-    results = UserResultForProblem.objects.filter(
-            user=user,
-            problem_instance__in=list(problem_instances),
-            submission_report__isnull=False)
+    results = list(UserResultForProblem.objects
+            .filter(user__in=users,
+                    problem_instance__in=list(problem_instances),
+                    submission_report__isnull=False)
+            .select_related('problem_instance__problem',
+                'submission_report__submission__programsubmission'))
+    submission_report_ids = [r.submission_report_id for r in results]
+    submission_ids = [r.submission_report.submission_id for r in results]
+    all_groups = set(itertools.chain.from_iterable(test_groups.values()))
+
+    compilation_reports = dict((c.submission_report_id, c)
+            for c in CompilationReport.objects
+                    .filter(submission_report__in=submission_report_ids))
+
+    test_reports = defaultdict(list)
+    for t in TestReport.objects \
+            .filter(submission_report__submission__in=submission_ids) \
+            .filter(submission_report__status='ACTIVE') \
+            .filter(submission_report__kind__in=['INITIAL', 'NORMAL']) \
+            .filter(test_group__in=all_groups) \
+            .select_related('submission_report') \
+            .order_by('test__kind', 'test__order', 'test_name'):
+        test_reports[t.submission_report.submission_id].append(t)
+
+    group_reports = defaultdict(dict)
+    for g in GroupReport.objects \
+            .filter(submission_report__submission__in=submission_ids) \
+            .filter(submission_report__status='ACTIVE') \
+            .filter(submission_report__kind__in=['INITIAL', 'NORMAL']) \
+            .filter(group__in=all_groups) \
+            .select_related('submission_report'):
+        group_reports[g.submission_report.submission_id][g.group] = g
+
+    resultsets = defaultdict(list)
     for r in results:
         problem_instance = r.problem_instance
         submission_report = r.submission_report
         submission = submission_report.submission
         source_file = submission.programsubmission.source_file
-        groups = list(test_groups[problem_instance])
-
-        try:
-            compilation_report = CompilationReport.objects \
-                    .get(submission_report=submission_report)
-        except CompilationReport.DoesNotExist:
-            compilation_report = None
-
-        try:
-            test_reports = TestReport.objects \
-                    .filter(submission_report__submission=submission) \
-                    .filter(submission_report__status='ACTIVE') \
-                    .filter(submission_report__kind__in=['INITIAL',
-                                                         'NORMAL']) \
-                    .filter(test_group__in=groups) \
-                    .order_by('test__kind', 'test__order', 'test_name')
-        except TestReport.DoesNotExist:
-            test_reports = []
-
-        group_reports = GroupReport.objects \
-                .filter(submission_report__submission=submission) \
-                .filter(submission_report__status='ACTIVE') \
-                .filter(submission_report__kind__in=['INITIAL', 'NORMAL']) \
-                .filter(group__in=groups)
-        group_reports = dict((g.group, g) for g in group_reports)
+        selected_groups = set(test_groups[problem_instance])
+
         groups = []
-        for group_name, tests in itertools.groupby(test_reports,
+        for group_name, tests in itertools.groupby(
+                (t for t in test_reports[submission.id]
+                 if t.test_group in selected_groups),
                 attrgetter('test_group')):
             groups.append({'tests': list(tests),
-                'report': group_reports[group_name]})
+                'report': group_reports[submission.id][group_name]})
 
         problem_score = None
         max_problem_score = None
@@ -147,94 +153,187 @@ def _serialize_report(user, problem_instances, test_groups):
             elif group_max_score is not None:
                 max_problem_score += group_max_score
 
-        resultsets.append(dict(
+        resultsets[r.user_id].append(dict(
             result=r,
             score=problem_score,
             max_score=max_problem_score,
-            compilation_report=compilation_report,
+            compilation_report=compilation_reports.get(submission_report.id),
             groups=groups,
             code=source_file.read(),
             codefile=source_file.file.name
         ))
         source_file.close()
-        if total_score is None:
-            total_score = problem_score
-        elif problem_score is not None:
-            total_score += problem_score
-    return {
-        'user': user,
-        'resultsets': resultsets,
-        'sum': total_score,
-    }
+    return resultsets
+
 
+def _serialize_reports(users, problem_instances, test_groups, progress=None):
+    """Generates dictionaries representing reports of the given users.
 
-def _serialize_reports(users, problem_instances, test_groups):
-    """Runs :meth:`serialize_report` for a number of users.
+       The results of ``settings.OIREPORTS_CHUNK_SIZE`` users are loaded
+       at once by :func:`_serialize_resultsets`. After every such chunk,
+       ``progress`` is called (if given) with the number of users processed
+       so far.
 
-       Returns a list of objects produced by serialize_report, sorted
+       Returns a list of reports of users with any results, sorted
        by user's last name and first name.
     """
+    users = list(users.order_by('last_name', 'first_name', 'username'))
+    chunk_size = settings.OIREPORTS_CHUNK_SIZE
     data = []
-    for user in users.order_by('last_name', 'first_name', 'username'):
-        user_data = _serialize_report(user, problem_instances,
+    for i in xrange(0, len(users), chunk_size):
+        chunk = users[i:i + chunk_size]
+        resultsets = _serialize_resultsets(chunk, problem_instances,
                 test_groups)
-        if user_data['resultsets']:
-            data.append(user_data)
+        for user in chunk:
+            if not resultsets[user.id]:
+                continue
+            total_score = None
+            for resultset in resultsets[user.id]:
+                if total_score is None:
+                    total_score = resultset['score']
+                elif resultset['score'] is not None:
+                    total_score += resultset['score']
+            data.append({
+                'user': user,
+                'resultsets': resultsets[user.id],
+                'sum': total_score,
+            })
+        if progress is not None:
+            progress(i + len(chunk))
     return data
 
 
-def _report_text(request, template_file, report_form):
+def _schedule_report(request, report_form):
+    """Creates a :class:`~oioioi.oireports.models.GeneratedReport` and
+       starts generating it in background.
+    """
+    form_type = report_form.cleaned_data['form_type']
     round_key = report_form.cleaned_data['report_round']
+    region_key = report_form.cleaned_data['report_region']
+
     if round_key == CONTEST_REPORT_KEY:
-        round = None
+        round_id = None
     else:
-        round = Round.objects.get(contest=request.contest, id=round_key)
+        round_id = Round.objects.get(contest=request.contest, id=round_key).id
 
-    title = request.contest.name
-    if round:
-        title += ' -- ' + round.name
-
-    # Region object
-    region_key = report_form.cleaned_data['report_region']
     if region_key == CONTEST_REPORT_KEY:
-        region = None
+        region_id = None
     else:
-        region = Region.objects.get(short_name=region_key,
-                contest=request.contest)
+        region_id = Region.objects.get(short_name=region_key,
+                contest=request.contest).id
 
     if report_form.cleaned_data['is_single_report']:
-        users = User.objects \
-            .filter(username=report_form.cleaned_data['single_report_user'])
+        username = report_form.cleaned_data['single_report_user'].username
     else:
-        users = _users_in_contest(request, region)
+        username = None
 
-    # Generate report
     testgroups = report_form.get_testgroups(request)
-    return _render_report(
-        request,
-        template_file,
-        title,
-        users,
-        testgroups.keys(),
-        testgroups
-    )
-
-
-def generate_pdfreport(request, report_form):
-    report = _report_text(request, 'oireports/pdfreport.tex', report_form)
-    filename = '%s-%s-%s.pdf' % (request.contest.id,
-            report_form.cleaned_data['report_round'],
-            report_form.cleaned_data['report_region'])
-
-    return generate_pdf(report, filename)
-
-
-def generate_xmlreport(request, report_form):
-    report = _report_text(request, 'oireports/xmlreport.xml', report_form)
-    filename = '%s-%s-%s.xml' % (request.contest.id,
-        report_form.cleaned_data['report_round'],
-        report_form.cleaned_data['report_region'])
-    return stream_file(ContentFile(report.encode('utf-8')), filename)
+    params = {
+        'round_id': round_id,
+        'region_id': region_id,
+        'username': username,
+        'testgroups': [[pi.id, groups] for pi, groups
+                       in testgroups.iteritems()],
+        'language': translation.get_language(),
+    }
+
+    extension = 'pdf' if form_type == 'pdf_report' else 'xml'
+    filename = '%s-%s-%s.%s' % (request.contest.id, round_key, region_key,
+            extension)
+    # We need to make sure that the report is saved in the database before
+    # the Celery task starts.
+    with transaction.atomic():
+        report = GeneratedReport.objects.create(contest=request.contest,
+                created_by=request.user, form_type=form_type,
+                filename=filename)
+    oireportsmgr_job.delay(report.id, params)
+    return report
+
+
+def generate_report(report, params):
+    """Generates the contents of a
+       :class:`~oioioi.oireports.models.GeneratedReport` and saves it,
+       tracking the progress.
+
+       ``params`` is a dict with keys:
+         ``round_id``: id of the round to generate the report for, ``None``
+         for the whole contest
+
+         ``region_id``: id of the region of users to include, ``None`` for
+         all users
+
+         ``username``: username of the only user to include, or ``None``
+
+         ``testgroups``: a list of pairs: id of a problem instance and
+         a list of names of its test groups to include
+
+         ``language``: language code of the report
+    """
+    contest = report.contest
+    title = contest.name
+    if params['round_id'] is not None:
+        title += ' -- ' + Round.objects.get(id=params['round_id']).name
+
+    if params['username'] is not None:
+        users = User.objects.filter(username=params['username'])
+    else:
+        users = _users_in_contest(contest, params['region_id'])
+
+    problem_instances = ProblemInstance.objects.in_bulk(
+            [pi_id for pi_id, _groups in params['testgroups']])
+    testgroups = dict((problem_instances[pi_id], groups)
+                      for pi_id, groups in params['testgroups'])
+
+    reports = GeneratedReport.objects.filter(id=report.id)
+    reports.update(users_total=users.count())
+
+    def progress(users_done):
+        reports.update(users_done=users_done)
+
+    rows = _serialize_reports(users, testgroups.keys(), testgroups, progress)
+
+    if report.form_type == 'pdf_report':
+        template_name = 'oireports/pdfreport.tex'
+    else:
+        template_name = 'oireports/xmlreport.xml'
+    with translation.override(params['language']):
+        text = render_to_string(template_name, {
+            'rows': rows,
+            'title': title,
+            'timestamp': report.creation_date,
+        })
+
+    if report.form_type == 'pdf_report':
+        content = File(render_pdf(text))
+    else:
+        content = ContentFile(text.encode('utf-8'))
+    try:
+        report.file.save(report.filename, content, save=False)
+    finally:
+        content.close()
+    report.status = 'OK'
+    report.save(update_fields=['file', 'status'])
+
+
+def _get_report_or_404(request, report_id):
+    return get_object_or_404(GeneratedReport, id=report_id,
+                             contest=request.contest)
+
+
+@enforce_condition(contest_exists & is_contest_admin)
+def report_view(request, report_id):
+    report = _get_report_or_404(request, report_id)
+    return TemplateResponse(request, 'oireports/report.html', {
+        'report': report,
+    })
+
+
+@enforce_condition(contest_exists & is_contest_admin)
+def download_report_view(request, report_id):
+    report = _get_report_or_404(request, report_id)
+    if report.status != 'OK':
+        raise Http404
+    return stream_file(report.file, report.filename)
 
 
 @enforce_condition(contest_exists & is_contest_admin)
@@ -1,6 +1,8 @@
 from nose.tools import nottest
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
 
@@ -10,6 +12,7 @@ from oioioi.base.utils.validators import validate_db_string_id
 from oioioi.contests.models import Contest
 from oioioi.participants.fields import \
         OneToOneBothHandsCascadingParticipantField
+from oioioi.rankings.models import Ranking
 
 
 check_django_app_dependencies(__name__, ['oioioi.contestexcl'])
@@ -63,6 +66,13 @@ class Participant(models.Model):
         self.save()
 
 
+@receiver([post_save, post_delete], sender=Participant)
+def _participant_changed(sender, instance, **kwargs):
+    # Rankings show only the active participants and hide the names of the
+    # anonymous ones.
+    Ranking.invalidate_contest(instance.contest_id)
+
+
 class Region(models.Model):
     short_name = models.CharField(max_length=10,
         validators=[validate_db_string_id])
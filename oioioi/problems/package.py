@@ -106,7 +106,8 @@ class ProblemPackageBackend(RegisteredSubclassesBase, ObjectWithMixins):
             self.unpack(env)
             problem = Problem.objects.get(id=env['problem_id'])
             pp.problem = problem
-            pp.save()
+            # Other fields (e.g. info) may have been set by the backend.
+            pp.save(update_fields=['problem'])
         return problem
 
     def pack(self, problem):
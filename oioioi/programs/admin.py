@@ -10,12 +10,15 @@ from django.utils.html import conditional_escape
 from django.utils.encoding import force_unicode
 from django.forms.models import BaseInlineFormSet
 
+from oioioi.base import admin as oioioi_admin
+from oioioi.base.admin import system_admin_menu_registry
 from oioioi.base.utils import make_html_link
 from oioioi.contests.models import ProblemInstance
 from oioioi.contests.admin import ProblemInstanceAdmin, SubmissionAdmin
 from oioioi.problems.admin import ProblemPackageAdmin, MainProblemInstanceAdmin
+from oioioi.programs import compile_cache
 from oioioi.programs.models import Test, ModelSolution, OutputChecker, \
-        LibraryProblemData, ReportActionsConfig
+        LibraryProblemData, ReportActionsConfig, CompiledBinary
 
 
 class ValidationFormset(BaseInlineFormSet):
@@ -319,3 +322,34 @@ class LanguageListFilter(SimpleListFilter):
             return queryset.filter(condition)
         else:
             return queryset
+
+
+class CompiledBinaryAdmin(oioioi_admin.ModelAdmin):
+    list_display = ['language', 'compiler', 'exec_mode', 'size',
+                    'compile_time', 'hits', 'creation_date', 'last_used']
+    list_filter = ['language', 'exec_mode']
+    actions = ['delete_selected']
+
+    def __init__(self, *args, **kwargs):
+        super(CompiledBinaryAdmin, self).__init__(*args, **kwargs)
+        self.list_display_links = None
+
+    def has_add_permission(self, request):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        stats = compile_cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = 100. * stats['hits'] / lookups if lookups else 0
+        stats['saved_time'] = stats['saved_time'] / 1000.
+        extra_context = extra_context or {}
+        extra_context['compile_cache_stats'] = stats
+        extra_context['compile_cache_size'] = settings.COMPILE_CACHE_SIZE
+        return super(CompiledBinaryAdmin, self) \
+                .changelist_view(request, extra_context=extra_context)
+
+oioioi_admin.site.register(CompiledBinary, CompiledBinaryAdmin)
+system_admin_menu_registry.register('compiledbinary_admin',
+        _("Compilation cache"), lambda request: reverse(
+            'oioioiadmin:programs_compiledbinary_changelist'),
+        order=60)
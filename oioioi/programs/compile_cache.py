@@ -0,0 +1,168 @@
+"""A cache of compiled submissions, shared by all evaluations.
+
+   Successfully compiled binaries are kept in Filetracker as
+   :class:`~oioioi.programs.models.CompiledBinary` objects and reused by
+   :func:`oioioi.programs.handlers.compile` for identical compilations,
+   for example in rejudges or for resubmitted solutions.
+
+   When the total size of the binaries exceeds ``settings.COMPILE_CACHE_SIZE``
+   bytes, the least recently used ones are removed, except for the ones used
+   in the last ``settings.COMPILE_CACHE_MIN_AGE`` seconds, which may still be
+   being tested.
+"""
+
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from oioioi.filetracker.client import get_client
+from oioioi.filetracker.utils import filetracker_to_django_file
+from oioioi.programs.models import CompiledBinary
+
+
+logger = logging.getLogger(__name__)
+
+_HITS_KEY = 'compile_cache_hits'
+_MISSES_KEY = 'compile_cache_misses'
+_SAVED_TIME_KEY = 'compile_cache_saved_time'
+
+# Part of the cache left free after eviction, so that it isn't run on every
+# binary added to a full cache.
+_EVICTION_SLACK = 0.1
+
+
+def _source_digest(source_file):
+    reader, _version = get_client().get_stream(source_file)
+    digest = hashlib.sha256()
+    try:
+        for chunk in iter(lambda: reader.read(65536), ''):
+            digest.update(chunk)
+    finally:
+        reader.close()
+    return digest.hexdigest()
+
+
+def compile_cache_key(env, compiler):
+    """Returns the key identifying the compilation of
+       ``env['source_file']`` with the given compiler, or ``None`` if the
+       cache is disabled.
+    """
+    if not settings.COMPILE_CACHE_SIZE:
+        return None
+    key = [
+        _source_digest(env['source_file']),
+        env.get('language'),
+        compiler,
+        env.get('exec_mode', ''),
+        sorted(env.get('extra_files', {}).items()),
+        env.get('extra_compilation_args', []),
+    ]
+    return hashlib.sha256(json.dumps(key)).hexdigest()
+
+
+def binary_path(key):
+    """Returns the Filetracker path the binary should be compiled to."""
+    return '/compiled_binaries/%s' % (key,)
+
+
+def _count(key, delta=1):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # The key has been evicted from the cache in the meantime.
+        pass
+
+
+def get_cached_binary(key):
+    """Returns the :class:`~oioioi.programs.models.CompiledBinary` with
+       the given key and marks it as used, or returns ``None`` if there is
+       no such binary.
+    """
+    try:
+        binary = CompiledBinary.objects.get(key=key)
+    except CompiledBinary.DoesNotExist:
+        _count(_MISSES_KEY)
+        return None
+    CompiledBinary.objects.filter(id=binary.id) \
+            .update(hits=F('hits') + 1, last_used=timezone.now())
+    _count(_HITS_KEY)
+    _count(_SAVED_TIME_KEY, binary.compile_time)
+    return binary
+
+
+def add_binary(key, env, compile_time):
+    """Adds the binary compiled to :func:`binary_path` to the cache.
+
+       ``env`` should contain the compilation results, as produced by
+       :func:`oioioi.programs.handlers.compile_end`, and ``compile_time``
+       is the time it took, in milliseconds.
+    """
+    path = binary_path(key)
+    binary = CompiledBinary(key=key,
+            language=env.get('language', ''),
+            compiler=env.get('compiler') or
+                    'default-%s' % (env.get('language', ''),),
+            exec_mode=env.get('exec_mode', ''),
+            file=filetracker_to_django_file(path),
+            size=get_client().file_size(path),
+            compiler_output=env.get('compilation_message', ''),
+            exec_info=json.dumps(env.get('exec_info', {})),
+            compile_time=compile_time)
+    try:
+        with transaction.atomic():
+            binary.save()
+    except IntegrityError:
+        # The same source was compiled concurrently, to the same path.
+        return
+    evict()
+
+
+def evict():
+    """Removes the least recently used binaries if the cache is full."""
+    total = CompiledBinary.objects.aggregate(size=Sum('size'))['size'] or 0
+    if total <= settings.COMPILE_CACHE_SIZE:
+        return
+    target_size = settings.COMPILE_CACHE_SIZE * (1 - _EVICTION_SLACK)
+    in_use_since = timezone.now() - \
+            timedelta(seconds=settings.COMPILE_CACHE_MIN_AGE)
+    candidates = CompiledBinary.objects \
+            .filter(last_used__lt=in_use_since).order_by('last_used') \
+            .values_list('id', 'size')
+    to_delete = []
+    for binary_id, size in candidates.iterator():
+        if total <= target_size:
+            break
+        to_delete.append(binary_id)
+        total -= size
+    # The files are removed by a post_delete signal receiver.
+    CompiledBinary.objects.filter(id__in=to_delete).delete()
+    logger.debug("Compile cache evicted %d binaries, size is %d bytes now",
+                 len(to_delete), total)
+
+
+def stats():
+    """Returns a dict with the numbers of cache hits and misses, the total
+       compilation time saved by the hits (in milliseconds) and the current
+       number and total size of the cached binaries.
+    """
+    binaries = CompiledBinary.objects.aggregate(size=Sum('size'),
+                                                count=Count('id'))
+    return {
+        'hits': cache.get(_HITS_KEY, 0),
+        'misses': cache.get(_MISSES_KEY, 0),
+        'saved_time': cache.get(_SAVED_TIME_KEY, 0),
+        'binaries': binaries['count'],
+        'size': binaries['size'] or 0,
+    }
+
+
+def reset_stats():
+    cache.delete_many([_HITS_KEY, _MISSES_KEY, _SAVED_TIME_KEY])
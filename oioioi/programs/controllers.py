@@ -642,8 +642,42 @@ class ProgrammingContestController(ContestController):
         problem.controller.fill_evaluation_environ(environ, submission)
         self.fill_evaluation_environ_post_problem(environ, submission)
 
+    def use_fail_fast_evaluation(self, submission):
+        """Determines if the evaluation of the submission should stop at
+           the first failed test (see
+           :func:`oioioi.programs.handlers.run_tests`).
+
+           The tests not run get the ``SKIP`` status, so the scorers used
+           must handle it.
+
+           The default implementation returns ``False``.
+        """
+        return False
+
+    def use_group_short_circuiting(self, submission):
+        """Determines if the evaluation of a test group of the submission
+           should stop after the first failed test in the group (see
+           :func:`oioioi.programs.handlers.run_tests`).
+
+           It's applied only to the groups scored by
+           :func:`~oioioi.programs.utils.min_group_scorer`, as the score
+           of such a group is already known then. The tests not run get
+           the ``SKIP`` status.
+
+           The default implementation returns
+           ``settings.GROUP_SHORT_CIRCUIT_EVALUATION``.
+        """
+        return settings.GROUP_SHORT_CIRCUIT_EVALUATION
+
     def fill_evaluation_environ_post_problem(self, environ, submission):
         """Run after ProblemController.fill_evaluation_environ."""
+        if self.use_fail_fast_evaluation(submission):
+            environ['fail_fast'] = True
+        elif environ.get('group_scorer',
+                'oioioi.programs.utils.min_group_scorer') == \
+                'oioioi.programs.utils.min_group_scorer' and \
+                self.use_group_short_circuiting(submission):
+            environ['short_circuit_groups'] = True
         if 'INITIAL' in environ['report_kinds']:
             add_before_placeholder(environ, 'after_initial_tests',
                     ('update_report_statuses',
@@ -1,5 +1,7 @@
+import json
 import logging
 import functools
+import time
 from collections import defaultdict
 import types
 
@@ -13,9 +15,11 @@ from django.conf import settings
 from oioioi.base.utils import make_html_link
 from oioioi.evalmgr.tasks import transfer_job
 from oioioi.contests.scores import ScoreValue, IntegerScore
-from oioioi.contests.models import Submission, SubmissionReport, \
+from oioioi.contests.models import SubmissionReport, \
         ScoreReport
 from oioioi.contests.handlers import _get_submission_or_skip
+from oioioi.programs.compile_cache import add_binary, binary_path, \
+        compile_cache_key, get_cached_binary
 from oioioi.programs.models import CompilationReport, TestReport, \
         GroupReport, Test, UserOutGenStatus
 from oioioi.filetracker.client import get_client
@@ -84,6 +88,12 @@ def compile(env, **kwargs):
             binary path
           * env['compilation_message'] - contains compiler stdout and stderr
           * env['exec_info'] - information how to execute the compiled file
+          * env['compiled_file_cached'] - set to ``True`` if
+            env['compiled_file'] is kept in the compilation cache (see
+            :mod:`oioioi.programs.compile_cache`) and must not be deleted
+
+       If the same source was compiled before in the same way, the binary is
+       taken from the compilation cache and no job is sent to the workers.
     """
 
     compilation_job = env.copy()
@@ -92,6 +102,21 @@ def compile(env, **kwargs):
     compilation_job['out_file'] = _make_filename(env, 'exe')
     if 'language' in env and 'compiler' not in env:
         compilation_job['compiler'] = 'default-' + env['language']
+
+    cache_key = compile_cache_key(env, compilation_job.get('compiler'))
+    if cache_key is not None:
+        binary = get_cached_binary(cache_key)
+        if binary is not None:
+            env['compiled_file'] = django_to_filetracker_path(binary.file)
+            env['compiled_file_cached'] = True
+            env['compilation_message'] = binary.compiler_output
+            env['compilation_result'] = 'OK'
+            env['exec_info'] = json.loads(binary.exec_info)
+            return env
+        compilation_job['out_file'] = binary_path(cache_key)
+        env['compile_cache_key'] = cache_key
+        env['compile_start_time'] = time.time()
+
     env['workers_jobs'] = {'compile': compilation_job}
     return transfer_job(env,
             'oioioi.sioworkers.handlers.transfer_job',
@@ -99,14 +124,53 @@ def compile(env, **kwargs):
 
 
 def compile_end(env, **kwargs):
+    if env.get('compiled_file_cached'):
+        # Taken from the compilation cache by compile.
+        return env
     new_env = env['workers_jobs.results']['compile']
     env['compiled_file'] = new_env.get('out_file')
     env['compilation_message'] = new_env.get('compiler_output', '')
     env['compilation_result'] = new_env.get('result_code', 'CE')
     env['exec_info'] = new_env.get('exec_info', {})
+    cache_key = env.pop('compile_cache_key', None)
+    start_time = env.pop('compile_start_time', None)
+    if cache_key is not None and env['compilation_result'] == 'OK':
+        try:
+            add_binary(cache_key, env,
+                       int((time.time() - start_time) * 1000))
+            env['compiled_file_cached'] = True
+        # pylint: disable=broad-except
+        except Exception:
+            logger.exception("Could not add %s to the compilation cache",
+                             env['compiled_file'])
     return env
 
 
+def _get_old_test_reports(submission_id, test_names=None):
+    """Returns results from the active reports of the submission, as
+       a dictionary mapping test names to dictionaries with ``score``,
+       ``max_score``, ``status`` and ``time_used`` keys.
+    """
+    reports = TestReport.objects.filter(
+            submission_report__submission__id=submission_id,
+            submission_report__status='ACTIVE') \
+            .only('test_name', 'score', 'test_max_score', 'status',
+                  'time_used')
+    if test_names is not None:
+        reports = reports.filter(test_name__in=test_names)
+    old_reports = {}
+    for report in reports:
+        score = report.score
+        max_score = IntegerScore(report.test_max_score)
+        old_reports[report.test_name] = {
+            'score': score and score.serialize(),
+            'max_score': max_score and max_score.serialize(),
+            'status': report.status,
+            'time_used': report.time_used,
+        }
+    return old_reports
+
+
 @_skip_on_compilation_error
 @transaction.atomic
 def collect_tests(env, **kwargs):
@@ -118,41 +182,48 @@ def collect_tests(env, **kwargs):
 
        Produced ``environ`` keys:
           * ``tests``: a dictionary mapping test names to test envs
+          * ``old_test_reports``: (only for rejudges) a dictionary mapping
+            names of tests, which won't be judged again, to their results
+            from the active report (see :func:`grade_tests`)
     """
 
     env.setdefault('tests', {})
 
-    if 'tests_subset' in env['extra_args']:
-        tests = Test.objects.in_bulk(env['extra_args']['tests_subset']) \
-                                                                    .values()
-    else:
-        tests = Test.objects.filter(
-            problem_instance__id=env['problem_instance_id'],
-            is_active=True)
-
     problem_instance = env['problem_instance_id']
+    rejudge_type = None
     if env['is_rejudge']:
-        submission = env['submission_id']
         rejudge_type = env['extra_args'].setdefault('rejudge_type', 'FULL')
         tests_to_judge = env['extra_args'].setdefault('tests_to_judge', [])
-        test_reports = TestReport.objects.filter(
-            submission_report__submission__id=submission,
-            submission_report__status='ACTIVE')
-        tests_used = [report.test_name for report in test_reports]
-        if rejudge_type == 'NEW':
+        old_reports = _get_old_test_reports(env['submission_id'])
+        tests_used = set(old_reports)
+
+    # A JUDGED rejudge always uses the tests of the active report, even
+    # if a tests subset is given.
+    if rejudge_type == 'JUDGED':
+        tests = list(Test.objects.filter(
+            problem_instance__id=problem_instance,
+            name__in=tests_used))
+    elif 'tests_subset' in env['extra_args']:
+        tests = Test.objects.in_bulk(env['extra_args']['tests_subset']) \
+                                                                    .values()
+    else:
+        tests = list(Test.objects.filter(
+            problem_instance__id=problem_instance,
+            is_active=True))
+
+    if rejudge_type == 'NEW':
+        if 'tests_subset' in env['extra_args']:
             tests_to_judge = [t.name for t in
                               Test.objects.filter(
                                   problem_instance__id=problem_instance,
                                   is_active=True)
                               .exclude(name__in=tests_used)]
-        elif rejudge_type == 'JUDGED':
-            tests = Test.objects.filter(
-                problem_instance__id=problem_instance,
-                name__in=tests_used)
-            tests_to_judge = [t for t in tests_to_judge if t in tests_used]
-        elif rejudge_type == 'FULL':
-            tests_to_judge = [t.name for t in tests]
-    else:
+        else:
+            tests_to_judge = [t.name for t in tests
+                              if t.name not in tests_used]
+    elif rejudge_type == 'JUDGED':
+        tests_to_judge = [t for t in tests_to_judge if t in tests_used]
+    elif rejudge_type in (None, 'FULL'):
         tests_to_judge = [t.name for t in tests]
 
     for test in tests:
@@ -176,6 +247,11 @@ def collect_tests(env, **kwargs):
 
     for test in tests_to_judge:
         env['tests'][test]['to_judge'] = True
+
+    if env['is_rejudge']:
+        env['old_test_reports'] = dict((name, report)
+                for name, report in old_reports.iteritems()
+                if name in env['tests'] and not env['tests'][name]['to_judge'])
     return env
 
 
@@ -203,6 +279,19 @@ def run_tests(env, kind=None, **kwargs):
            arguments passed to
            :fun:`oioioi.sioworkers.jobs.run_sioworkers_jobs`
            (kwargs).
+         * ``fail_fast``: set to ``True`` if the evaluation should stop at
+           the first failed test. The tests are then run in waves (example
+           tests first, then in their order; the first wave has
+           ``settings.FAIL_FAST_FIRST_WAVE_SIZE`` tests, every next one is
+           twice as big), and tests of the waves not run get ``SKIP`` as
+           their ``result_code``. It's ignored if ``save_outputs`` is set.
+         * ``short_circuit_groups``: like ``fail_fast``, but the waves are
+           formed in every test group separately (the first one has
+           ``settings.GROUP_SHORT_CIRCUIT_FIRST_WAVE_SIZE`` tests of the
+           group) and only the tests of groups with a failed test are
+           skipped. It makes sense for groups scored by their worst test
+           only, like with
+           :func:`~oioioi.programs.utils.min_group_scorer`.
 
        Produced ``environ`` keys:
          * ``test_results``: a dictionary, mapping test names into
@@ -252,9 +341,67 @@ def run_tests(env, kind=None, **kwargs):
         job['untrusted_checker'] = env['untrusted_checker']
         jobs[test_name] = job
     extra_args = env.get('sioworkers_extra_args', {}).get(kind, {})
+    env['workers_jobs.not_to_judge'] = not_to_judge
+    if not env.get('save_outputs'):
+        if env.get('fail_fast'):
+            return _run_in_waves(env, jobs, extra_args, by_group=False,
+                    wave_size=settings.FAIL_FAST_FIRST_WAVE_SIZE)
+        if env.get('short_circuit_groups'):
+            return _run_in_waves(env, jobs, extra_args, by_group=True,
+                    wave_size=settings.GROUP_SHORT_CIRCUIT_FIRST_WAVE_SIZE)
     env['workers_jobs'] = jobs
     env['workers_jobs.extra_args'] = extra_args
-    env['workers_jobs.not_to_judge'] = not_to_judge
+    return transfer_job(env,
+            'oioioi.sioworkers.handlers.transfer_job',
+            'oioioi.sioworkers.handlers.restore_job')
+
+
+def _wave_order(test_env):
+    """Example tests go first, as they are the most likely to fail, then
+       the tests are run in their order.
+    """
+    return (test_env['kind'] != 'EXAMPLE', test_env['order'],
+            test_env['name'])
+
+
+def _wave_chain(pending, test_env):
+    """Returns the key of the tests skipped together with the given one
+       after it fails.
+    """
+    if pending['by_group']:
+        return test_env['group']
+    return None
+
+
+def _run_in_waves(env, jobs, extra_args, by_group, wave_size):
+    order = sorted(jobs, key=lambda name: _wave_order(jobs[name]))
+    return _run_next_wave(env, {
+        'jobs': [[name, jobs[name]] for name in order],
+        'wave_size': wave_size,
+        'extra_args': extra_args,
+        'by_group': by_group,
+    })
+
+
+def _run_next_wave(env, pending):
+    """Sends the next wave of ``pending`` jobs to the workers, leaving
+       the rest in ``env['workers_jobs.pending']``.
+    """
+    wave_size = pending['wave_size']
+    taken = defaultdict(int)
+    wave = []
+    rest = []
+    for name, job in pending['jobs']:
+        chain = _wave_chain(pending, job)
+        if taken[chain] < wave_size:
+            taken[chain] += 1
+            wave.append((name, job))
+        else:
+            rest.append([name, job])
+    env['workers_jobs'] = dict(wave)
+    env['workers_jobs.extra_args'] = pending['extra_args']
+    env['workers_jobs.pending'] = dict(pending, jobs=rest,
+            wave_size=2 * wave_size)
     return transfer_job(env,
             'oioioi.sioworkers.handlers.transfer_job',
             'oioioi.sioworkers.handlers.restore_job')
@@ -262,12 +409,40 @@ def run_tests(env, kind=None, **kwargs):
 
 @_skip_on_compilation_error
 def run_tests_end(env, **kwargs):
-    not_to_judge = env['workers_jobs.not_to_judge']
-    del env['workers_jobs.not_to_judge']
     jobs = env['workers_jobs.results']
     env.setdefault('test_results', {})
     for test_name, result in jobs.iteritems():
         env['test_results'].setdefault(test_name, {}).update(result)
+
+    pending = env.get('workers_jobs.pending')
+    if pending is not None:
+        failed = set(_wave_chain(pending, env['tests'][test_name])
+                     for test_name, result in jobs.iteritems()
+                     if result.get('result_code') != 'OK')
+        to_run = []
+        for test_name, job in pending['jobs']:
+            if _wave_chain(pending, job) not in failed:
+                to_run.append([test_name, job])
+                continue
+            result = env['test_results'].setdefault(test_name, {})
+            result.update(job)
+            result.update({
+                'result_code': 'SKIP',
+                'result_string': '',
+                'time_used': 0,
+                'stderr': '',
+            })
+        if to_run:
+            # The recipe's own run_tests_end processes the results of
+            # the first wave only, so it's run again for every next one.
+            env['recipe'] = [('wave_run_tests_end',
+                              'oioioi.programs.handlers.run_tests_end')] + \
+                    list(env['recipe'])
+            return _run_next_wave(env, dict(pending, jobs=to_run))
+        del env['workers_jobs.pending']
+
+    not_to_judge = env['workers_jobs.not_to_judge']
+    del env['workers_jobs.not_to_judge']
     for test_name in not_to_judge:
         env['test_results'].setdefault(test_name, {}) \
                 .update(env['tests'][test_name])
@@ -285,10 +460,15 @@ def grade_tests(env, **kwargs):
        (instance of some subclass of
        :class:`~oioioi.contests.scores.ScoreValue`) and a status.
 
+       Results of tests which are not judged again are copied from
+       ``env['old_test_reports']`` (or from the active report, if it's
+       missing).
+
        Used ``environ`` keys:
          * ``tests``
          * ``test_results``
          * ``test_scorer``
+         * ``old_test_reports``
 
        Produced ``environ`` keys:
          * `score`, `max_score` and `status` keys in ``env['test_result']``
@@ -297,6 +477,12 @@ def grade_tests(env, **kwargs):
     fun = import_string(env.get('test_scorer')
             or settings.DEFAULT_TEST_SCORER)
     tests = env['tests']
+    old_reports = env.get('old_test_reports')
+    not_judged = [test_name for test_name in env['test_results']
+                  if not tests[test_name]['to_judge']]
+    if old_reports is None and not_judged:
+        old_reports = _get_old_test_reports(env['submission_id'],
+                                            not_judged)
     for test_name, test_result in env['test_results'].iteritems():
         if tests[test_name]['to_judge']:
             score, max_score, status = fun(tests[test_name], test_result)
@@ -306,19 +492,7 @@ def grade_tests(env, **kwargs):
             test_result['max_score'] = max_score and max_score.serialize()
             test_result['status'] = status
         else:
-            report = TestReport.objects.get(
-                submission_report__submission__id=env['submission_id'],
-                submission_report__status='ACTIVE',
-                test_name=test_name)
-            score = report.score
-            max_score = IntegerScore(report.test_max_score)
-            status = report.status
-            time_used = report.time_used
-            test_result['score'] = score and score.serialize()
-            test_result['max_score'] = max_score and max_score.serialize()
-            test_result['status'] = status
-            test_result['time_used'] = time_used
-            env['test_results'][test_name] = test_result
+            test_result.update(old_reports[test_name])
     return env
 
 
@@ -463,6 +637,27 @@ def _make_base_report(env, submission, kind):
     return submission, submission_report
 
 
+def _bulk_create_reports(model, reports, name_field, submission_report):
+    """Creates ``reports`` (all of them belonging to ``submission_report``)
+       with a single query and sets their ids.
+
+       Not all database backends return the ids from ``bulk_create``, so if
+       they are missing, they are fetched with one more query, using
+       ``name_field``, which is unique within the submission report.
+    """
+    if not reports:
+        return
+    model.objects.bulk_create(reports)
+    if all(report.id is not None for report in reports):
+        return
+    ids = dict(model.objects.filter(submission_report=submission_report)
+               .filter(**{name_field + '__in':
+                          [getattr(report, name_field) for report in reports]})
+               .values_list(name_field, 'id'))
+    for report in reports:
+        report.id = ids[getattr(report, name_field)]
+
+
 @transaction.atomic
 def make_report(env, kind='NORMAL', save_scores=True, **kwargs):
     """Builds entities for tests results in a database.
@@ -480,6 +675,11 @@ def make_report(env, kind='NORMAL', save_scores=True, **kwargs):
        Produced ``environ`` keys:
            * ``report_id``: id of the produced
              :class:`~oioioi.contests.models.SubmissionReport`
+
+       Also sets ``report_id`` in ``test_results`` and ``result_id`` in
+       ``group_results`` to ids of the created
+       :class:`~oioioi.programs.models.TestReport` and
+       :class:`~oioioi.programs.models.GroupReport` objects.
     """
     submission, submission_report = _make_base_report(env, kind)
 
@@ -487,6 +687,8 @@ def make_report(env, kind='NORMAL', save_scores=True, **kwargs):
         return env
     tests = env['tests']
     test_results = env.get('test_results', {})
+    comment_max_length = TestReport._meta.get_field('comment').max_length
+    test_reports = []
     for test_name, result in test_results.iteritems():
         test = tests[test_name]
         if 'report_id' in result:
@@ -501,21 +703,22 @@ def make_report(env, kind='NORMAL', save_scores=True, **kwargs):
         test_report.status = result['status']
         test_report.time_used = result['time_used']
         test_report.isolate_meta = result.get('isolate_meta', '{}')
-        sid = env['submission_id']
-        pi = Submission.objects.get(id=sid).problem_instance
         test_report.stderr = result['stderr']
         comment = result.get('result_string', '')
         if comment.lower() in ['ok', 'time limit exceeded', 'not judged']:  # Annoying
             comment = ''
-        test_report.comment = Truncator(comment).chars(TestReport.
-                _meta.get_field('comment').max_length)
+        test_report.comment = Truncator(comment).chars(comment_max_length)
         if env.get('save_outputs', False):
             test_report.output_file = filetracker_to_django_file(
                                                             result['out_file'])
-        test_report.save()
-        result['report_id'] = test_report.id
+        test_reports.append(test_report)
+    _bulk_create_reports(TestReport, test_reports, 'test_name',
+                         submission_report)
+    for test_report in test_reports:
+        test_results[test_report.test_name]['report_id'] = test_report.id
 
     group_results = env.get('group_results', {})
+    group_reports = []
     for group_name, group_result in group_results.iteritems():
         if 'report_id' in group_result:
             continue
@@ -525,8 +728,11 @@ def make_report(env, kind='NORMAL', save_scores=True, **kwargs):
         group_report.max_score = \
                 group_result['max_score'] if save_scores else None
         group_report.status = group_result['status']
-        group_report.save()
-        group_result['result_id'] = group_report.id
+        group_reports.append(group_report)
+    _bulk_create_reports(GroupReport, group_reports, 'group',
+                         submission_report)
+    for group_report in group_reports:
+        group_results[group_report.group]['result_id'] = group_report.id
 
     if kind == 'INITIAL':
         if submission.user is not None and not env.get('is_rejudge', False):
@@ -544,7 +750,7 @@ def make_report(env, kind='NORMAL', save_scores=True, **kwargs):
 
 
 def delete_executable(env, **kwargs):
-    if 'compiled_file' in env:
+    if 'compiled_file' in env and not env.get('compiled_file_cached'):
         get_client().delete_file(env['compiled_file'])
     return env
 
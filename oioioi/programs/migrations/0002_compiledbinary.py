@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import oioioi.filetracker.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('programs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompiledBinary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='key')),
+                ('language', models.CharField(blank=True, max_length=32, verbose_name='language')),
+                ('compiler', models.CharField(blank=True, max_length=64, verbose_name='compiler')),
+                ('exec_mode', models.CharField(blank=True, max_length=32, verbose_name='execution mode')),
+                ('file', oioioi.filetracker.fields.FileField(max_length=255, upload_to='compiled_binaries', verbose_name='file')),
+                ('size', models.BigIntegerField(verbose_name='size')),
+                ('compiler_output', models.TextField(blank=True)),
+                ('exec_info', models.TextField(default='{}')),
+                ('compile_time', models.IntegerField(verbose_name='compilation time [ms]')),
+                ('creation_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='creation date')),
+                ('last_used', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='last used')),
+                ('hits', models.IntegerField(default=0, verbose_name='hits')),
+            ],
+            options={
+                'ordering': ['-last_used'],
+                'verbose_name': 'compiled binary',
+                'verbose_name_plural': 'compiled binaries',
+            },
+        ),
+    ]
@@ -2,9 +2,10 @@ from nose.tools import nottest
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models, transaction
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.dispatch import receiver
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from oioioi.base.fields import EnumRegistry, EnumField
 from oioioi.problems.models import Problem, make_problem_filename
 from oioioi.filetracker.fields import FileField
@@ -115,7 +116,8 @@ class ModelSolutionsManager(models.Manager):
                         source_file=model_solution.source_file,
                         kind='IGNORED')
                 submission.save()
-            problem_instance.controller.judge(submission, is_rejudge=True)
+            problem_instance.controller.judge(submission,
+                    extra_args={'model_solution': True}, is_rejudge=True)
 
 
 class ModelSolution(models.Model):
@@ -144,7 +146,8 @@ class ModelSolution(models.Model):
                     source_file=self.source_file,
                     kind='IGNORED')
             submission.save()
-            problem_instance.controller.judge(submission, is_rejudge=True)        
+            problem_instance.controller.judge(submission,
+                    extra_args={'model_solution': True}, is_rejudge=True)
 
 
 @receiver(pre_save, sender=ProblemInstance)
@@ -216,6 +219,8 @@ submission_statuses.register('MLE', _("Memory limit exceeded"))
 submission_statuses.register('OLE', _("Output limit exceeded"))
 submission_statuses.register('SE', _("System error"))
 submission_statuses.register('RV', _("Rule violation"))
+# Tests not run in the fail-fast mode, see oioioi.programs.handlers.run_tests
+submission_statuses.register('SKIP', _("Skipped"))
 
 submission_statuses.register('INI_OK', _("Initial tests: OK"))
 submission_statuses.register('INI_ERR', _("Initial tests: failed"))
@@ -288,3 +293,42 @@ class UserOutGenStatus(models.Model):
                                       related_name='userout_status')
     status = EnumField(submission_statuses, default='?')
     visible_for_user = models.BooleanField(default=True)
+
+
+class CompiledBinary(models.Model):
+    """A binary kept in the compilation cache (see
+       :mod:`oioioi.programs.compile_cache`).
+
+       ``key`` identifies the compilation: it's a digest of the source
+       contents, the language, the compiler, the execution mode and the extra
+       compilation files and arguments.
+    """
+    key = models.CharField(max_length=64, unique=True,
+            verbose_name=_("key"))
+    language = models.CharField(max_length=32, blank=True,
+            verbose_name=_("language"))
+    compiler = models.CharField(max_length=64, blank=True,
+            verbose_name=_("compiler"))
+    exec_mode = models.CharField(max_length=32, blank=True,
+            verbose_name=_("execution mode"))
+    file = FileField(upload_to='compiled_binaries', verbose_name=_("file"))
+    size = models.BigIntegerField(verbose_name=_("size"))
+    compiler_output = models.TextField(blank=True)
+    exec_info = models.TextField(default='{}')
+    compile_time = models.IntegerField(
+            verbose_name=_("compilation time [ms]"))
+    creation_date = models.DateTimeField(default=timezone.now,
+            verbose_name=_("creation date"))
+    last_used = models.DateTimeField(default=timezone.now, db_index=True,
+            verbose_name=_("last used"))
+    hits = models.IntegerField(default=0, verbose_name=_("hits"))
+
+    class Meta(object):
+        verbose_name = _("compiled binary")
+        verbose_name_plural = _("compiled binaries")
+        ordering = ['-last_used']
+
+
+@receiver(post_delete, sender=CompiledBinary)
+def _delete_compiled_binary_file(sender, instance, **kwargs):
+    instance.file.delete(save=False)
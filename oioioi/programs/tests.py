@@ -1,11 +1,13 @@
 import os
+import tempfile
 from collections import defaultdict
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
 
 from django.conf import settings
 from django.test import RequestFactory
+from django.utils import timezone
 from django.utils.timezone import utc
 from django.utils.html import strip_tags, escape
 from django.utils.http import urlencode
@@ -22,13 +24,17 @@ from oioioi.contests.models import Submission, ProblemInstance, Contest, Round
 from oioioi.contests.tests import PrivateRegistrationController, \
         SubmitFileMixin
 from oioioi.programs.models import Test, ModelSolution, ProgramSubmission, \
-        TestReport, ReportActionsConfig
+        TestReport, GroupReport, ReportActionsConfig, CompiledBinary
 from oioioi.programs.controllers import ProgrammingContestController
 from oioioi.sinolpack.tests import get_test_filename
 from oioioi.contests.scores import IntegerScore
 from oioioi.base.utils import memoized_property
 from oioioi.base.notification import NotificationHandler
-from oioioi.programs.handlers import make_report
+from oioioi.filetracker.client import get_client
+from oioioi.programs import compile_cache
+from oioioi.programs.handlers import make_report, grade_tests, grade_groups, \
+        run_tests, run_tests_end, compile, compile_end, delete_executable, \
+        collect_tests
 from oioioi.programs.views import _testreports_to_generate_outs
 
 
@@ -681,6 +687,253 @@ class TestNotifications(TestCase):
         NotificationHandler.send_notification = send_notification_backup
 
 
+class TestMakeReport(TestCase):
+    fixtures = ['test_users', 'test_contest', 'test_full_package',
+            'test_problem_instance', 'test_submission']
+
+    def test_many_tests(self):
+        num_tests = 500
+        tests = {}
+        test_results = {}
+        group_results = {}
+        for i in xrange(num_tests):
+            name = str(i)
+            tests[name] = {'name': name, 'group': name, 'max_score': 10,
+                           'exec_time_limit': 1000}
+            test_results[name] = {'score': IntegerScore(10).serialize(),
+                                  'status': 'OK', 'time_used': 10,
+                                  'stderr': '', 'result_string': 'ok'}
+            group_results[name] = {'score': IntegerScore(10).serialize(),
+                                   'max_score': IntegerScore(10).serialize(),
+                                   'status': 'OK'}
+        env = {'compilation_result': 'OK', 'submission_id': 1,
+               'status': 'OK', 'score': None, 'max_score': None,
+               'compilation_message': '', 'tests': tests,
+               'test_results': test_results, 'group_results': group_results}
+
+        with self.assertNumQueriesLessThan(20):
+            env = make_report(env)
+
+        test_reports = TestReport.objects.filter(
+                submission_report_id=env['report_id'])
+        self.assertEqual(test_reports.count(), num_tests)
+        self.assertEqual(
+                dict(test_reports.values_list('test_name', 'id')),
+                dict((name, result['report_id'])
+                     for name, result in env['test_results'].iteritems()))
+        group_reports = GroupReport.objects.filter(
+                submission_report_id=env['report_id'])
+        self.assertEqual(
+                dict(group_reports.values_list('group', 'id')),
+                dict((name, result['result_id'])
+                     for name, result in env['group_results'].iteritems()))
+
+
+@override_settings(COMPILE_CACHE_SIZE=150, COMPILE_CACHE_MIN_AGE=60)
+class TestCompileCache(TestCase):
+    def setUp(self):
+        compile_cache.reset_stats()
+        self._put_file('/sources/a.cpp', 'int main() {}')
+
+    def _put_file(self, path, data):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            get_client().put_file(path, f.name)
+
+    def _compile(self, **extra):
+        env = {'source_file': '/sources/a.cpp', 'language': 'cpp',
+               'exec_mode': 'cpu', 'job_id': 'job', 'recipe': []}
+        env.update(extra)
+        env = compile(env)
+        if 'transfer' not in env:
+            return compile_end(env)
+        out_file = env['workers_jobs']['compile']['out_file']
+        self._put_file(out_file, 'x' * 100)
+        env['workers_jobs.results'] = {'compile': {
+            'out_file': out_file,
+            'result_code': 'OK',
+            'compiler_output': 'warning',
+            'exec_info': {'mode': 'executable'},
+        }}
+        return compile_end(env)
+
+    def test_hit(self):
+        env = self._compile()
+        binary = CompiledBinary.objects.get()
+        self.assertEqual(binary.size, 100)
+        self.assertEqual(binary.compiler, 'default-cpp')
+        self.assertTrue(env['compiled_file_cached'])
+        delete_executable(env)
+        self.assertTrue(binary.file.storage.exists(binary.file.name))
+
+        env = self._compile()
+        self.assertEqual(env['compiled_file'], compile_cache.binary_path(
+            binary.key))
+        self.assertEqual(env['compilation_result'], 'OK')
+        self.assertEqual(env['compilation_message'], 'warning')
+        self.assertEqual(env['exec_info'], {'mode': 'executable'})
+        self.assertEqual(CompiledBinary.objects.get().hits, 1)
+
+        self._compile(exec_mode='unsafe')
+        self.assertEqual(CompiledBinary.objects.count(), 2)
+        stats = compile_cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_eviction(self):
+        self._compile()
+        old = CompiledBinary.objects.get()
+        CompiledBinary.objects.update(
+                last_used=timezone.now() - timedelta(minutes=5))
+        self._compile(extra_compilation_args=['-DLOCAL'])
+        new = CompiledBinary.objects.get()
+        self.assertNotEqual(old.key, new.key)
+        self.assertFalse(old.file.storage.exists(old.file.name))
+
+        # Binaries used recently are kept, even if the cache gets too big.
+        self._compile(exec_mode='unsafe')
+        self.assertEqual(CompiledBinary.objects.count(), 2)
+
+    def test_compilation_error(self):
+        env = {'source_file': '/sources/a.cpp', 'language': 'cpp',
+               'job_id': 'job'}
+        env = compile(env)
+        env['workers_jobs.results'] = {'compile': {'result_code': 'CE'}}
+        env = compile_end(env)
+        self.assertFalse(env.get('compiled_file_cached'))
+        self.assertFalse(CompiledBinary.objects.exists())
+
+
+class TestFailFastEvaluation(TestCase):
+    def _env(self, num_tests):
+        tests = {}
+        for i in xrange(num_tests):
+            name = 'test%d' % i
+            tests[name] = {'name': name, 'kind': 'NORMAL', 'order': i,
+                           'group': name, 'max_score': 10,
+                           'to_judge': name != 'test0'}
+        if 'test9' in tests:
+            tests['test9']['kind'] = 'EXAMPLE'
+        return {'tests': tests, 'fail_fast': True, 'submission_kind': 'NORMAL',
+                'compiled_file': '/exe', 'exec_info': {},
+                'untrusted_checker': True,
+                'recipe': [('run_tests_end',
+                            'oioioi.programs.handlers.run_tests_end'),
+                           ('next', 'next')]}
+
+    def _run_wave(self, env, failed=()):
+        env.pop('transfer')
+        self.assertEqual(env['recipe'][0][1],
+                         'oioioi.programs.handlers.run_tests_end')
+        env['recipe'] = env['recipe'][1:]
+        env['workers_jobs.results'] = dict(
+                (name, dict(job, result_code='WA' if name in failed else 'OK',
+                            time_used=10, stderr=''))
+                for name, job in env.pop('workers_jobs').iteritems())
+        return run_tests_end(env)
+
+    @override_settings(FAIL_FAST_FIRST_WAVE_SIZE=2)
+    def test_waves(self):
+        env = run_tests(self._env(12))
+        self.assertItemsEqual(env['workers_jobs'], ['test9', 'test1'])
+        env = self._run_wave(env)
+        self.assertItemsEqual(env['workers_jobs'],
+                              ['test2', 'test3', 'test4', 'test5'])
+        env = self._run_wave(env, failed=['test3'])
+        self.assertNotIn('transfer', env)
+        self.assertEqual(env['recipe'], [('next', 'next')])
+        self.assertNotIn('workers_jobs.pending', env)
+
+        statuses = dict((name, result['result_code'])
+                        for name, result in env['test_results'].iteritems()
+                        if 'result_code' in result)
+        self.assertEqual(statuses, {
+            'test9': 'OK', 'test1': 'OK', 'test2': 'OK', 'test3': 'WA',
+            'test4': 'OK', 'test5': 'OK', 'test6': 'SKIP', 'test7': 'SKIP',
+            'test8': 'SKIP', 'test10': 'SKIP', 'test11': 'SKIP'})
+        self.assertIn('test0', env['test_results'])
+
+    @override_settings(FAIL_FAST_FIRST_WAVE_SIZE=2)
+    def test_all_passed(self):
+        env = run_tests(self._env(4))
+        env = self._run_wave(env)
+        env = self._run_wave(env)
+        self.assertNotIn('transfer', env)
+        self.assertTrue(all(env['test_results'][name]['result_code'] == 'OK'
+                            for name in ['test1', 'test2', 'test3']))
+
+    @override_settings(GROUP_SHORT_CIRCUIT_FIRST_WAVE_SIZE=2)
+    def test_short_circuit_groups(self):
+        env = self._env(0)
+        env.update({'fail_fast': False, 'short_circuit_groups': True,
+                    'test_scorer': 'oioioi.programs.utils.discrete_test_scorer',
+                    'group_scorer': 'oioioi.programs.utils.min_group_scorer'})
+        for order, name in enumerate(['1a', '1b', '1c', '1d', '1e',
+                                      '2a', '2b', '2c']):
+            env['tests'][name] = {'name': name, 'kind': 'NORMAL',
+                                  'order': order, 'group': name[0],
+                                  'max_score': 10, 'to_judge': True}
+
+        env = run_tests(env)
+        self.assertItemsEqual(env['workers_jobs'], ['1a', '1b', '2a', '2b'])
+        env = self._run_wave(env, failed=['1b'])
+        self.assertItemsEqual(env['workers_jobs'], ['2c'])
+        self.assertEqual(env['test_results']['1d']['result_code'], 'SKIP')
+        env = self._run_wave(env)
+        self.assertNotIn('transfer', env)
+        self.assertEqual(len(env['test_results']), 8)
+
+        env = grade_groups(grade_tests(env))
+        self.assertEqual(env['test_results']['1c']['status'], 'SKIP')
+        self.assertEqual(env['group_results']['1']['status'], 'WA')
+        self.assertEqual(env['group_results']['1']['score'],
+                         IntegerScore(0).serialize())
+        self.assertEqual(env['group_results']['2']['status'], 'OK')
+        self.assertEqual(env['group_results']['2']['score'],
+                         IntegerScore(10).serialize())
+
+    def test_disabled_when_saving_outputs(self):
+        env = self._env(12)
+        env['save_outputs'] = True
+        env['job_id'] = 'job'
+        env = run_tests(env)
+        self.assertEqual(len(env['workers_jobs']), 11)
+        self.assertNotIn('workers_jobs.pending', env)
+
+
+@override_settings(GROUP_SHORT_CIRCUIT_EVALUATION=True,
+                   GROUP_SHORT_CIRCUIT_FIRST_WAVE_SIZE=1)
+class TestGroupShortCircuitJudging(TestCase, SubmitFileMixin):
+    fixtures = ['test_users', 'test_contest', 'test_full_package',
+                'test_problem_instance']
+
+    def _judge(self, code, prog_lang='C'):
+        contest = Contest.objects.get()
+        self.client.login(username='test_user')
+        self.submit_code(contest, ProblemInstance.objects.get(), code,
+                         prog_lang=prog_lang)
+        submission = ProgramSubmission.objects.get()
+        self.assertNotEqual(submission.status, 'SE')
+        return dict(TestReport.objects.filter(
+                submission_report__submission=submission,
+                submission_report__status='ACTIVE',
+                submission_report__kind='NORMAL')
+                .values_list('test_name', 'status'))
+
+    def test_failed_group(self):
+        statuses = self._judge('int main(void) { return 1; }')
+        self.assertEqual(statuses, {'1a': 'RE', '1b': 'SKIP', '2': 'RE',
+                                    '3': 'RE'})
+
+    def test_second_wave(self):
+        statuses = self._judge(open(
+                get_test_filename('sum-various-results.cpp')).read(),
+                prog_lang='C++')
+        self.assertEqual(statuses, {'1a': 'OK', '1b': 'RE', '2': 'WA',
+                                    '3': 'OK'})
+
+
 class TestScorers(TestCase):
     t_results_ok = (
         ({'exec_time_limit': 100, 'max_score': 100},
@@ -1075,6 +1328,38 @@ class TestRejudge(TestCase, SubmitFileMixin):
                            ['0', '1b', '3'],
                            ['1a', '2'])
 
+    def test_rejudge_judged_with_tests_subset(self):
+        TestReport.objects.filter(test_name__in=['2', '3']).delete()
+        env = {'is_rejudge': True,
+               'submission_id': 1,
+               'problem_instance_id': 1,
+               'extra_args': {
+                   'rejudge_type': 'JUDGED',
+                   'tests_to_judge': ['0', '2'],
+                   'tests_subset': list(Test.objects
+                       .filter(problem_instance__id=1)
+                       .values_list('id', flat=True))}}
+        env = collect_tests(env)
+        self.assertEqual(set(env['tests']), set(['0', '1ocen', '1a', '1b']))
+        self.assertEqual([name for name, test in env['tests'].iteritems()
+                          if test['to_judge']], ['0'])
+        self.assertEqual(set(env['old_test_reports']),
+                         set(['1ocen', '1a', '1b']))
+
+    def test_grade_tests_uses_old_reports(self):
+        score = IntegerScore(10).serialize()
+        env = {'submission_id': 1,
+               'tests': {'0': {'to_judge': False}},
+               'test_results': {'0': {}},
+               'old_test_reports': {'0': {'score': score,
+                                          'max_score': score,
+                                          'status': 'OK',
+                                          'time_used': 10}}}
+        with self.assertNumQueries(0):
+            env = grade_tests(env)
+        self.assertEqual(env['test_results']['0']['status'], 'OK')
+        self.assertEqual(env['test_results']['0']['score'], score)
+
 
 class TestLimitsLimits(TestCase):
     fixtures = ['test_users', 'test_contest', 'test_full_package',
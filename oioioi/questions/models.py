@@ -10,11 +10,13 @@ from django.utils.text import Truncator
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 
 from oioioi.contests.models import Contest, Round, ProblemInstance
 from oioioi.base.fields import EnumRegistry, EnumField
 from oioioi.base.utils.validators import validate_whitespaces
+from oioioi.status.utils import invalidate_contest_status, \
+        invalidate_user_status
 
 message_kinds = EnumRegistry()
 message_kinds.register('QUESTION', _("Question"))
@@ -131,6 +133,21 @@ class MessageNotifierConfig(models.Model):
         verbose_name_plural = _("notified about new questions")
 
 
+@receiver([post_save, post_delete], sender=Message)
+def _message_changed(sender, instance, **kwargs):
+    if instance.contest_id:
+        invalidate_contest_status(instance.contest_id)
+
+
+@receiver([post_save, post_delete], sender=MessageView)
+def _message_view_changed(sender, instance, **kwargs):
+    # The message may be already deleted (or not loaded yet by loaddata).
+    contest_id = Message.objects.filter(id=instance.message_id) \
+            .values_list('contest_id', flat=True).first()
+    if contest_id:
+        invalidate_user_status(contest_id, instance.user_id)
+
+
 @receiver(post_save, sender=Message)
 def send_notification(sender, instance, created, **kwargs):
     # Don't send a notification when the message was just edited
@@ -1,11 +1,17 @@
+import bisect
+
 from django.core.urlresolvers import reverse
 from django.utils.translation import ungettext
 from django.utils.functional import lazy
 from oioioi.base.utils import make_navbar_badge
+from oioioi.contests.models import Round
 from oioioi.contests.utils import can_enter_contest, is_contest_admin
+from oioioi.questions.models import Message
 from oioioi.questions.utils import unanswered_questions
 from oioioi.questions.views import new_messages, visible_messages
 from oioioi.status.registry import status_registry
+from oioioi.status.utils import get_contest_status_data, \
+        get_user_status_data
 
 
 def navbar_tip_processor(request):
@@ -17,7 +23,7 @@ def navbar_tip_processor(request):
         return {}
 
     def generator():
-        messages = navbar_messages_generator(request)
+        messages = cached_navbar_messages(request)
         if not messages: return ''
         return make_navbar_badge(**messages)
     return {'extra_navbar_right_messages': lazy(generator, unicode)()}
@@ -25,12 +31,45 @@ def navbar_tip_processor(request):
 
 @status_registry.register
 def get_messages(request, response):
-    messages = navbar_messages_generator(request)
+    messages = cached_navbar_messages(request)
     if messages:
         response['messages'] = messages
     return response
 
 
+def _get_visibility_change_dates(contest):
+    """Returns the sorted dates, at which messages of the contest may
+       become visible.
+    """
+    dates = set()
+    for date, pub_date in Message.objects.filter(contest=contest) \
+            .values_list('date', 'pub_date'):
+        dates.add(date)
+        dates.add(pub_date)
+    for start_date, end_date in Round.objects.filter(contest=contest) \
+            .values_list('start_date', 'end_date'):
+        dates.add(start_date)
+        dates.add(end_date)
+    dates.discard(None)
+    return sorted(dates)
+
+
+def cached_navbar_messages(request):
+    """Returns the result of :func:`navbar_messages_generator`, cached
+       for the user until the messages change.
+    """
+    if request.contest is None:
+        return {}
+    dates = get_contest_status_data(request.contest, 'messages_dates',
+                                    _get_visibility_change_dates)
+    # The visible messages may change at the dates, so they're a part of
+    # the key.
+    period = bisect.bisect_right(dates, request.timestamp)
+    return get_user_status_data(request, 'messages',
+            navbar_messages_generator,
+            key=(is_contest_admin(request), period))
+
+
 def navbar_messages_generator(request):
     if request.contest is None:
         return {}
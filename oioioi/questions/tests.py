@@ -13,13 +13,15 @@ from oioioi.contests.models import Contest, ProblemInstance
 from oioioi.programs.controllers import ProgrammingContestController
 from oioioi.questions.models import Message, ReplyTemplate
 from oioioi.questions.forms import FilterMessageForm
+from oioioi.questions.processors import cached_navbar_messages, \
+        navbar_messages_generator
 from oioioi.questions.utils import unanswered_questions
 from oioioi.base.notification import NotificationHandler
 from .views import visible_messages
 from oioioi.questions.management.commands.mailnotifyd import \
     mailnotify, candidate_messages
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 class TestContestControllerMixin(object):
@@ -102,6 +104,40 @@ class TestQuestions(TestCase):
         self.assertListEqual([9, 8, 7, 6, 5, 4, 10, 3, 2, 1],
                 [m.id for m in visible_messages(make_request('test_admin'))])
 
+    def test_cached_navbar_messages(self):
+        contest = Contest.objects.get()
+        round = contest.round_set.get()
+        admin = User.objects.get(username='test_admin')
+        timestamp = datetime(2013, 9, 7, 13, 40, 0, tzinfo=timezone.utc)
+
+        def make_request(timestamp):
+            request = RequestFactory().request()
+            request.timestamp = timestamp
+            request.contest = contest
+            request.user = User.objects.get(username='test_user2')
+            return request
+
+        def check_messages(timestamp):
+            messages = cached_navbar_messages(make_request(timestamp))
+            self.assertEqual(messages,
+                    navbar_messages_generator(make_request(timestamp)))
+            return messages
+
+        before = check_messages(timestamp)
+        Message.objects.create(round=round, author=admin, kind='PUBLIC',
+                topic='new-public', content='new-public-body',
+                date=timestamp - timedelta(minutes=1))
+        after = check_messages(timestamp)
+        self.assertNotEqual(before, after)
+
+        Message.objects.create(round=round, author=admin, kind='PUBLIC',
+                topic='scheduled-public', content='scheduled-public-body',
+                date=timestamp - timedelta(minutes=1),
+                pub_date=timestamp + timedelta(minutes=1))
+        self.assertEqual(check_messages(timestamp), after)
+        self.assertNotEqual(
+                check_messages(timestamp + timedelta(minutes=2)), after)
+
     def test_new_labels(self):
         self.client.login(username='test_user')
         contest = Contest.objects.get()
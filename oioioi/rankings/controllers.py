@@ -1,12 +1,15 @@
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from operator import itemgetter
+import hashlib
+import time
 import unicodecsv
 
 from django.conf import settings
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse
+from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.template import RequestContext
-from django.template.loader import render_to_string
+from django.template.loader import get_template, render_to_string
 from django.test import RequestFactory
 from django.utils import timezone
 from django.utils.encoding import force_unicode
@@ -14,8 +17,10 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User, AnonymousUser
 
-from oioioi.base.utils import RegisteredSubclassesBase, ObjectWithMixins
+from oioioi.base.utils import RegisteredSubclassesBase, ObjectWithMixins, \
+        memoized
 from oioioi.contests.models import ProblemInstance, UserResultForProblem
+from oioioi.contests.scores import ScoreValue
 from oioioi.contests.controllers import ContestController, \
         ContestControllerContext
 from oioioi.contests.utils import is_contest_admin, is_contest_observer
@@ -26,6 +31,25 @@ from oioioi.rankings.models import Ranking, RankingPage
 
 CONTEST_RANKING_KEY = 'c'
 
+# Version of the format produced by DefaultRankingController.pack_serialized
+PACKED_RANKING_FORMAT = 1
+
+
+# A single page produced by RankingController.build_ranking.
+# ``html`` is None if the page has the same fingerprint as the already
+# stored one, and so it hasn't been rendered again.
+RenderedPage = namedtuple('RenderedPage',
+                          ['fingerprint', 'html', 'render_duration'])
+
+
+class _Echo(object):
+    """File-like object returning what is written to it, so that
+       a csv writer can be used to generate a streamed response.
+    """
+
+    def write(self, value):
+        return value
+
 
 class RankingMixinForContestController(object):
     """ContestController mixin that sets up rankings app.
@@ -38,7 +62,14 @@ class RankingMixinForContestController(object):
     def update_user_results(self, user, problem_instance, *args, **kwargs):
         super(RankingMixinForContestController, self) \
             .update_user_results(user, problem_instance, *args, **kwargs)
-        Ranking.invalidate_contest(problem_instance.round.contest)
+        Ranking.invalidate_user_results(problem_instance.round.contest,
+                                        [(user.id, problem_instance.id)])
+
+    def update_user_results_bulk(self, users_and_problems):
+        super(RankingMixinForContestController, self) \
+            .update_user_results_bulk(users_and_problems)
+        Ranking.invalidate_user_results(self.contest,
+                [(user.id, pi.id) for user, pi in users_and_problems])
 
 ContestController.mix_in(RankingMixinForContestController)
 
@@ -152,22 +183,65 @@ class RankingController(RegisteredSubclassesBase, ObjectWithMixins):
     def get_serialized_ranking(self, key):
         return self.serialize_ranking(key)
 
-    def build_ranking(self, key):
+    def build_ranking(self, key, page_fingerprints=None):
         """Serializes data and renders html for given key.
 
            Results are processed using serialize_ranking, and then as many
            pages as needed are rendered. Returns a tuple containing serialized
-           data and a list of strings, that are html code of ranking pages.
+           data and a list of pages. Each page is either a string with its
+           html code or a :class:`RenderedPage`.
+
+           ``page_fingerprints`` maps page numbers to fingerprints of the
+           currently stored pages. Pages whose fingerprint hasn't changed
+           are not rendered again.
         """
         data = self.serialize_ranking(key)
-        pages = []
+        return data, self._render_ranking_pages(key, data, page_fingerprints)
+
+    def update_ranking(self, key, data, changes, page_fingerprints=None):
+        """Updates previously serialized data and renders html for given key.
+
+           ``changes`` is a list of ``(user_id, problem_instance_id)`` pairs,
+           whose results have changed since ``data`` was serialized.
+
+           Returns a tuple like :meth:`build_ranking` does, or ``None`` if
+           the ranking can't be updated incrementally and has to be rebuilt
+           from scratch.
+        """
+        data = self.update_serialized_ranking(key, data, changes)
+        if data is None:
+            return None
+        return data, self._render_ranking_pages(key, data, page_fingerprints)
+
+    def _num_pages(self, data):
         num_participants = len(data['rows'])
         on_page = data['participants_on_page']
         num_pages = (num_participants + on_page - 1) / on_page
-        num_pages = max(num_pages, 1)  # Render at least a single page
-        for i in range(1, num_pages+1):
-            pages.append(self._render_ranking_page(key, data, i))
-        return data, pages
+        return max(num_pages, 1)  # Render at least a single page
+
+    def _render_ranking_pages(self, key, data, page_fingerprints=None):
+        page_fingerprints = page_fingerprints or {}
+        pages = []
+        for i in range(1, self._num_pages(data) + 1):
+            fingerprint = self._get_page_fingerprint(key, data, i)
+            if fingerprint is not None and \
+                    page_fingerprints.get(i) == fingerprint:
+                pages.append(RenderedPage(fingerprint, None, 0))
+                continue
+            start = time.time()
+            html = self._render_ranking_page(key, data, i)
+            pages.append(RenderedPage(fingerprint, html,
+                                      time.time() - start))
+        return pages
+
+    def _get_page_fingerprint(self, key, data, page):
+        """Returns a string identifying the contents of the given page of
+           the ranking, or ``None`` if the page should always be rendered.
+
+           If the fingerprint of a page is the same as the one of the page
+           rendered previously, the page is not rendered again.
+        """
+        return None
 
     def _fake_request(self, page):
         """Creates a fake request used to render ranking.
@@ -196,6 +270,47 @@ class RankingController(RegisteredSubclassesBase, ObjectWithMixins):
         """
         raise NotImplementedError
 
+    def pack_serialized(self, data):
+        """Converts data returned by :meth:`serialize_ranking` to the form
+           stored by rankingsd. The result is pickled, so it should be
+           compact and consist only of basic Python types.
+        """
+        return data
+
+    def unpack_serialized(self, packed):
+        """Inverts :meth:`pack_serialized`.
+
+           Returns ``None`` if the data can't be unpacked (e.g. it is in an
+           outdated format).
+        """
+        return packed
+
+    def get_user_positions(self, data):
+        """Returns a list of ``(user_id, position)`` pairs for data returned
+           by :meth:`serialize_ranking`, which is stored by rankingsd as an
+           index for :meth:`find_user_position`. ``None`` means no index.
+        """
+        return None
+
+    def update_serialized_ranking(self, key, data, changes):
+        """Patches data returned earlier by :meth:`serialize_ranking`,
+           given the list of changed ``(user_id, problem_instance_id)``
+           pairs.
+
+           Returns ``None`` if this is not supported or not possible, in
+           which case the ranking is serialized from scratch.
+        """
+        return None
+
+
+@memoized
+def _template_digest(template_name):
+    """Returns a digest of the source of the template, as loaded by the
+       template engine.
+    """
+    source = get_template(template_name).template.source
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
 
 class DefaultRankingController(RankingController):
     description = _("Default ranking")
@@ -239,21 +354,153 @@ class DefaultRankingController(RankingController):
         key = self.get_full_key(request, partial_key)
         if getattr(settings, 'MOCK_RANKINGSD', False):
             rows = self.serialize_ranking(key)['rows']
-        else:
-            try:
-                ranking = Ranking.objects.get(contest=self.contest, key=key)
-            except Ranking.DoesNotExist:
-                return None
-            serialized = ranking.serialized or {}
-            rows = serialized.get('rows')
-            if not rows:  # Ranking isn't ready yet
-                return None
-
-        for i, row in enumerate(rows):
-            if row['user'] == user:
-                return i + 1
-        # User not found
-        return None
+            for i, row in enumerate(rows):
+                if row['user'] == user:
+                    return i + 1
+            # User not found
+            return None
+
+        try:
+            # Only the index is needed, not the whole serialized ranking
+            ranking = Ranking.objects.only('user_positions') \
+                    .get(contest=self.contest, key=key)
+        except Ranking.DoesNotExist:
+            return None
+        # None also if the ranking isn't ready yet
+        return ranking.find_user_position(user.id)
+
+    def get_user_positions(self, data):
+        if not isinstance(data, dict) or 'rows' not in data:
+            return None
+        return [(row['user'].id, i)
+                for i, row in enumerate(data['rows'], 1)]
+
+    def _pack_result(self, result):
+        if result is None:
+            return None
+        score = result.score.serialize() if result.score is not None \
+                else None
+        return (result.status, score, getattr(result, 'url', None))
+
+    def _unpack_result(self, user, pi, packed):
+        if packed is None:
+            return None
+        status, score, url = packed
+        result = UserResultForProblem(user=user, problem_instance=pi,
+                status=status, score=ScoreValue.deserialize(score))
+        if url is not None:
+            result.url = url
+        return result
+
+    def pack_serialized(self, data):
+        """Stores the rows column by column, using only ids and serialized
+           scores instead of model instances.
+        """
+        if not isinstance(data, dict) or 'rows' not in data:
+            return data
+        rows = data['rows']
+        extra_keys = set()
+        for row in rows:
+            extra_keys.update(row.keys())
+        extra_keys -= {'user', 'results', 'sum', 'place'}
+        return {
+            'format': PACKED_RANKING_FORMAT,
+            'problem_instances': [(pi.id, visible) for pi, visible
+                                  in data['problem_instances']],
+            'participants_on_page': data['participants_on_page'],
+            'users': [(row['user'].id, row['user'].username,
+                       row['user'].first_name, row['user'].last_name)
+                      for row in rows],
+            'places': [row['place'] for row in rows],
+            'sums': [row['sum'].serialize() for row in rows],
+            'results': [[self._pack_result(r) for r in row['results']]
+                        for row in rows],
+            'extra': dict((k, [row.get(k) for row in rows])
+                          for k in extra_keys),
+        }
+
+    def unpack_serialized(self, packed):
+        if not isinstance(packed, dict):
+            return packed
+        if 'rows' in packed:
+            # Not packed at all
+            return packed
+        if packed.get('format') != PACKED_RANKING_FORMAT:
+            return None
+
+        pis_with_visibility = self._unpack_problem_instances(packed)
+        if pis_with_visibility is None:
+            return None
+        pis = [pi for pi, _visible in pis_with_visibility]
+        return {'rows': list(self._iter_unpacked_rows(packed, pis)),
+                'problem_instances': pis_with_visibility,
+                'participants_on_page': packed['participants_on_page']}
+
+    def _unpack_problem_instances(self, packed):
+        pis_ids = [pi_id for pi_id, _visible in packed['problem_instances']]
+        pis = ProblemInstance.objects.select_related('problem', 'round') \
+                .in_bulk(pis_ids)
+        if len(pis) != len(pis_ids):
+            return None
+        return [(pis[pi_id], visible)
+                for pi_id, visible in packed['problem_instances']]
+
+    def _iter_unpacked_rows(self, packed, pis):
+        extra = packed['extra'].items()
+        for i, (user_id, username, first_name, last_name) in \
+                enumerate(packed['users']):
+            user = User(id=user_id, username=username,
+                        first_name=first_name, last_name=last_name)
+            row = {
+                'user': user,
+                'results': [self._unpack_result(user, pi, r)
+                            for pi, r in zip(pis, packed['results'][i])],
+                'sum': ScoreValue.deserialize(packed['sums'][i]),
+                'place': packed['places'][i],
+            }
+            for k, values in extra:
+                row[k] = values[i]
+            yield row
+
+    def _get_row_fingerprint(self, key, row):
+        user = row['user']
+        results = [(r.problem_instance_id, r.status, unicode(r.score),
+                    getattr(r, 'url', None)) if r else None
+                   for r in row['results']]
+        other = sorted((k, unicode(v)) for k, v in row.items()
+                       if k not in ('user', 'results'))
+        return (user.id, user.username, user.first_name, user.last_name,
+                results, other)
+
+    # Should be increased whenever the code rendering the pages changes in
+    # a way not reflected by their templates, so that the pages rendered
+    # by the previous version are rendered again.
+    PAGES_VERSION = 1
+
+    def _get_page_template_names(self, key):
+        """Returns the names of the templates used to render pages of
+           the ranking.
+        """
+        return ['rankings/default_ranking.html']
+
+    def _get_pages_version(self, key):
+        """Returns a string identifying the code and the templates used
+           to render pages of the ranking.
+        """
+        return '%s:%s' % (self.PAGES_VERSION,
+                ','.join(_template_digest(name)
+                         for name in self._get_page_template_names(key)))
+
+    def _get_page_fingerprint(self, key, data, page):
+        on_page = data['participants_on_page']
+        rows = data['rows'][(page - 1) * on_page:page * on_page]
+        content = (self._get_pages_version(key),
+                   key, page, on_page, self._num_pages(data),
+                   [(pi.id, pi.get_short_name_display(), pi.round.is_trial,
+                     visible)
+                    for pi, visible in data['problem_instances']],
+                   [self._get_row_fingerprint(key, row) for row in rows])
+        return hashlib.sha1(repr(content)).hexdigest()
 
     def _render_ranking_page(self, key, data, page):
         request = self._fake_request(page)
@@ -276,22 +523,73 @@ class DefaultRankingController(RankingController):
         line.append(row['sum'])
         return line
 
+    def _get_snapshot_for_export(self, key):
+        """Returns the ranking data stored by rankingsd, with rows
+           unpacked lazily, or ``None`` if there is no usable snapshot.
+        """
+        try:
+            ranking = Ranking.objects.get(contest=self.contest, key=key)
+        except Ranking.DoesNotExist:
+            return None
+        packed = ranking.serialized
+        if not isinstance(packed, dict) or \
+                packed.get('format') != PACKED_RANKING_FORMAT:
+            return None
+        pis_with_visibility = self._unpack_problem_instances(packed)
+        if pis_with_visibility is None:
+            return None
+        pis = [pi for pi, _visible in pis_with_visibility]
+        return {'rows': self._iter_unpacked_rows(packed, pis),
+                'problem_instances': pis_with_visibility}
+
+    def serialize_ranking_for_export(self, key):
+        """Like :meth:`serialize_ranking`, but the rows are as lightweight
+           as possible, as they are only used for exporting the ranking
+           (e.g. to CSV). The results are read in chunks and without any
+           related objects.
+        """
+        rounds, pis = self._get_rounds_and_pis(key)
+        users = self.filter_users_for_ranking(key, User.objects.all())
+        results = self._get_results(pis, users) \
+                .select_related(None).prefetch_related(None) \
+                .only('user', 'problem_instance', 'score', 'status') \
+                .order_by('user') \
+                .iterator()
+        users = users.only('id', 'username', 'first_name', 'last_name')
+
+        data = self._get_users_results(pis, results, rounds, users,
+                                       with_urls=False)
+        self._assign_places(data, itemgetter('sum'))
+        return {'rows': data,
+                'problem_instances': self._get_pis_with_visibility(key, pis)}
+
+    def _iter_csv_lines(self, key, data):
+        writer = unicodecsv.writer(_Echo())
+        yield writer.writerow(map(force_unicode,
+                              self._get_csv_header(key, data)))
+        for row in data['rows']:
+            yield writer.writerow(map(force_unicode,
+                                  self._get_csv_row(key, row)))
+
     def render_ranking_to_csv(self, request, partial_key):
-        key = self.get_full_key(request, partial_key)
-        data = self.serialize_ranking(key)
+        """Streams the ranking as a CSV file.
 
-        response = HttpResponse(content_type='text/csv')
+           If the request has a ``snapshot`` GET parameter, the ranking last
+           generated by rankingsd is exported without querying the results
+           at all.
+        """
+        key = self.get_full_key(request, partial_key)
+        data = None
+        if request.GET.get('snapshot'):
+            data = self._get_snapshot_for_export(key)
+        if data is None:
+            data = self.serialize_ranking_for_export(key)
+
+        response = StreamingHttpResponse(self._iter_csv_lines(key, data),
+                                         content_type='text/csv')
         response['Content-Disposition'] = \
                 make_content_disposition_header('attachment',
                     u'%s-%s-%s.csv' % (_("ranking"), self.contest.id, key))
-        writer = unicodecsv.writer(response)
-
-        writer.writerow(map(force_unicode,
-                        self._get_csv_header(key, data)))
-        for row in data['rows']:
-            writer.writerow(map(force_unicode,
-                            self._get_csv_row(key, row)))
-
         return response
 
     def filter_users_for_ranking(self, key, queryset):
@@ -303,14 +601,18 @@ class DefaultRankingController(RankingController):
     def _allow_zero_score(self):
         return True
 
-    def _get_users_results(self, pis, results, rounds, users):
+    # Order of the users with the same score in the ranking.
+    _USERS_ORDER = ('last_name', 'first_name', 'username')
+
+    def _get_users_results(self, pis, results, rounds, users,
+                           with_urls=True):
         by_user = defaultdict(dict)
         for r in results:
             by_user[r.user_id][r.problem_instance_id] = r
         users = users.filter(id__in=by_user.keys())
         data = []
         all_rounds_trial = all(r.is_trial for r in rounds)
-        for user in users.order_by('last_name', 'first_name', 'username'):
+        for user in users.order_by(*self._USERS_ORDER):
             by_user_row = by_user[user.id]
             user_results = []
             user_data = {
@@ -321,7 +623,8 @@ class DefaultRankingController(RankingController):
 
             for pi in pis:
                 result = by_user_row.get(pi.id)
-                if result and hasattr(result, 'submission_report') and \
+                if with_urls and result and \
+                        hasattr(result, 'submission_report') and \
                         hasattr(result.submission_report, 'submission_id'):
                     submission_id = result.submission_report.submission_id
                     kwargs = {'contest_id': self.contest.id,
@@ -352,6 +655,10 @@ class DefaultRankingController(RankingController):
            returned.
         """
         data.sort(key=extractor, reverse=True)
+        self._renumber_places(data, extractor)
+
+    def _renumber_places(self, data, extractor):
+        """Assigns places to already sorted ranking ``data``."""
         prev_sum = None
         place = None
         for i, row in enumerate(data, 1):
@@ -373,22 +680,100 @@ class DefaultRankingController(RankingController):
         return [(pi, self._is_problem_statement_visible(key, pi, now))
                 for pi in pis]
 
-    def serialize_ranking(self, key):
+    def _get_rounds_and_pis(self, key):
         partial_key = self.get_partial_key(key)
         rounds = list(self._rounds_for_key(key))
         pis = list(self._filter_pis_for_ranking(partial_key,
             ProblemInstance.objects.filter(round__in=rounds)).
             select_related('problem').prefetch_related('round'))
-        users = self.filter_users_for_ranking(key, User.objects.all())
-        results = UserResultForProblem.objects \
+        return rounds, pis
+
+    def _get_results(self, pis, users):
+        return UserResultForProblem.objects \
                 .filter(problem_instance__in=pis, user__in=users) \
                 .prefetch_related('problem_instance__round') \
                 .select_related('submission_report', 'problem_instance',
                         'problem_instance__contest')
 
+    def serialize_ranking(self, key):
+        rounds, pis = self._get_rounds_and_pis(key)
+        users = self.filter_users_for_ranking(key, User.objects.all())
+        results = self._get_results(pis, users)
+
         data = self._get_users_results(pis, results, rounds, users)
         self._assign_places(data, itemgetter('sum'))
         return {'rows': data,
                 'problem_instances': self._get_pis_with_visibility(key, pis),
                 'participants_on_page': getattr(settings,
                     'PARTICIPANTS_ON_PAGE', 100)}
+
+    def _user_precedes(self, user, other):
+        """Tells if ``user`` comes before ``other`` in the order of
+           :meth:`_get_users_results`.
+
+           The names are compared by the database, as its collation may
+           differ from the comparison of Python strings.
+        """
+        precedes = Q()
+        equal = {}
+        for field in self._USERS_ORDER:
+            precedes |= Q(**dict(equal, **{field + '__lt':
+                                           getattr(other, field)}))
+            equal[field] = getattr(other, field)
+        return User.objects.filter(precedes, id=user.id).exists()
+
+    def _row_precedes(self, row, other, extractor):
+        """Tells if ``row`` should be placed before ``other`` in a ranking
+           sorted by :meth:`_assign_places`, i.e. by descending ``extractor``
+           value and then in the order of :meth:`_get_users_results`.
+        """
+        value, other_value = extractor(row), extractor(other)
+        if value != other_value:
+            return value > other_value
+        return self._user_precedes(row['user'], other['user'])
+
+    def _insert_row(self, rows, row, extractor):
+        """Inserts ``row`` into sorted ``rows`` using binary search."""
+        lo, hi = 0, len(rows)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._row_precedes(rows[mid], row, extractor):
+                lo = mid + 1
+            else:
+                hi = mid
+        rows.insert(lo, row)
+
+    def update_serialized_ranking(self, key, data, changes):
+        if not isinstance(data, dict) or 'rows' not in data:
+            return None
+        rounds, pis = self._get_rounds_and_pis(key)
+        pis_with_visibility = self._get_pis_with_visibility(key, pis)
+        old_visibility = [(pi.id, visible)
+                          for pi, visible in data['problem_instances']]
+        new_visibility = [(pi.id, visible)
+                          for pi, visible in pis_with_visibility]
+        if old_visibility != new_visibility:
+            # The set of rounds or problems (or their visibility) has
+            # changed, so all the rows may differ.
+            return None
+
+        pis_ids = set(pi.id for pi in pis)
+        users_ids = set(user_id for user_id, pi_id in changes
+                        if pi_id in pis_ids)
+        data['problem_instances'] = pis_with_visibility
+        if not users_ids:
+            return data
+
+        users = self.filter_users_for_ranking(key,
+                User.objects.filter(id__in=users_ids))
+        results = self._get_results(pis, users)
+        new_rows = self._get_users_results(pis, results, rounds, users)
+
+        extractor = itemgetter('sum')
+        rows = [row for row in data['rows']
+                if row['user'].id not in users_ids]
+        for row in new_rows:
+            self._insert_row(rows, row, extractor)
+        self._renumber_places(rows, extractor)
+        data['rows'] = rows
+        return data
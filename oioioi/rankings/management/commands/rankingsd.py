@@ -1,11 +1,42 @@
+from datetime import timedelta
+from optparse import make_option
+import logging
+import multiprocessing
+import os
+import socket
 import time
 
-from django.core.management.base import BaseCommand
-from oioioi.rankings.models import choose_for_recalculation, recalculate
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from oioioi.rankings.models import choose_for_recalculation, recalculate, \
+        release_stale_recalcs
 from django.utils.translation import ugettext as _
 from django.conf import settings
 
 
+logger = logging.getLogger(__name__)
+
+
+def _worker_name(pid):
+    return '%s:%d' % (socket.gethostname(), pid)
+
+
+def _release_stale_recalcs():
+    release_stale_recalcs(older_than=timedelta(
+        seconds=settings.RANKING_RECALC_TIMEOUT))
+
+
+def _run_worker(shard, num_shards):
+    worker = _worker_name(os.getpid())
+    while True:
+        r = choose_for_recalculation(shard, num_shards, worker)
+        if r:
+            recalculate(r)
+        else:
+            _release_stale_recalcs()
+            time.sleep(settings.RANKINGSD_POLLING_INTERVAL)
+
+
 class Command(BaseCommand):
     help = _(
         "Daemon that rebuilds rankings. Ranking generation is quite a slow "
@@ -16,10 +47,60 @@ class Command(BaseCommand):
         "with cooldown."
     )
 
+    option_list = BaseCommand.option_list + (
+        make_option('--workers',
+                    type=int,
+                    default=1,
+                    help="Number of worker processes recalculating "
+                         "rankings in parallel"),
+        make_option('--shard',
+                    type=int,
+                    default=0,
+                    help="Recalculate only rankings of contests from this "
+                         "shard (counted from 0)"),
+        make_option('--num-shards',
+                    type=int,
+                    default=1,
+                    help="Number of shards the contests are split into, "
+                         "e.g. the number of hosts running rankingsd"),
+    )
+
+    def _start_worker(self, shard, num_shards):
+        process = multiprocessing.Process(target=_run_worker,
+                                          args=(shard, num_shards))
+        process.daemon = True
+        process.start()
+        return process
+
     def handle(self, *args, **options):
-        while True:
-            r = choose_for_recalculation()
-            if r:
-                recalculate(r)
-            else:
+        workers = options['workers']
+        shard = options['shard']
+        num_shards = options['num_shards']
+        if workers < 1:
+            raise CommandError("--workers must be positive")
+        if num_shards < 1 or not 0 <= shard < num_shards:
+            raise CommandError("--shard must be between 0 and "
+                               "--num-shards - 1")
+
+        if workers == 1:
+            _run_worker(shard, num_shards)
+            return
+
+        processes = []
+        try:
+            while True:
+                # Database connections must not be shared with the workers.
+                connections.close_all()
+                while len(processes) < workers:
+                    processes.append(self._start_worker(shard, num_shards))
                 time.sleep(settings.RANKINGSD_POLLING_INTERVAL)
+                for process in processes[:]:
+                    if process.is_alive():
+                        continue
+                    logger.error("rankingsd worker %d died with exit "
+                                 "code %s", process.pid, process.exitcode)
+                    release_stale_recalcs(worker=_worker_name(process.pid))
+                    processes.remove(process)
+        finally:
+            for process in processes:
+                process.terminate()
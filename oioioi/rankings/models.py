@@ -1,15 +1,57 @@
-import pickle
+import cPickle as pickle
+import struct
+import zlib
 from datetime import timedelta
 
 from django.db import models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.conf import settings
+from django.contrib.auth.models import User
 
-from oioioi.contests.models import Contest
+from oioioi.contests.models import Contest, ProblemInstance, \
+        UserResultForContest
+
+
+# (user_id, position) entry of Ranking.user_positions
+_USER_POSITION = struct.Struct('<II')
+
+
+def pack_user_positions(positions):
+    """Packs a list of ``(user_id, position)`` pairs into a string sorted
+       by user ids, suitable for :meth:`Ranking.find_user_position`.
+    """
+    return ''.join(_USER_POSITION.pack(user_id, position)
+                   for user_id, position in sorted(positions))
+
+
+def find_packed_user_position(packed, user_id):
+    """Finds the position of the user in the result of
+       :func:`pack_user_positions` using binary search, without unpacking
+       the whole index.
+    """
+    lo, hi = 0, len(packed) // _USER_POSITION.size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        mid_user_id, position = _USER_POSITION.unpack_from(packed,
+                mid * _USER_POSITION.size)
+        if mid_user_id == user_id:
+            return position
+        elif mid_user_id < user_id:
+            lo = mid + 1
+        else:
+            hi = mid
+    return None
 
 
 class RankingRecalc(models.Model):
-    pass
+    # whether the ranking has to be rebuilt from scratch, or it is enough
+    # to patch it with the recorded RankingResultChanges
+    full = models.BooleanField(default=True)
+    # advisory, used to recover recalculations of crashed workers
+    start_date = models.DateTimeField(auto_now_add=True)
+    worker = models.CharField(max_length=255, blank=True)
 
 
 class Ranking(models.Model):
@@ -64,6 +106,14 @@ class Ranking(models.Model):
        RANKING_MIN_COOLDOWN - minimum cooldown duration (safety limit)
        RANKING_MAX_COOLDOWN - maximum cooldown duration (safety limit)
 
+       Apart from full invalidations, it is possible to invalidate only
+       results of some users for some problem instances (see
+       invalidate_user_results). Such changes are recorded as
+       RankingResultChange objects and, if RANKING_INCREMENTAL_RECALCULATION
+       is set, the next recalculation only patches the previously serialized
+       ranking instead of rebuilding it from scratch. Any full invalidation
+       forces a full rebuild.
+
        NOTE: We use the local time (and not the database time), for all time
        calculations, including the cooldowns, so be careful about drastic
        changes of system time on the generating machine.
@@ -78,21 +128,49 @@ class Ranking(models.Model):
     # used to determine cooldown
     last_recalculation_duration = models.DurationField(default=timedelta(0))
 
+    # advisory, statistics of the last recalculation
+    last_pages_rendered = models.IntegerField(default=0)
+    last_pages_skipped = models.IntegerField(default=0)
+    last_render_duration = models.DurationField(default=timedelta(0))
+
     # internal, use serialized instead
     serialized_data = models.BinaryField(null=True)
+    # internal, use find_user_position instead
+    user_positions = models.BinaryField(null=True)
 
     # internal to ranking recalculation mechanism
     # use invalidate_* and is_up_to_date instead
     needs_recalculation = models.BooleanField(default=True)
+    needs_full_recalculation = models.BooleanField(default=True)
     cooldown_date = models.DateTimeField(auto_now_add=True)
     recalc_in_progress = models.ForeignKey(RankingRecalc, null=True)
 
     @property
     def serialized(self):
-        """Serialized data of this ranking"""
+        """Serialized data of this ranking, as returned by
+           RankingController.pack_serialized.
+        """
         if not self.serialized_data:
             return None
-        return pickle.loads(self.serialized_data)
+        try:
+            data = zlib.decompress(self.serialized_data)
+        except zlib.error:
+            # stored uncompressed by an older version
+            data = str(self.serialized_data)
+        return pickle.loads(data)
+
+    @serialized.setter
+    def serialized(self, value):
+        self.serialized_data = zlib.compress(
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def find_user_position(self, user_id):
+        """Returns the position of the user in the ranking, or None if the
+           user is not in the ranking or the ranking has no index of users.
+        """
+        if not self.user_positions:
+            return None
+        return find_packed_user_position(str(self.user_positions), user_id)
 
     def controller(self):
         """RankingController of the contest"""
@@ -102,6 +180,7 @@ class Ranking(models.Model):
     def invalidate_queryset(cls, qs):
         """Marks queryset of rankings as invalid"""
         qs.all().update(needs_recalculation=True,
+                        needs_full_recalculation=True,
                         invalidation_date=timezone.now())
 
     @classmethod
@@ -109,6 +188,24 @@ class Ranking(models.Model):
         """Marks all the keys in the constest as invalid"""
         return cls.invalidate_queryset(cls.objects.filter(contest=contest))
 
+    @classmethod
+    def invalidate_user_results(cls, contest, users_and_problems):
+        """Marks all the keys in the contest as invalid, but records that
+           only the results of given ``(user_id, problem_instance_id)`` pairs
+           have changed, so that the rankings may be updated incrementally.
+        """
+        rankings = list(cls.objects.filter(contest=contest)
+                        .values_list('id', flat=True))
+        if not rankings:
+            return
+        RankingResultChange.objects.bulk_create([
+            RankingResultChange(ranking_id=ranking_id, user_id=user_id,
+                                problem_instance_id=pi_id)
+            for ranking_id in rankings
+            for user_id, pi_id in set(users_and_problems)])
+        cls.objects.filter(id__in=rankings).update(
+                needs_recalculation=True, invalidation_date=timezone.now())
+
     def is_up_to_date(self):
         """Is all the data for this contest up to date (i.e. not invalidated
            since the last recalculation succeeded)?
@@ -123,58 +220,180 @@ class Ranking(models.Model):
         unique_together = ('contest', 'key')
 
 
+# Fields of User displayed in rankings or used to order them.
+RANKING_USER_FIELDS = frozenset(['username', 'first_name', 'last_name'])
+
+
+@receiver(post_save, sender=User)
+def _user_changed(sender, instance, update_fields=None, **kwargs):
+    """Rankings store names of the users, so they are rebuilt when a user
+       is saved (except for saves not touching the names, like updating
+       ``last_login``).
+    """
+    if update_fields is not None and \
+            not RANKING_USER_FIELDS.intersection(update_fields):
+        return
+    contests = UserResultForContest.objects.filter(user=instance) \
+            .values('contest')
+    Ranking.invalidate_queryset(Ranking.objects.filter(contest__in=contests))
+
+
+class RankingResultChange(models.Model):
+    """Result of a single user for a single problem instance, which has
+       changed since the last recalculation of the ranking.
+    """
+    ranking = models.ForeignKey(Ranking, related_name='result_changes')
+    user = models.ForeignKey(User)
+    problem_instance = models.ForeignKey(ProblemInstance)
+
+
 class RankingPage(models.Model):
     """Single page of a ranking"""
     ranking = models.ForeignKey(Ranking, related_name='pages')
     nr = models.IntegerField()
     data = models.TextField()
+    # identifies the contents of the page, see
+    # RankingController._get_page_fingerprint
+    fingerprint = models.CharField(max_length=40, null=True)
 
 
 def clamp(minimum, x, maximum):
     return max(minimum, min(x, maximum))
 
 
-@transaction.atomic
-def choose_for_recalculation():
+def contest_shard(contest_id, num_shards):
+    """Returns the shard (a number in ``range(num_shards)``) to which
+       rankings of the given contest belong.
+    """
+    return (zlib.crc32(contest_id.encode('utf-8')) & 0xffffffff) \
+        % num_shards
+
+
+def choose_for_recalculation(shard=0, num_shards=1, worker=''):
+    """Claims a ranking which needs recalculation and returns the
+       corresponding RankingRecalc, or None if there is nothing to do.
+
+       Many workers may call this function concurrently. Rankings which are
+       being recalculated by someone else are skipped instead of waiting for
+       their locks. If ``num_shards`` is greater than 1, only rankings of the
+       contests belonging to ``shard`` (see contest_shard) are considered.
+    """
     now = timezone.now()
-    r = Ranking.objects.filter(
+    candidates = Ranking.objects.filter(
         needs_recalculation=True,
-        cooldown_date__lt=now
-    ).order_by('last_recalculation_date').select_for_update().first()
-    if r is None:
+        cooldown_date__lt=now,
+        recalc_in_progress__isnull=True
+    ).order_by('last_recalculation_date').values_list('id', 'contest_id')
+    for ranking_id, contest_id in candidates.iterator():
+        if num_shards > 1 and \
+                contest_shard(contest_id, num_shards) != shard:
+            continue
+        recalc = _claim_for_recalculation(ranking_id, now, worker)
+        if recalc is not None:
+            return recalc
+    return None
+
+
+@transaction.atomic
+def _claim_for_recalculation(ranking_id, now, worker):
+    recalc = RankingRecalc(worker=worker)
+    recalc.save()
+    # The conditional update makes sure that only one worker claims
+    # the ranking.
+    claimed = Ranking.objects.filter(
+        id=ranking_id,
+        needs_recalculation=True,
+        recalc_in_progress__isnull=True
+    ).update(recalc_in_progress=recalc, needs_recalculation=False)
+    if not claimed:
+        recalc.delete()
         return None
+    r = Ranking.objects.get(id=ranking_id)
     cooldown_duration = clamp(
         timedelta(seconds=settings.RANKING_MIN_COOLDOWN),
         r.last_recalculation_duration * settings.RANKING_COOLDOWN_FACTOR,
         timedelta(seconds=settings.RANKING_MAX_COOLDOWN)
     )
     r.cooldown_date = now + cooldown_duration
-    r.needs_recalculation = False
-    recalc = RankingRecalc()
+    recalc.full = r.needs_full_recalculation
     recalc.save()
-    r.recalc_in_progress = recalc
+    r.needs_full_recalculation = False
     r.save()
     return recalc
 
 
+@transaction.atomic
+def release_stale_recalcs(worker=None, older_than=None):
+    """Gives back the rankings claimed by crashed workers, so that they are
+       recalculated (from scratch) again.
+
+       Releases the recalculations of the given ``worker`` and/or the ones
+       started more than ``older_than`` (a timedelta) ago.
+    """
+    recalcs = RankingRecalc.objects.all()
+    if worker is not None:
+        recalcs = recalcs.filter(worker=worker)
+    if older_than is not None:
+        recalcs = recalcs.filter(start_date__lt=timezone.now() - older_than)
+    recalcs_ids = list(recalcs.values_list('id', flat=True))
+    if not recalcs_ids:
+        return 0
+    released = Ranking.objects.filter(recalc_in_progress__in=recalcs_ids) \
+        .update(recalc_in_progress=None, needs_recalculation=True,
+                needs_full_recalculation=True,
+                invalidation_date=timezone.now())
+    RankingRecalc.objects.filter(id__in=recalcs_ids).delete()
+    return released
+
+
 @transaction.atomic
 def save_pages(ranking, pages_list):
-    ranking.pages.all().delete()
-    for nr, page_data in enumerate(pages_list, 1):
-        page = RankingPage(ranking=ranking, nr=nr, data=page_data)
-        page.save()
+    """Stores the pages returned by RankingController.build_ranking.
+
+       Only the pages which have been rendered are written, all the other
+       ones are kept in place. Returns a tuple ``(rendered, skipped,
+       render_duration)``.
+    """
+    ranking.pages.filter(nr__gt=len(pages_list)).delete()
+    existing = set(ranking.pages.values_list('nr', flat=True))
+    rendered = skipped = 0
+    render_duration = timedelta(0)
+    for nr, page in enumerate(pages_list, 1):
+        if isinstance(page, basestring):
+            fingerprint, page_data, duration = None, page, 0
+        else:
+            fingerprint, page_data, duration = page
+        if page_data is None:
+            skipped += 1
+            continue
+        rendered += 1
+        render_duration += timedelta(seconds=duration)
+        if nr in existing:
+            ranking.pages.filter(nr=nr).update(data=page_data,
+                                               fingerprint=fingerprint)
+        else:
+            RankingPage(ranking=ranking, nr=nr, data=page_data,
+                        fingerprint=fingerprint).save()
+    return rendered, skipped, render_duration
 
 
 @transaction.atomic
 def save_recalc_results(recalc, date_before, date_after, serialized,
-                        pages_list):
+                        pages_list, processed_changes=(),
+                        user_positions=None):
     try:
         r = Ranking.objects.filter(recalc_in_progress=recalc). \
             select_for_update().get()
     except Ranking.DoesNotExist:
         return
-    r.serialized_data = pickle.dumps(serialized)
-    save_pages(r, pages_list)
+    r.serialized = serialized
+    if user_positions is None:
+        r.user_positions = None
+    else:
+        r.user_positions = pack_user_positions(user_positions)
+    r.last_pages_rendered, r.last_pages_skipped, r.last_render_duration = \
+        save_pages(r, pages_list)
+    r.result_changes.filter(id__in=processed_changes).delete()
     r.last_recalculation_date = date_before
     r.last_recalculation_duration = date_after - date_before
     old_recalc = r.recalc_in_progress
@@ -191,7 +410,24 @@ def recalculate(recalc):
     except Ranking.DoesNotExist:
         return
     ranking_controller = r.controller()
-    serialized, pages_list = ranking_controller.build_ranking(r.key)
+    # Changes recorded after this point will trigger another recalculation.
+    changes = list(r.result_changes.values_list('id', 'user_id',
+                                                'problem_instance_id'))
+    page_fingerprints = dict(r.pages.values_list('nr', 'fingerprint'))
+    result = None
+    if not recalc.full and getattr(settings,
+            'RANKING_INCREMENTAL_RECALCULATION', False):
+        previous = ranking_controller.unpack_serialized(r.serialized)
+        if previous is not None:
+            result = ranking_controller.update_ranking(r.key, previous,
+                    [(user_id, pi_id) for _id, user_id, pi_id in changes],
+                    page_fingerprints)
+    if result is None:
+        result = ranking_controller.build_ranking(r.key, page_fingerprints)
+    serialized, pages_list = result
+    user_positions = ranking_controller.get_user_positions(serialized)
+    serialized = ranking_controller.pack_serialized(serialized)
     date_after = timezone.now()
     save_recalc_results(recalc, date_before, date_after, serialized,
-                        pages_list)
+                        pages_list, [change[0] for change in changes],
+                        user_positions)
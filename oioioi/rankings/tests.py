@@ -7,17 +7,19 @@ from django.utils.timezone import utc
 from django.contrib.auth.models import User
 from django.http import QueryDict
 from django.conf import settings
+from mock import patch
 
 from oioioi.base.templatetags.simple_filters import result_color_class
 from oioioi.base.tests import TestCase, fake_time, fake_timezone_now, \
         check_not_accessible
 from oioioi.contests.models import Contest, UserResultForProblem, \
         ProblemInstance
-from oioioi.contests.scores import IntegerScore
+from oioioi.contests.scores import IntegerScore, ScoreValue
 from oioioi.pa.score import PAScore
 from oioioi.rankings.controllers import DefaultRankingController
 from oioioi.rankings.models import Ranking, RankingPage, recalculate, \
-        choose_for_recalculation, RankingRecalc
+        choose_for_recalculation, RankingRecalc, RankingResultChange, \
+        contest_shard, release_stale_recalcs
 from oioioi.programs.controllers import ProgrammingContestController
 
 
@@ -221,22 +223,23 @@ class TestRankingViews(TestCase):
         self.client.login(username='test_admin')
         with fake_time(datetime(2012, 8, 5, tzinfo=utc)):
             response = self.client.get(url)
-            self.assertContains(response, 'User,')
+            content = ''.join(response.streaming_content)
+            self.assertIn('User,', content)
             # Check that Admin is filtered out.
-            self.assertNotContains(response, 'Admin')
+            self.assertNotIn('Admin', content)
 
             expected_order = ['Test,User', 'Test,User 2']
             prev_pos = 0
             for user in expected_order:
                 pattern = '%s,' % (user,)
-                self.assertIn(user, response.content)
-                pos = response.content.find(pattern)
+                self.assertIn(user, content)
+                pos = content.find(pattern)
                 self.assertGreater(pos, prev_pos, msg=('User %s has incorrect '
                        'position' % (user,)))
                 prev_pos = pos
 
             for task in ['zad1', 'zad2', 'zad3', 'zad3']:
-                self.assertContains(response, task)
+                self.assertIn(task, content)
 
             response = self.client.get(reverse('ranking',
                 kwargs={'contest_id': contest.id, 'key': '1'}))
@@ -248,7 +251,7 @@ class TestRankingViews(TestCase):
 class MockRankingController(DefaultRankingController):
     recalculation_result = ('serialized', ['1st', '2nd', '3rd'])
 
-    def build_ranking(self, key):
+    def build_ranking(self, key, page_fingerprints=None):
         assert key == "key"
         return self.recalculation_result
 
@@ -310,6 +313,36 @@ class TestRecalc(TestCase):
         recalc = choose_for_recalculation()
         self.assertIsNotNone(recalc)
 
+    def test_claimed_ranking_skipped(self):
+        contest = Contest.objects.get()
+        Ranking.objects.create(contest=contest, key='key')
+        recalc = choose_for_recalculation(worker='host:1')
+        self.assertIsNotNone(recalc)
+        self.assertEqual(recalc.worker, 'host:1')
+        # Invalidated during the recalculation, but still claimed.
+        Ranking.invalidate_contest(contest)
+        Ranking.objects.update(cooldown_date=datetime(2000, 1, 1, tzinfo=utc))
+        self.assertIsNone(choose_for_recalculation(worker='host:2'))
+
+    def test_sharding(self):
+        contest = Contest.objects.get()
+        Ranking.objects.create(contest=contest, key='key')
+        shard = contest_shard(contest.id, 2)
+        self.assertIsNone(choose_for_recalculation(1 - shard, 2))
+        self.assertIsNotNone(choose_for_recalculation(shard, 2))
+
+    def test_release_stale_recalcs(self):
+        contest = Contest.objects.get()
+        ranking = Ranking.objects.create(contest=contest, key='key')
+        recalc = choose_for_recalculation(worker='host:1')
+        self.assertEqual(release_stale_recalcs(worker='host:2'), 0)
+        self.assertEqual(release_stale_recalcs(worker='host:1'), 1)
+        self.assertFalse(RankingRecalc.objects.filter(id=recalc.id).exists())
+        ranking.refresh_from_db()
+        self.assertIsNone(ranking.recalc_in_progress)
+        self.assertTrue(ranking.needs_recalculation)
+        self.assertTrue(ranking.needs_full_recalculation)
+
     def test_null_checking(self):
         contest = Contest.objects.get()
         ranking, _ = Ranking.objects.get_or_create(contest=contest, key='key')
@@ -330,6 +363,195 @@ class TestRecalc(TestCase):
         self.assertFalse(ranking.is_up_to_date())
 
 
+class TestIncrementalRecalc(TestCase):
+    fixtures = ['test_users', 'test_contest', 'test_full_package',
+            'test_problem_instance', 'test_submission', 'test_extra_rounds',
+            'test_ranking_data', 'test_permissions']
+
+    def _recalculate(self, ranking):
+        # Skip the cooldown after the previous recalculation
+        Ranking.objects.update(cooldown_date=datetime(2000, 1, 1, tzinfo=utc))
+        recalc = choose_for_recalculation()
+        self.assertIsNotNone(recalc)
+        recalculate(recalc)
+        ranking.refresh_from_db()
+        self.assertTrue(ranking.is_up_to_date())
+        return recalc
+
+    def _summary(self, rows):
+        return [(row['user'].id, row['place'], row['sum']) for row in rows]
+
+    def _rows(self, ranking):
+        controller = ranking.controller()
+        return controller.unpack_serialized(ranking.serialized)['rows']
+
+    @override_settings(RANKING_INCREMENTAL_RECALCULATION=True)
+    def test_incremental_update(self):
+        contest = Contest.objects.get()
+        ranking, _ = Ranking.objects.get_or_create(contest=contest,
+                                                   key='admin#c')
+        recalc = self._recalculate(ranking)
+        self.assertTrue(recalc.full)
+        self.assertEqual(self._rows(ranking)[0]['user'].id, 1002)
+
+        result = UserResultForProblem.objects.get(user__id=1001,
+                                                  problem_instance__id=1)
+        result.score = IntegerScore(100)
+        result.save()
+        Ranking.invalidate_user_results(contest, [(1001, 1)])
+        self.assertEqual(ranking.result_changes.count(), 1)
+        ranking.refresh_from_db()
+        self.assertFalse(ranking.is_up_to_date())
+
+        recalc = self._recalculate(ranking)
+        self.assertFalse(recalc.full)
+        self.assertEqual(ranking.result_changes.count(), 0)
+        expected = ranking.controller().serialize_ranking('admin#c')
+        self.assertEqual(self._summary(self._rows(ranking)),
+                         self._summary(expected['rows']))
+        self.assertEqual(self._rows(ranking)[0]['user'].id, 1001)
+
+        # A full invalidation always rebuilds the ranking from scratch.
+        Ranking.invalidate_contest(contest)
+        recalc = self._recalculate(ranking)
+        self.assertTrue(recalc.full)
+
+    @override_settings(PARTICIPANTS_ON_PAGE=1)
+    def test_unchanged_pages_not_rendered(self):
+        contest = Contest.objects.get()
+        ranking, _ = Ranking.objects.get_or_create(contest=contest,
+                                                   key='admin#c')
+        self._recalculate(ranking)
+        self.assertEqual(ranking.last_pages_rendered, 2)
+        self.assertEqual(ranking.last_pages_skipped, 0)
+        pages = list(ranking.pages.order_by('nr'))
+
+        Ranking.invalidate_contest(contest)
+        self._recalculate(ranking)
+        self.assertEqual(ranking.last_pages_rendered, 0)
+        self.assertEqual(ranking.last_pages_skipped, 2)
+        self.assertEqual(list(ranking.pages.order_by('nr')), pages)
+
+        result = UserResultForProblem.objects.get(user__id=1001,
+                                                  problem_instance__id=1)
+        result.score = IntegerScore(30)
+        result.save()
+        Ranking.invalidate_user_results(contest, [(1001, 1)])
+        self._recalculate(ranking)
+        self.assertEqual(ranking.last_pages_rendered, 1)
+        self.assertEqual(ranking.last_pages_skipped, 1)
+        new_pages = list(ranking.pages.order_by('nr'))
+        self.assertEqual([page.id for page in new_pages],
+                         [page.id for page in pages])
+        self.assertEqual(new_pages[0].data, pages[0].data)
+        self.assertNotEqual(new_pages[1].data, pages[1].data)
+
+    def test_pages_rendered_after_template_change(self):
+        contest = Contest.objects.get()
+        ranking, _ = Ranking.objects.get_or_create(contest=contest,
+                                                   key='admin#c')
+        self._recalculate(ranking)
+        self.assertEqual(ranking.last_pages_rendered, 1)
+
+        Ranking.invalidate_contest(contest)
+        with patch('oioioi.rankings.controllers._template_digest',
+                   return_value='changed'):
+            self._recalculate(ranking)
+        self.assertEqual(ranking.last_pages_rendered, 1)
+        self.assertEqual(ranking.last_pages_skipped, 0)
+
+    def test_packed_ranking(self):
+        contest = Contest.objects.get()
+        ranking, _ = Ranking.objects.get_or_create(contest=contest,
+                                                   key='admin#c')
+        self._recalculate(ranking)
+        packed = ranking.serialized
+        self.assertEqual(packed['users'][0][0], 1002)
+        self.assertEqual([ScoreValue.deserialize(score)
+                          for score in packed['sums']],
+                         [IntegerScore(35), IntegerScore(34)])
+
+        controller = ranking.controller()
+        expected = controller.serialize_ranking('admin#c')
+        unpacked = controller.unpack_serialized(packed)
+        self.assertEqual(self._summary(unpacked['rows']),
+                         self._summary(expected['rows']))
+        self.assertEqual([(pi.id, visible) for pi, visible
+                          in unpacked['problem_instances']],
+                         [(pi.id, visible) for pi, visible
+                          in expected['problem_instances']])
+
+        self.assertEqual(ranking.find_user_position(1002), 1)
+        self.assertEqual(ranking.find_user_position(1001), 2)
+        self.assertIsNone(ranking.find_user_position(1003))
+
+    def test_csv_from_snapshot(self):
+        contest = Contest.objects.get()
+        ranking, _ = Ranking.objects.get_or_create(contest=contest,
+                                                   key='admin#c')
+        self._recalculate(ranking)
+
+        # Not visible in the snapshot
+        UserResultForProblem.objects.filter(user__id=1001) \
+                .update(score=IntegerScore(100))
+
+        self.client.login(username='test_admin')
+        url = reverse('ranking_csv', kwargs={'contest_id': contest.id,
+                                             'key': 'c'})
+        with fake_time(datetime(2012, 8, 5, tzinfo=utc)):
+            response = self.client.get(url + '?snapshot=1')
+            content = ''.join(response.streaming_content)
+            self.assertLess(content.find('Test,User 2'),
+                            content.find('Test,User,'))
+            self.assertNotIn('100', content)
+
+            response = self.client.get(url)
+            content = ''.join(response.streaming_content)
+            self.assertLess(content.find('Test,User,'),
+                            content.find('Test,User 2'))
+            self.assertIn('100', content)
+
+    @override_settings(RANKING_INCREMENTAL_RECALCULATION=True)
+    def test_tied_rows_order(self):
+        contest = Contest.objects.get()
+        ranking, _ = Ranking.objects.get_or_create(contest=contest,
+                                                   key='admin#c')
+        self._recalculate(ranking)
+
+        result = UserResultForProblem.objects.get(user__id=1001,
+                                                  problem_instance__id=1)
+        result.score = IntegerScore(35)
+        result.save()
+        Ranking.invalidate_user_results(contest, [(1001, 1)])
+        recalc = self._recalculate(ranking)
+        self.assertFalse(recalc.full)
+        expected = ranking.controller().serialize_ranking('admin#c')
+        self.assertEqual(self._summary(self._rows(ranking)),
+                         self._summary(expected['rows']))
+
+    def test_full_invalidation_on_user_change(self):
+        contest = Contest.objects.get()
+        ranking, _ = Ranking.objects.get_or_create(contest=contest,
+                                                   key='admin#c')
+        self._recalculate(ranking)
+
+        user = User.objects.get(id=1002)
+        user.save(update_fields=['last_login'])
+        ranking.refresh_from_db()
+        self.assertTrue(ranking.is_up_to_date())
+
+        user.first_name = 'Renamed'
+        user.save()
+        ranking.refresh_from_db()
+        self.assertFalse(ranking.is_up_to_date())
+        self.assertTrue(ranking.needs_full_recalculation)
+
+    def test_no_rankings_no_changes(self):
+        contest = Contest.objects.get()
+        Ranking.invalidate_user_results(contest, [(1001, 1)])
+        self.assertFalse(RankingResultChange.objects.exists())
+
+
 class TestRankingsdFrontend(TestCase):
     fixtures = ['test_users', 'test_contest', 'test_full_package',
             'test_problem_instance', 'test_submission', 'test_extra_rounds',
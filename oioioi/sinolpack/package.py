@@ -1,8 +1,13 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from multiprocessing.pool import ThreadPool
 import glob
 import logging
 import re
 import shutil
 import tempfile
+import time
 import os
 import zipfile
 import chardet
@@ -117,6 +122,8 @@ class SinolPackage(object):
                 {'c': C_EXTRA_ARGS, 'cpp': C_EXTRA_ARGS, 'pas': PAS_EXTRA_ARGS}
         self.use_make = settings.USE_SINOLPACK_MAKEFILES
         self.use_sandboxes = not settings.USE_UNSAFE_EXEC
+        self.timings = OrderedDict((stage, 0.) for stage in
+                ('extract', 'ingen', 'inwer', 'outgen', 'upload', 'db'))
 
     def identify(self):
         return self._find_main_dir() is not None
@@ -151,13 +158,62 @@ class SinolPackage(object):
 
         return None
 
-    def _save_to_field(self, field, file):
+    def _save_to_field(self, field, file, save=True):
         basename = os.path.basename(filetracker_to_django_file(file).name)
         filename = os.path.join(self.rootdir, basename)
         get_client().get_file(file, filename)
-        field.save(os.path.basename(filename), File(open(filename, 'rb')))
+        field.save(os.path.basename(filename), File(open(filename, 'rb')),
+                   save=save)
         get_client().delete_file(file)
 
+    def _upload_to_field(self, field, name, path):
+        with open(path, 'rb') as f:
+            field.save(name, File(f), save=False)
+
+    @contextmanager
+    def _measure(self, stage):
+        """Adds the time spent in the ``with`` block to the timing of
+           the given stage of unpacking.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[stage] += time.time() - start
+
+    def _run_uploads(self, uploads):
+        """Runs the given callables, which save files of tests, using
+           a pool of ``settings.SINOLPACK_UPLOAD_CONCURRENCY`` threads.
+
+           The callables must not use the database, as each thread would
+           use its own connection, outside of the current transaction.
+           Deduplicating storage keeps reference counts in the database, so
+           with ``settings.FILETRACKER_DEDUPLICATION`` the files are saved
+           one by one.
+        """
+        with self._measure('upload'):
+            if settings.SINOLPACK_UPLOAD_CONCURRENCY <= 1 \
+                    or len(uploads) <= 1 \
+                    or settings.FILETRACKER_DEDUPLICATION:
+                for upload in uploads:
+                    upload()
+                return
+            pool = ThreadPool(min(settings.SINOLPACK_UPLOAD_CONCURRENCY,
+                                  len(uploads)))
+            try:
+                pool.map(lambda upload: upload(), uploads)
+            finally:
+                pool.close()
+                pool.join()
+
+    def _save_timings(self):
+        info = _("Unpacking times: %s") % ', '.join(
+                '%s %.2fs' % (stage, duration)
+                for stage, duration in self.timings.iteritems())
+        logger.info("%s: %s", self.filename, info)
+        self.package.info = info
+        ProblemPackage.objects.filter(id=self.package.id).update(info=info)
+
     def _find_and_compile(self, suffix, command=None, cwd=None,
                           log_on_failure=True, out_name=None):
         if not command:
@@ -321,9 +377,11 @@ class SinolPackage(object):
         tmpdir = tempfile.mkdtemp()
         logger.info("%s: tmpdir is %s", self.filename, tmpdir)
         try:
-            self.archive.extract(to_path=tmpdir)
+            with self._measure('extract'):
+                self.archive.extract(to_path=tmpdir)
             self.rootdir = os.path.join(tmpdir, self.short_name)
             self._process_package()
+            self._save_timings()
 
             return self.problem
         finally:
@@ -540,14 +598,17 @@ class SinolPackage(object):
         self.statement_memory_limit = self._detect_statement_memory_limit()
 
         if self.use_make:
-            self._find_and_compile('', command='ingen')
-            self._find_and_compile('', command='outgen')
+            with self._measure('ingen'):
+                self._find_and_compile('', command='ingen')
+            with self._measure('outgen'):
+                self._find_and_compile('', command='outgen')
 
         created_tests, outs_to_make, scored_groups = \
             self._create_instances_for_tests()
 
         self._verify_time_limits(created_tests)
-        self._verify_inputs(created_tests)
+        with self._measure('inwer'):
+            self._verify_inputs(created_tests)
         self._generate_test_outputs(created_tests, outs_to_make)
         self._validate_tests(created_tests)
         self._delete_non_existing_tests(created_tests)
@@ -585,23 +646,55 @@ class SinolPackage(object):
                     % (re.escape(self.short_name))
         names_re = re.compile(re_string)
 
-        collected_ins = self._make_ins(re_string)
+        with self._measure('ingen'):
+            collected_ins = self._make_ins(re_string)
         all_items = list(set(os.listdir(indir)) | set(collected_ins.keys()))
 
+        with self._measure('db'):
+            existing_tests = dict((test.name, test) for test in
+                    Test.objects.filter(
+                        problem_instance=self.main_problem_instance))
+            # File names are generated from the problem, which must be
+            # already fetched, as uploading threads can't use the database.
+            self.main_problem_instance.problem = self.problem
+            for test in existing_tests.itervalues():
+                test.problem_instance = self.main_problem_instance
+
         created_tests = []
         outs_to_make = []
         scored_groups = set()
+        uploads = []
 
         for order, test in enumerate(sorted(all_items, key=naturalsort_key)):
             instance = self._process_test(test, order, names_re,
                                           indir, outdir,
                                           collected_ins, scored_groups,
-                                          outs_to_make)
+                                          outs_to_make, existing_tests,
+                                          uploads)
             if instance:
                 created_tests.append(instance)
 
+        self._run_uploads(uploads)
+        self._save_tests(created_tests)
+
         return created_tests, outs_to_make, scored_groups
 
+    def _save_tests(self, tests):
+        """Saves the tests, creating the new ones with a single query."""
+        with self._measure('db'):
+            new_tests = [test for test in tests if test.id is None]
+            for test in tests:
+                if test.id is not None:
+                    test.save()
+            Test.objects.bulk_create(new_tests)
+            if any(test.id is None for test in new_tests):
+                ids = dict(Test.objects.filter(
+                        problem_instance=self.main_problem_instance,
+                        name__in=[test.name for test in new_tests])
+                        .values_list('name', 'id'))
+                for test in new_tests:
+                    test.id = ids[test.name]
+
     def _verify_time_limits(self, tests):
         """:raises: :class:`~oioioi.problems.package.ProblemPackageError`
            if sum of tests time limits exceeds
@@ -652,12 +745,23 @@ class SinolPackage(object):
 
     def _generate_test_outputs(self, tests, outs_to_make):
         if not self.use_make:
-            outs = self._make_outs(outs_to_make)
+            with self._measure('outgen'):
+                outs = self._make_outs(outs_to_make)
+            uploads = []
+            updated_tests = []
             for instance in tests:
                 if instance.name in outs:
                     generated_out = outs[instance.name]
-                    self._save_to_field(instance.output_file,
-                                        generated_out['out_file'])
+                    uploads.append(partial(self._save_to_field,
+                                           instance.output_file,
+                                           generated_out['out_file'],
+                                           save=False))
+                    updated_tests.append(instance)
+            self._run_uploads(uploads)
+            with self._measure('db'):
+                for instance in updated_tests:
+                    Test.objects.filter(id=instance.id) \
+                            .update(output_file=instance.output_file.name)
 
     def _validate_tests(self, created_tests):
         """Check if all tests have output files and that
@@ -681,9 +785,14 @@ class SinolPackage(object):
             test.delete()
 
     def _process_test(self, test, order, names_re, indir, outdir,
-            collected_ins, scored_groups, outs_to_make):
-        """Responsible for saving test in and out files,
+            collected_ins, scored_groups, outs_to_make, existing_tests,
+            uploads):
+        """Responsible for preparing test in and out files,
            setting test limits, assigning test kind and group.
+
+           The test instance is not saved, and its files are not uploaded,
+           so that it may be done for all the tests at once (see
+           :meth:`_run_uploads` and :meth:`_save_tests`).
            :param test: Test name.
            :param order: Test number.
            :param names_re: Compiled regex to match test details from name.
@@ -696,6 +805,9 @@ class SinolPackage(object):
            :param scored_groups: Accumulator for score groups.
            :param outs_to_make: Accumulator for name of output files to
                   be generated by model solution.
+           :param existing_tests: Dictionary mapping names to test instances
+                  already existing in the problem.
+           :param uploads: Accumulator for callables uploading test files.
            :return: Test instance or None if name couldn't be matched.
         """
         match = names_re.match(test)
@@ -711,8 +823,11 @@ class SinolPackage(object):
         group = match.group(3)       # 0
         suffix = match.group(4)      # ocen
 
-        instance, created = Test.objects.get_or_create(
-                problem_instance=self.main_problem_instance, name=name)
+        instance = existing_tests.get(name)
+        created = instance is None
+        if created:
+            instance = Test(problem_instance=self.main_problem_instance,
+                            name=name)
 
         inname_base = basename + '.in'
         inname = os.path.join(indir, inname_base)
@@ -720,12 +835,16 @@ class SinolPackage(object):
         outname = os.path.join(outdir, outname_base)
 
         if test in collected_ins:
-            self._save_to_field(instance.input_file, collected_ins[test])
+            uploads.append(partial(self._save_to_field, instance.input_file,
+                                   collected_ins[test], save=False))
         else:
-            instance.input_file.save(inname_base, File(open(inname, 'rb')))
+            uploads.append(partial(self._upload_to_field, instance.input_file,
+                                   inname_base, inname))
 
         if os.path.isfile(outname):
-            instance.output_file.save(outname_base, File(open(outname), 'rb'))
+            uploads.append(partial(self._upload_to_field,
+                                   instance.output_file, outname_base,
+                                   outname))
 
         outs_to_make.append((_make_filename_in_job_dir(self.env,
                 'out/%s' % (outname_base)), instance))
@@ -748,7 +867,6 @@ class SinolPackage(object):
             instance.memory_limit = memory_limit
 
         instance.order = order
-        instance.save()
         return instance
 
     def _get_memory_limit(self, created, name):
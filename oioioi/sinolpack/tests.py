@@ -340,6 +340,17 @@ class TestSinolPackage(TestCase):
         problem = Problem.objects.get()
         self._check_full_package(problem)
 
+    @override_settings(SINOLPACK_UPLOAD_CONCURRENCY=4)
+    def test_concurrent_upload_and_timings(self):
+        filename = get_test_filename('test_full_package.tgz')
+        call_command('addproblem', filename)
+        problem = Problem.objects.get()
+        self._check_full_package(problem)
+
+        info = ProblemPackage.objects.get(problem=problem).info
+        for stage in ('extract', 'ingen', 'inwer', 'outgen', 'upload', 'db'):
+            self.assertIn(stage, info)
+
     def _check_interactive_package(self, problem):
         self.assertEqual(problem.short_name, 'arc')
 
@@ -1,40 +1,121 @@
+from contextlib import contextmanager
 import json
+import multiprocessing
+import os
+import Queue
+import shutil
+import tempfile
+import time
 import sio.workers.runner
 import sio.celery.job
 
 from django.db import transaction
 from django.conf import settings
+from django.dispatch import receiver
+from django.test.signals import setting_changed
 
-from xmlrpclib import Server
+from xmlrpclib import ServerProxy, MultiCall, Fault
 
 
 # This is a workaround for SIO-915. We assume that other parts of OIOIOI code
 # do not rely on particular directory being the current directory. Without
 # this assumption, even a single call to LocalClient.build would break that
 # code.
-from threading import Lock
+from threading import Lock, BoundedSemaphore, Event
 
 from oioioi.evalmgr.tasks import delay_environ
 
 _local_backend_lock = Lock()
 
+_local_pool = None
+_local_pool_lock = Lock()
+
+
+def _init_local_worker():
+    # Makes sioworkers use the same Filetracker client as Django.
+    from oioioi.filetracker.client import get_client
+    get_client()
+
+
+def _run_job_in_own_directory(job):
+    """Runs the job in a fresh working directory, which is removed
+       afterwards. Called in a worker process of the local pool, which runs
+       only one job at a time, so changing its working directory is safe.
+    """
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='oioioi-local-job-')
+    try:
+        os.chdir(workdir)
+        return sio.workers.runner.run(job)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _get_local_pool():
+    # pylint: disable=global-statement
+    global _local_pool
+    with _local_pool_lock:
+        if _local_pool is None:
+            _local_pool = multiprocessing.Pool(
+                    settings.LOCAL_BACKEND_CONCURRENCY,
+                    initializer=_init_local_worker)
+        return _local_pool
+
+
+def _reset_local_pool():
+    """Terminates the pool of worker processes used by
+       :class:`LocalBackend`. A new one will be created when needed.
+    """
+    # pylint: disable=global-statement
+    global _local_pool
+    with _local_pool_lock:
+        if _local_pool is not None:
+            _local_pool.terminate()
+            _local_pool.join()
+            _local_pool = None
+
+
+@receiver(setting_changed)
+def _on_setting_changed(sender, setting, **kwargs):
+    if setting == 'LOCAL_BACKEND_CONCURRENCY':
+        _reset_local_pool()
+
 
 class LocalBackend(object):
-    """A simple sioworkers backend which executes the work in the calling
-       process.
+    """A simple sioworkers backend which executes the work on the local
+       machine.
+
+       If ``settings.LOCAL_BACKEND_CONCURRENCY`` is 1, jobs are run one by
+       one in the calling process. Otherwise they are run in a pool of
+       that many worker processes, each job in its own working directory,
+       and jobs with higher ``task_priority`` are started first.
 
        Perfect for tests or a single-machine OIOIOI setup.
     """
 
     def run_job(self, job, **kwargs):
+        if settings.LOCAL_BACKEND_CONCURRENCY > 1:
+            return _get_local_pool().apply(_run_job_in_own_directory, (job,))
         with _local_backend_lock:
             return sio.workers.runner.run(job)
 
     def run_jobs(self, dict_of_jobs, **kwargs):
-        results = {}
-        for key, value in dict_of_jobs.iteritems():
-            results[key] = self.run_job(value, **kwargs)
-        return results
+        if settings.LOCAL_BACKEND_CONCURRENCY <= 1:
+            results = {}
+            for key, value in dict_of_jobs.iteritems():
+                results[key] = self.run_job(value, **kwargs)
+            return results
+
+        pool = _get_local_pool()
+        keys = sorted(dict_of_jobs, key=lambda key:
+                      -dict_of_jobs[key].get('task_priority', 0))
+        async_results = [(key, pool.apply_async(_run_job_in_own_directory,
+                                                (dict_of_jobs[key],)))
+                         for key in keys]
+        return dict((key, async_result.get())
+                    for key, async_result in async_results)
+
 
     def send_async_jobs(self, env, **kwargs):
         res = self.run_jobs(env['workers_jobs'],
@@ -47,9 +128,148 @@ class LocalBackend(object):
             delay_environ(env)
 
 
+class _ServerPool(object):
+    """A thread-safe pool of XML-RPC proxies for a single sioworkersd.
+
+       Each proxy keeps its HTTP connection open between calls (HTTP/1.1
+       keep-alive is used by ``xmlrpclib``), but must not be used by more
+       than one thread at a time, so threads borrow proxies from the pool.
+    """
+
+    def __init__(self, url, size):
+        self.url = url
+        self._proxies = Queue.LifoQueue()
+        self._semaphore = BoundedSemaphore(size)
+
+    @contextmanager
+    def server(self):
+        with self._semaphore:
+            try:
+                proxy = self._proxies.get_nowait()
+            except Queue.Empty:
+                proxy = ServerProxy(self.url, allow_none=True)
+            # If the call fails for a reason other than a fault reported
+            # by sioworkersd, the connection may be broken, so the proxy is
+            # dropped.
+            broken = True
+            try:
+                yield proxy
+                broken = False
+            except Fault:
+                broken = False
+                raise
+            finally:
+                if not broken:
+                    self._proxies.put(proxy)
+
+
+class _PendingCall(object):
+    def __init__(self, argument):
+        self.argument = argument
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class _RunGroupBatcher(object):
+    """Sends ``run_group`` calls made concurrently by many threads as
+       a single ``system.multicall`` RPC.
+
+       The first thread, which has a call to make, waits for
+       ``delay`` seconds, collecting calls of other threads, and then sends
+       them all, in batches of at most ``max_batch_size`` calls.
+    """
+
+    def __init__(self, pool, max_batch_size, delay):
+        self._pool = pool
+        self._max_batch_size = max_batch_size
+        self._delay = delay
+        self._lock = Lock()
+        self._pending = []
+
+    def run_group(self, argument):
+        call = _PendingCall(argument)
+        with self._lock:
+            self._pending.append(call)
+            leader = len(self._pending) == 1
+        if leader:
+            time.sleep(self._delay)
+            with self._lock:
+                calls, self._pending = self._pending, []
+            for i in xrange(0, len(calls), self._max_batch_size):
+                self._send(calls[i:i + self._max_batch_size])
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _send(self, calls):
+        try:
+            with self._pool.server() as server:
+                if len(calls) == 1:
+                    results = [server.run_group(calls[0].argument)]
+                else:
+                    multicall = MultiCall(server)
+                    for call in calls:
+                        multicall.run_group(call.argument)
+                    results = multicall()
+                for i, call in enumerate(calls):
+                    # Results of a multicall are unpacked on access, which
+                    # raises the fault reported for the given call.
+                    try:
+                        call.result = results[i]
+                    except Fault, e:
+                        call.error = e
+        # pylint: disable=broad-except
+        except Exception, e:
+            for call in calls:
+                call.error = e
+        finally:
+            for call in calls:
+                call.done.set()
+
+
+_pools = {}
+_batchers = {}
+_pools_lock = Lock()
+
+
+def _get_pool(url):
+    with _pools_lock:
+        if url not in _pools:
+            _pools[url] = _ServerPool(url,
+                    settings.SIOWORKERSD_CONNECTION_POOL_SIZE)
+        return _pools[url]
+
+
+def _get_batcher(url):
+    pool = _get_pool(url)
+    with _pools_lock:
+        if url not in _batchers:
+            _batchers[url] = _RunGroupBatcher(pool,
+                    settings.SIOWORKERSD_MAX_BATCH_SIZE,
+                    settings.SIOWORKERSD_BATCH_DELAY)
+        return _batchers[url]
+
+
 class SioworkersdBackend(object):
-    """A backend which collaborates with sioworkersd"""
-    server = Server(settings.SIOWORKERSD_URL, allow_none=True)
+    """A backend which collaborates with sioworkersd.
+
+       The backend is thread-safe. RPCs are made through a pool of
+       persistent connections (see
+       ``settings.SIOWORKERSD_CONNECTION_POOL_SIZE``) and if
+       ``settings.SIOWORKERSD_MAX_BATCH_SIZE`` is greater than 1,
+       asynchronous jobs sent concurrently by many threads are batched
+       into a single ``system.multicall`` RPC.
+    """
+
+    def _sync_run_group(self, env):
+        with _get_pool(settings.SIOWORKERSD_URL).server() as server:
+            ans = server.sync_run_group(json.dumps(env))
+        if 'error' in ans:
+            raise RuntimeError('Error from workers:\n%s\nTB:\n%s' %
+                (ans['error']['message'], ans['error']['traceback']))
+        return ans
 
     def run_job(self, job, **kwargs):
         env = {'workers_jobs': {'dummy_name': job}}
@@ -59,10 +279,7 @@ class SioworkersdBackend(object):
             settings.NON_CONTEST_PRIORITY)
         env['contest_weight'] = (settings.OIOIOI_INSTANCE_WEIGHT_BONUS +
             settings.NON_CONTEST_WEIGHT)
-        ans = SioworkersdBackend.server.sync_run_group(json.dumps(env))
-        if 'error' in ans:
-            raise RuntimeError('Error from workers:\n%s\nTB:\n%s' %
-                (ans['error']['message'], ans['error']['traceback']))
+        ans = self._sync_run_group(env)
         return ans['workers_jobs.results']['dummy_name']
 
     def run_jobs(self, dict_of_jobs, **kwargs):
@@ -73,10 +290,7 @@ class SioworkersdBackend(object):
             settings.NON_CONTEST_PRIORITY)
         env['contest_weight'] = (settings.OIOIOI_INSTANCE_WEIGHT_BONUS +
             settings.NON_CONTEST_WEIGHT)
-        ans = SioworkersdBackend.server.sync_run_group(json.dumps(env))
-        if 'error' in ans:
-            raise RuntimeError('Error from workers:\n%s\nTB:\n%s' %
-                (ans['error']['message'], ans['error']['traceback']))
+        ans = self._sync_run_group(env)
         return ans['workers_jobs.results']
 
     def send_async_jobs(self, env, **kwargs):
@@ -85,4 +299,8 @@ class SioworkersdBackend(object):
             url = 'http://' + settings.SIOWORKERS_LISTEN_ADDR + ':' \
                 + str(settings.SIOWORKERS_LISTEN_PORT)
         env['return_url'] = url
-        SioworkersdBackend.server.run_group(json.dumps(env))
+        if settings.SIOWORKERSD_MAX_BATCH_SIZE > 1:
+            _get_batcher(settings.SIOWORKERSD_URL).run_group(json.dumps(env))
+        else:
+            with _get_pool(settings.SIOWORKERSD_URL).server() as server:
+                server.run_group(json.dumps(env))
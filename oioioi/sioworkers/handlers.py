@@ -1,7 +1,7 @@
 from oioioi.sioworkers.jobs import send_async_jobs
 
 
-_STRIPPED_FIELDS = ['recipe', 'error_handlers']
+_STRIPPED_FIELDS = ['recipe', 'error_handlers', 'workers_jobs.pending']
 
 
 def restore_job(saved_environ, resuming_environ):
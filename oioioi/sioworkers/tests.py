@@ -1,5 +1,18 @@
+import json
+import os
+import threading
+import time
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from SocketServer import ThreadingMixIn
+from xmlrpclib import Fault
+
 from django.test import TestCase
+from django.test.utils import override_settings
+
+from mock import patch
 
+from oioioi.sioworkers.backends import SioworkersdBackend, LocalBackend, \
+        _reset_local_pool, _get_pool, _PendingCall, _RunGroupBatcher
 from oioioi.sioworkers.jobs import run_sioworkers_job, run_sioworkers_jobs
 
 
@@ -13,3 +26,155 @@ class TestSioworkersBindings(TestCase):
         self.assertEqual(envs['key1'].get('pong'), 'e1')
         self.assertEqual(envs['key2'].get('pong'), 'e2')
         self.assertEqual(len(envs), 2)
+
+
+def _slow_run(job):
+    time.sleep(job['duration'])
+    return dict(job, cwd=os.getcwd(), pid=os.getpid())
+
+
+class TestLocalBackend(TestCase):
+    def tearDown(self):
+        _reset_local_pool()
+
+    def _run_jobs(self, num_jobs):
+        jobs = dict(('test%d' % i, dict(job_type='sleep', duration=0.02,
+                                        task_priority=i))
+                    for i in xrange(num_jobs))
+        start = time.time()
+        results = LocalBackend().run_jobs(jobs)
+        return results, time.time() - start
+
+    @patch('sio.workers.runner.run', _slow_run)
+    def test_concurrent_jobs(self):
+        cwd = os.getcwd()
+        num_jobs = 100
+        with override_settings(LOCAL_BACKEND_CONCURRENCY=1):
+            _results, sequential_duration = self._run_jobs(num_jobs)
+        with override_settings(LOCAL_BACKEND_CONCURRENCY=4):
+            results, concurrent_duration = self._run_jobs(num_jobs)
+            self.assertEqual(LocalBackend().run_job(
+                dict(job_type='sleep', duration=0))['job_type'], 'sleep')
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(len(results), num_jobs)
+        self.assertEqual(results['test7']['task_priority'], 7)
+        self.assertGreater(len(set(r['pid'] for r in results.values())), 1)
+        workdirs = set(r['cwd'] for r in results.values())
+        self.assertEqual(len(workdirs), num_jobs)
+        self.assertNotIn(cwd, workdirs)
+        for workdir in workdirs:
+            self.assertFalse(os.path.exists(workdir))
+        self.assertLess(concurrent_duration, sequential_duration / 2)
+
+
+class _KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        SimpleXMLRPCRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+
+class FakeSioworkersd(ThreadingMixIn, SimpleXMLRPCServer):
+    """A stand-in for sioworkersd, which answers ``ping`` jobs."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        SimpleXMLRPCServer.__init__(self, ('127.0.0.1', 0),
+                requestHandler=_KeepAliveRequestHandler, logRequests=False)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.envs = []
+        self.register_function(self.run_group, 'run_group')
+        self.register_function(self.sync_run_group, 'sync_run_group')
+        self.register_multicall_functions()
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % self.server_address
+
+    def run_group(self, env):
+        env = json.loads(env)
+        if env.get('fail'):
+            raise ValueError('failed')
+        with self.lock:
+            self.envs.append(env)
+        return 'ok'
+
+    def sync_run_group(self, env):
+        env = json.loads(env)
+        env['workers_jobs.results'] = dict(
+                (name, dict(job, pong=job.get('ping')))
+                for name, job in env['workers_jobs'].iteritems())
+        return env
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class TestSioworkersdBackend(TestCase):
+    def _send_async_jobs(self, num_threads, jobs_per_thread):
+        def send():
+            backend = SioworkersdBackend()
+            for i in xrange(jobs_per_thread):
+                backend.send_async_jobs({'workers_jobs': {'test': {}}})
+
+        threads = [threading.Thread(target=send)
+                   for _i in xrange(num_threads)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start
+
+    def test_connection_reuse(self):
+        with FakeSioworkersd() as sioworkersd:
+            with override_settings(SIOWORKERSD_URL=sioworkersd.url):
+                backend = SioworkersdBackend()
+                for i in xrange(20):
+                    env = backend.run_job(dict(job_type='ping', ping=i))
+                    self.assertEqual(env['pong'], i)
+                self._send_async_jobs(8, 10)
+        self.assertEqual(len(sioworkersd.envs), 80)
+        self.assertLessEqual(sioworkersd.connections, 4)
+
+    @override_settings(SIOWORKERSD_MAX_BATCH_SIZE=50,
+                       SIOWORKERSD_BATCH_DELAY=0.01)
+    def test_batching_throughput(self):
+        num_threads, jobs_per_thread = 16, 50
+        with FakeSioworkersd() as sioworkersd:
+            with override_settings(SIOWORKERSD_URL=sioworkersd.url):
+                duration = self._send_async_jobs(num_threads,
+                                                 jobs_per_thread)
+        num_jobs = num_threads * jobs_per_thread
+        self.assertEqual(len(sioworkersd.envs), num_jobs)
+        for env in sioworkersd.envs:
+            self.assertIn('return_url', env)
+        # At least 1000 submissions per minute.
+        self.assertLess(duration, num_jobs * 60. / 1000)
+
+    def test_fault_in_batch(self):
+        calls = [_PendingCall(json.dumps({'fail': fail}))
+                 for fail in (False, True, False, True, False)]
+        with FakeSioworkersd() as sioworkersd:
+            batcher = _RunGroupBatcher(_get_pool(sioworkersd.url), 10, 0)
+            batcher._send(calls)
+        self.assertEqual(len(sioworkersd.envs), 3)
+        self.assertEqual([call.result for call in calls],
+                         ['ok', None, 'ok', None, 'ok'])
+        for call in calls:
+            self.assertTrue(call.done.is_set())
+            if call.result is None:
+                self.assertIsInstance(call.error, Fault)
+            else:
+                self.assertIsNone(call.error)
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from oioioi.contests.models import Round, RoundTimeExtension
+from oioioi.status.utils import invalidate_contest_status
+
+
+@receiver([post_save, post_delete], sender=Round)
+def _round_changed(sender, instance, **kwargs):
+    invalidate_contest_status(instance.contest_id)
+
+
+@receiver([post_save, post_delete], sender=RoundTimeExtension)
+def _round_time_extension_changed(sender, instance, **kwargs):
+    invalidate_contest_status(instance.round.contest_id)
@@ -6,6 +6,7 @@ $(function(){
     var sync_time = 300000 + (Math.random() * 60000) | 0;
     var sync_interval;
     var status_url = oioioi_base_url + 'status';
+    var last_data = null;
 
     var update_status_promise = function() {
         var data = null;
@@ -23,8 +24,22 @@ $(function(){
             }, FAIL_PROMISE_WAIT_TIME);
         });
 
-        var json_request = $.getJSON(status_url, function(aData) {
-            data = aData;
+        // The server answers "304 Not Modified" when the status hasn't
+        // changed. The current time is always sent in a header, as
+        // the browser may also use a cached body.
+        var json_request = $.ajax({
+            url: status_url,
+            dataType: 'json',
+            ifModified: true,
+            success: function(aData, textStatus, jqXHR) {
+                aData = $.extend({}, textStatus === 'notmodified' ?
+                                     last_data : aData);
+                var time = jqXHR.getResponseHeader('X-Status-Time');
+                if (time !== null) {
+                    aData.time = JSON.parse(time);
+                }
+                data = last_data = aData;
+            }
         });
 
         $.when(json_request)
@@ -1,10 +1,18 @@
 import json
+from datetime import datetime
 
+from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
+from django.test import RequestFactory
+from django.utils.timezone import utc
+from mock import Mock
 
 from oioioi.base.tests import TestCase
-from oioioi.contests.models import Contest
+from oioioi.contests.models import Contest, Round
 from oioioi.status.registry import status_registry
+from oioioi.status.utils import get_contest_status_data, \
+        get_user_status_data, invalidate_contest_status, \
+        invalidate_user_status
 
 
 def _coding_status(request, response):
@@ -57,6 +65,27 @@ class TestContestStatus(TestCase):
         self.assertContains(response, 'testing an app')
         self.assertContains(response, 'initialStatus')
 
+    def test_not_modified(self):
+        contest = Contest.objects.get()
+        url = reverse('get_status', kwargs={'contest_id': contest.id})
+
+        self.client.login(username='test_user')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertAlmostEqual(float(response['X-Status-Time']),
+                               json.loads(self.client.get(url).content)['time'],
+                               delta=10)
+
+        self.client.login(username='test_admin')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
 
 class TestNoContestStatus(TestCase):
     fixtures = ['test_users']
@@ -77,3 +106,53 @@ class TestNoContestStatus(TestCase):
         self.assertNotContains(response, 'contest_id')
         self.assertContains(response, 'test_user')
         self.assertContains(response, 'testing an app')
+
+
+class TestStatusCache(TestCase):
+    fixtures = ['test_users', 'test_contest']
+
+    def _request(self, username):
+        request = RequestFactory().get('/')
+        request.contest = Contest.objects.get()
+        request.user = User.objects.get(username=username)
+        return request
+
+    def test_contest_status_data(self):
+        contest = Contest.objects.get()
+        generator = Mock(return_value=None)
+
+        get_contest_status_data(contest, 'test', generator)
+        get_contest_status_data(contest, 'test', generator)
+        self.assertEqual(generator.call_count, 1)
+        generator.assert_called_with(contest)
+
+        invalidate_contest_status(contest.id)
+        get_contest_status_data(contest, 'test', generator)
+        self.assertEqual(generator.call_count, 2)
+
+        Round.objects.create(contest=contest, name='new round',
+                start_date=datetime(2012, 1, 1, tzinfo=utc))
+        get_contest_status_data(contest, 'test', generator)
+        self.assertEqual(generator.call_count, 3)
+
+    def test_user_status_data(self):
+        request = self._request('test_user')
+        generator = Mock(side_effect=lambda request: request.user.username)
+
+        self.assertEqual(get_user_status_data(request, 'test', generator),
+                         'test_user')
+        self.assertEqual(get_user_status_data(request, 'test', generator),
+                         'test_user')
+        self.assertEqual(generator.call_count, 1)
+        self.assertEqual(get_user_status_data(self._request('test_user2'),
+                                              'test', generator),
+                         'test_user2')
+        self.assertEqual(get_user_status_data(request, 'test', generator,
+                                              key=(1,)),
+                         'test_user')
+        self.assertEqual(generator.call_count, 3)
+
+        invalidate_user_status(request.contest.id, request.user.id)
+        get_user_status_data(request, 'test', generator)
+        get_user_status_data(self._request('test_user2'), 'test', generator)
+        self.assertEqual(generator.call_count, 4)
@@ -1,9 +1,21 @@
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 
 from oioioi.base.permissions import is_superuser
 from oioioi.status.registry import status_registry
 
 
+# Keys of the status, which change on every request and so are left out
+# of its ETag. They are sent in ``X-Status-<Key>`` headers of
+# ``304 Not Modified`` responses.
+VOLATILE_STATUS_KEYS = ('time',)
+
+
 def get_status(request):
     """Returns dict composed by ``status_registry`` functions."""
     response = {
@@ -21,3 +33,84 @@ def get_status(request):
         response = fun(request, response)
 
     return response
+
+
+def get_status_etag(status):
+    """Returns the ETag of the status, which doesn't depend on
+       :data:`VOLATILE_STATUS_KEYS`.
+    """
+    stable = dict((k, v) for k, v in status.iteritems()
+                  if k not in VOLATILE_STATUS_KEYS)
+    return hashlib.md5(json.dumps(stable, sort_keys=True)).hexdigest()
+
+
+def _contest_version_key(contest_id):
+    return 'status_version:%s' % (contest_id,)
+
+
+def _user_version_key(contest_id, user_id):
+    return 'status_version:%s:%s' % (contest_id, user_id)
+
+
+def _get_versions(keys):
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def invalidate_contest_status(contest_id):
+    """Invalidates all the data cached by :func:`get_contest_status_data`
+       and :func:`get_user_status_data` for the contest.
+    """
+    cache.set(_contest_version_key(contest_id), uuid.uuid4().hex, None)
+
+
+def invalidate_user_status(contest_id, user_id):
+    """Invalidates the data cached by :func:`get_user_status_data` for
+       the user in the contest.
+    """
+    cache.set(_user_version_key(contest_id, user_id), uuid.uuid4().hex,
+              None)
+
+
+def _cached(key, generator):
+    # The value is wrapped, so that ``None`` may be cached too.
+    value = cache.get(key)
+    if value is None:
+        value = (generator(),)
+        cache.set(key, value, settings.STATUS_CACHE_TIMEOUT)
+    return value[0]
+
+
+def get_contest_status_data(contest, name, generator):
+    """Returns ``generator(contest)``, computed once and shared by all
+       the users of the contest.
+
+       The result is cached until :func:`invalidate_contest_status` is
+       called, but for at most ``settings.STATUS_CACHE_TIMEOUT`` seconds.
+       It must not depend on the request.
+    """
+    version, = _get_versions([_contest_version_key(contest.id)])
+    return _cached('status:%s:%s:%s' % (contest.id, version, name),
+                   lambda: generator(contest))
+
+
+def get_user_status_data(request, name, generator, key=()):
+    """Returns ``generator(request)``, cached for the user doing
+       the request.
+
+       The result is cached until :func:`invalidate_contest_status` or
+       :func:`invalidate_user_status` is called, but for at most
+       ``settings.STATUS_CACHE_TIMEOUT`` seconds. If it depends on
+       anything more than the user and the contest, the additional
+       values must be passed in ``key``.
+    """
+    contest_id = request.contest.id
+    versions = _get_versions([_contest_version_key(contest_id),
+            _user_version_key(contest_id, request.user.id)])
+    return _cached('status:%s:%s:%s:%s:%s' % (contest_id, request.user.id,
+                   ':'.join(versions), name, ':'.join(map(str, key))),
+                   lambda: generator(request))
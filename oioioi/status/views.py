@@ -1,7 +1,25 @@
-from oioioi.status.utils import get_status
-from oioioi.base.utils import jsonify
+import json
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+from oioioi.status.utils import get_status, get_status_etag, \
+        VOLATILE_STATUS_KEYS
 
 
-@jsonify
 def get_status_view(request):
-    return get_status(request)
+    status = get_status(request)
+    etag = get_status_etag(status)
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(json.dumps(status),
+                                content_type='application/json')
+    # Browsers may serve the body of a not modified response from their
+    # cache, so the volatile values are always sent in headers too.
+    for key in VOLATILE_STATUS_KEYS:
+        if key in status:
+            response['X-Status-' + key.capitalize()] = json.dumps(status[key])
+    response['ETag'] = quote_etag(etag)
+    response['Cache-Control'] = 'no-cache, private'
+    return response